@@ -9,7 +9,92 @@
   .. moduleauthor:: Tim Evens <tim@evensweb.com>
 """
 import psycopg2 as py
-from time import time
+import threading
+import traceback
+import zlib
+from queue import Queue
+from time import time, sleep
+
+#: Max number of times to try to reconnect before giving up
+MAX_RECONNECT_ATTEMPTS = 8
+
+#: Initial and max delay in seconds between reconnect attempts, doubled after each attempt
+RECONNECT_DELAY_MIN = 1
+RECONNECT_DELAY_MAX = 60
+
+#: Max number of times to replay a statement that failed due to a lost connection or deadlock
+MAX_REPLAY_ATTEMPTS = 3
+
+#: Max number of batches queued to a writer before adding more batches blocks
+WRITER_QUEUE_SIZE = 4
+
+#: Translation table to escape values for COPY text format
+COPY_ESCAPE = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\x00': ''})
+
+
+def copyValue(value):
+    """ Encode a single value into COPY text format
+
+        :param value:   Value to encode, None is encoded as NULL
+
+        :return: Encoded string value
+    """
+    if value is None:
+        return '\\N'
+
+    return str(value).translate(COPY_ESCAPE)
+
+
+def tempTableName(prefix, tableName, columns):
+    """ Name of the temp table used to stage rows for a table
+
+        Temp tables are kept for the session and keep the columns they were created
+        with, so the column set is part of the name.
+
+        :param prefix:      Name prefix, such as tmp_copy
+        :param tableName:   Target table name
+        :param columns:     List of column names
+
+        :return: Temp table name
+    """
+    return "%s_%s_%08x" % (prefix, tableName.replace('.', '_'), zlib.crc32(','.join(columns).encode()))
+
+
+class copyStream:
+    """ File like object that encodes row tuples into COPY text format as it is read
+
+        This is used with cursor.copy_expert() so that the rows are streamed to
+        postgres without building the complete COPY buffer first.
+    """
+
+    def __init__(self, rows):
+        """
+            :param rows:    Iterable of row tuples
+        """
+        self.rows = iter(rows)
+        self.buf = ""
+
+    def read(self, size=-1):
+        lines = [self.buf]
+        length = len(self.buf)
+
+        for row in self.rows:
+            line = '\t'.join([copyValue(v) for v in row]) + '\n'
+            lines.append(line)
+            length += len(line)
+
+            if (size >= 0 and length >= size):
+                break
+
+        data = ''.join(lines)
+
+        if (size < 0):
+            self.buf = ""
+            return data
+
+        self.buf = data[size:]
+        return data[:size]
+
 
 class dbHandler:
     """ Database handler class
@@ -26,6 +111,12 @@ class dbHandler:
     #: Last query time in seconds (floating point)
     last_query_time = 0
 
+    #: Number of named cursors created, used to generate unique cursor names
+    cursor_count = 0
+
+    #: Connect parameters (user, pw, host, database), used to reconnect
+    connect_params = None
+
     def __init__(self):
         pass
 
@@ -33,6 +124,8 @@ class dbHandler:
         """
          Connect to database
         """
+        self.connect_params = (user, pw, host, database)
+
         try:
             self.conn = py.connect(user=user, password=pw,
                                host=host,
@@ -54,6 +147,87 @@ class dbHandler:
             self.conn.close()
             self.conn = None
 
+    def isConnected(self):
+        """ Health check of the connection
+
+            ..note:: Any open transaction is rolled back
+
+            :return: True if the connection is usable, False otherwise
+        """
+        if (not self.conn or self.conn.closed):
+            return False
+
+        try:
+            self.conn.rollback()
+            self.cursor.execute("SELECT 1")
+            self.cursor.fetchall()
+            return True
+
+        except (py.OperationalError, py.InterfaceError):
+            return False
+
+    def reconnect(self):
+        """ Reconnect to the database using exponential backoff between attempts
+
+            Raises OperationalError if unable to reconnect after MAX_RECONNECT_ATTEMPTS.
+        """
+        delay = RECONNECT_DELAY_MIN
+
+        for attempt in range(1, MAX_RECONNECT_ATTEMPTS + 1):
+            try:
+                self.close()
+            except py.Error:
+                self.cursor = None
+                self.conn = None
+
+            try:
+                self.connectDb(*self.connect_params)
+                print("Reconnected to psql after %d attempt(s)" % attempt)
+                return
+
+            except py.OperationalError as err:
+                print("ERROR: Reconnect attempt %d of %d failed, retry in %d seconds - %s" % (
+                    attempt, MAX_RECONNECT_ATTEMPTS, delay, str(err).strip()))
+                sleep(delay)
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
+
+        raise py.OperationalError("Unable to reconnect to psql after %d attempts" % MAX_RECONNECT_ATTEMPTS)
+
+    def replay(self, func, *args):
+        """ Run func and replay it if the connection is lost or the transaction is rolled back
+
+            The connection is reestablished before replaying.  Errors other than a lost
+            connection or a deadlock/serialization failure are raised as is.
+
+            :param func:    Function that runs the statement(s) and commits
+            :param args:    Arguments to pass to func
+
+            :return: Value returned by func
+        """
+        attempt = 0
+
+        while True:
+            try:
+                return func(*args)
+
+            except (py.OperationalError, py.InterfaceError) as err:
+                attempt += 1
+
+                if (self.isConnected()):
+                    if (not isinstance(err, py.extensions.TransactionRollbackError)
+                            or attempt > MAX_REPLAY_ATTEMPTS):
+                        raise err
+
+                    print("WARN: Transaction rolled back, replaying (%d) - %s" % (attempt, str(err).strip()))
+                    sleep(attempt)
+
+                else:
+                    if (attempt > MAX_REPLAY_ATTEMPTS):
+                        raise err
+
+                    print("ERROR: Lost connection to psql, reconnecting - %s" % str(err).strip())
+                    self.reconnect()
+
     def createTable(self, tableName, tableSchema, dropIfExists = True):
         """ Create table schema
 
@@ -119,30 +293,87 @@ class dbHandler:
             print("ERROR: Looks like psql is not connected, try to reconnect")
             return None
 
+        try:
+            return self.replay(self._query, query, queryParams)
+
+        except py.ProgrammingError as err:
+            print("ERROR: query failed - " + str(err))
+            return None
+
+    def _query(self, query, queryParams):
+        startTime = time()
+
+        if (queryParams):
+            self.cursor.execute(query % queryParams)
+        else:
+            self.cursor.execute(query)
+
+        self.last_query_time = time() - startTime
+
+        rows = []
+
+        while (True):
+            result = self.cursor.fetchmany(size=10000)
+            if (len(result) > 0):
+                rows += result
+            else:
+                break
+
+        return rows
+
+    def queryIter(self, query, queryParams=None, batchSize=10000):
+        """ Run a query and yield the result rows as they are fetched
+
+            A named (server side) cursor is used so that only batchSize rows are held in
+            memory at a time.  The cursor lives in the read transaction, so no other query
+            can run on this connection until the iteration ends.  Use a dbHandler that is
+            only for the read, the writes (and their replay/reconnect) go through another.
+            If the connection is lost, the error is printed and the iteration ends.
+
+            :param query:       The query to run - should be a working SELECT statement
+            :param queryParams: Dictionary of parameters to supply to the query for
+                                variable substitution
+            :param batchSize:   Number of rows to fetch from the server at a time
+
+            :return: Generator of rows, nothing is yielded if error
+        """
+        if (not self.conn):
+            print("ERROR: Looks like psql is not connected, try to reconnect")
+            return
+
+        self.cursor_count += 1
+        cursor = self.conn.cursor(name="query_iter_%d" % self.cursor_count)
+        cursor.itersize = batchSize
+
         try:
             startTime = time()
 
             if (queryParams):
-                self.cursor.execute(query % queryParams)
+                cursor.execute(query % queryParams)
             else:
-                self.cursor.execute(query)
+                cursor.execute(query)
 
             self.last_query_time = time() - startTime
 
-            rows = []
-
-            while (True):
-                result = self.cursor.fetchmany(size=10000)
-                if (len(result) > 0):
-                    rows += result
-                else:
-                    break
+            for row in cursor:
+                yield row
 
-            return rows
+            # End the read transaction
+            self.conn.commit()
 
         except py.ProgrammingError as err:
             print("ERROR: query failed - " + str(err))
-            return None
+            self.conn.rollback()
+
+        except (py.OperationalError, py.InterfaceError) as err:
+            print("ERROR: Lost connection to psql while fetching rows - %s" % str(err).strip())
+            return
+
+        finally:
+            try:
+                cursor.close()
+            except py.Error:
+                pass
 
     def queryNoResults(self, query, queryParams=None):
         """ Runs a query that would normally not have any results, such as insert, update, delete
@@ -158,20 +389,425 @@ class dbHandler:
             return None
 
         try:
-            startTime = time()
+            return self.replay(self._queryNoResults, query, queryParams)
 
-            if (queryParams):
-                self.cursor.execute(query % queryParams)
-            else:
-                self.cursor.execute(query)
+        except py.ProgrammingError as err:
+            print("ERROR: query failed - " + str(err))
+            #print("   QUERY: %s", query)
+            self.conn.rollback()
+            return None
 
-            self.conn.commit()
+    def _queryNoResults(self, query, queryParams):
+        startTime = time()
 
-            self.last_query_time = time() - startTime
+        if (queryParams):
+            self.cursor.execute(query % queryParams)
+        else:
+            self.cursor.execute(query)
 
-            return True
+        self.conn.commit()
 
-        except py.ProgrammingError as err:
-            print("ERROR: query failed - " + str(err))
-            #print("   QUERY: %s", query)
+        self.last_query_time = time() - startTime
+
+        return True
+
+    def bulkCopy(self, tableName, columns, rows):
+        """ Bulk insert rows directly into a table using COPY FROM STDIN
+
+            There is no conflict handling, so this is intended for loading staging
+            tables that do not have unique constraints.
+
+            :param tableName:   Target table name
+            :param columns:     List of column names, in the same order as the row values
+            :param rows:        Iterable of row tuples
+
+            :return: Returns True if successful, None if not.
+        """
+        if (not self.cursor):
+            print("ERROR: Looks like psql is not connected, try to reconnect")
+            return None
+
+        # Rows are replayed if the connection is lost, so an iterator cannot be used as is
+        if (iter(rows) is rows):
+            rows = list(rows)
+
+        try:
+            return self.replay(self._bulkCopy, tableName, columns, rows)
+
+        except (py.ProgrammingError, py.DataError) as err:
+            print("ERROR: bulk copy failed - " + str(err))
+            self.conn.rollback()
+            return None
+
+    def _bulkCopy(self, tableName, columns, rows):
+        startTime = time()
+
+        self.cursor.copy_expert("COPY %s (%s) FROM STDIN" % (tableName, ','.join(columns)), copyStream(rows))
+        self.conn.commit()
+
+        self.last_query_time = time() - startTime
+
+        return True
+
+    def bulkDelete(self, tableName, columns, rows):
+        """ Bulk delete rows using COPY FROM STDIN
+
+            The row keys are copied into a temp table, which is then joined with the
+            target table to delete the matching rows.
+
+            :param tableName:   Target table name
+            :param columns:     List of key column names, in the same order as the row values
+            :param rows:        Iterable of row key tuples
+
+            :return: Returns True if successful, None if not.
+        """
+        if (not self.cursor):
+            print("ERROR: Looks like psql is not connected, try to reconnect")
             return None
+
+        # Rows are replayed if the connection is lost, so an iterator cannot be used as is
+        if (iter(rows) is rows):
+            rows = list(rows)
+
+        try:
+            return self.replay(self._bulkDelete, tableName, columns, rows)
+
+        except (py.ProgrammingError, py.DataError) as err:
+            print("ERROR: bulk delete failed - " + str(err))
+            self.conn.rollback()
+            return None
+
+    def _bulkDelete(self, tableName, columns, rows):
+        tmpTable = tempTableName("tmp_delete", tableName, columns)
+        cols = ','.join(columns)
+
+        startTime = time()
+
+        self.cursor.execute(("CREATE TEMP TABLE IF NOT EXISTS %s ON COMMIT DELETE ROWS AS "
+                             "  SELECT %s FROM %s WITH NO DATA") % (tmpTable, cols, tableName))
+
+        self.cursor.copy_expert("COPY %s (%s) FROM STDIN" % (tmpTable, cols), copyStream(rows))
+
+        self.cursor.execute("DELETE FROM %s t USING %s d WHERE %s" % (
+            tableName, tmpTable, ' AND '.join(["t.%s = d.%s" % (c, c) for c in columns])))
+        self.conn.commit()
+
+        self.last_query_time = time() - startTime
+
+        return True
+
+    def bulkUpsert(self, tableName, columns, rows, conflict="", distinctOn=None):
+        """ Bulk insert/upsert rows using COPY FROM STDIN
+
+            Rows are copied into a temp table that has the same column types as the
+            target table.  The temp table is then merged into the target table using
+            INSERT ... SELECT so that the normal ON CONFLICT handling applies.
+
+            :param tableName:   Target table name
+            :param columns:     List of column names, in the same order as the row values
+            :param rows:        Iterable of row tuples
+            :param conflict:    ON CONFLICT clause to apply when merging, empty for none
+            :param distinctOn:  List of columns to de-duplicate the rows by, None to not de-dup
+
+            :return: Returns True if successful, None if not.
+        """
+        if (not self.cursor):
+            print("ERROR: Looks like psql is not connected, try to reconnect")
+            return None
+
+        # Rows are replayed if the connection is lost, so an iterator cannot be used as is
+        if (iter(rows) is rows):
+            rows = list(rows)
+
+        try:
+            return self.replay(self._bulkUpsert, tableName, columns, rows, conflict, distinctOn)
+
+        except (py.ProgrammingError, py.DataError, py.IntegrityError) as err:
+            print("ERROR: bulk upsert failed - " + str(err))
+            self.conn.rollback()
+            return None
+
+    def _bulkUpsert(self, tableName, columns, rows, conflict, distinctOn):
+        tmpTable = tempTableName("tmp_copy", tableName, columns)
+        cols = ','.join(columns)
+
+        startTime = time()
+
+        self.cursor.execute(("CREATE TEMP TABLE IF NOT EXISTS %s ON COMMIT DELETE ROWS AS "
+                             "  SELECT %s FROM %s WITH NO DATA") % (tmpTable, cols, tableName))
+
+        self.cursor.copy_expert("COPY %s (%s) FROM STDIN" % (tmpTable, cols), copyStream(rows))
+
+        query = "INSERT INTO %s (%s) SELECT " % (tableName, cols)
+
+        if (distinctOn):
+            query += "DISTINCT ON (%s) " % ','.join(distinctOn)
+
+        query += "%s FROM %s %s" % (cols, tmpTable, conflict)
+
+        self.cursor.execute(query)
+        self.conn.commit()
+
+        self.last_query_time = time() - startTime
+
+        return True
+
+
+class dbWriter(threading.Thread):
+    """ Write-behind database writer
+
+        Writes are queued to a bounded queue and run in order by this thread, using its
+        own database connection.  This allows the caller to continue parsing while the
+        previous batch is written.  Queueing blocks when the queue is full, which limits
+        the memory used when parsing is faster than the database.
+
+        The write methods match dbHandler, so a writer can be passed in place of a dbHandler
+        to functions that only write.
+    """
+
+    def __init__(self, user, pw, host, database, queueSize=WRITER_QUEUE_SIZE):
+        """
+            :param user:        Database username
+            :param pw:          Database password
+            :param host:        Database host
+            :param database:    Database name
+            :param queueSize:   Max number of queued batches
+        """
+        threading.Thread.__init__(self, daemon=True)
+
+        self.db = dbHandler()
+        self.db.connectDb(user, pw, host, database)
+
+        self.queue = Queue(maxsize=queueSize)
+
+        #: Exception raised by the last failed write, None if no error
+        self.error = None
+
+        #: Number of rows written
+        self.rows = 0
+
+        #: Number of batches that failed and were skipped
+        self.failed = 0
+
+        #: Time in seconds spent writing (floating point)
+        self.write_time = 0
+
+        self.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+
+            try:
+                if (item is None):
+                    return
+
+                (method, args) = item
+
+                startTime = time()
+
+                if (getattr(self.db, method)(*args)):
+                    if (method != 'queryNoResults'):
+                        self.rows += len(args[2])
+
+                elif (method == 'queryNoResults'):
+                    # Failed batches are skipped, but later writes may depend on a failed query
+                    raise Exception("query failed: %s" % args[0])
+
+                else:
+                    self.failed += 1
+
+                self.write_time += time() - startTime
+
+            except Exception as err:
+                print("ERROR: writer failed - " + str(err))
+                traceback.print_exc()
+                self.error = err
+
+            finally:
+                self.queue.task_done()
+
+    def checkError(self):
+        """ Raise the exception of a failed write in the caller thread """
+        if (self.error):
+            err = self.error
+            self.error = None
+            raise err
+
+    def bulkUpsert(self, tableName, columns, rows, conflict="", distinctOn=None):
+        """ Queue rows to be upserted, see dbHandler.bulkUpsert()
+
+            The rows are copied, so the caller can reuse/clear rows after this returns.
+
+            :return: True once queued
+        """
+        self.checkError()
+        self.queue.put(('bulkUpsert', (tableName, columns, list(rows), conflict, distinctOn)))
+        return True
+
+    def bulkCopy(self, tableName, columns, rows):
+        """ Queue rows to be copied, see dbHandler.bulkCopy()
+
+            The rows are copied, so the caller can reuse/clear rows after this returns.
+
+            :return: True once queued
+        """
+        self.checkError()
+        self.queue.put(('bulkCopy', (tableName, columns, list(rows))))
+        return True
+
+    def bulkDelete(self, tableName, columns, rows):
+        """ Queue row keys to be deleted, see dbHandler.bulkDelete()
+
+            The rows are copied, so the caller can reuse/clear rows after this returns.
+
+            :return: True once queued
+        """
+        self.checkError()
+        self.queue.put(('bulkDelete', (tableName, columns, list(rows))))
+        return True
+
+    def queryNoResults(self, query, queryParams=None):
+        """ Queue a query to run after the previously queued writes, see dbHandler.queryNoResults()
+
+            :return: True once queued
+        """
+        self.checkError()
+        self.queue.put(('queryNoResults', (query, queryParams)))
+        return True
+
+    def flush(self):
+        """ Wait for all queued writes to complete """
+        self.queue.join()
+        self.checkError()
+
+    def close(self):
+        """ Flush the queue, stop the writer thread and close its connection """
+        self.queue.put(None)
+        self.join()
+        self.db.close()
+        self.checkError()
+
+
+class dbWriterPool:
+    """ Pool of write-behind database writers
+
+        Each writer has its own connection.  Rows are partitioned to the writers by the
+        hash of their key, so concurrent upserts never touch the same key.  Each partition
+        is sorted by key so that rows are always locked in the same order.
+    """
+
+    def __init__(self, user, pw, host, database, writers=1, queueSize=WRITER_QUEUE_SIZE):
+        """
+            :param user:        Database username
+            :param pw:          Database password
+            :param host:        Database host
+            :param database:    Database name
+            :param writers:     Number of writers/connections
+            :param queueSize:   Max number of queued batches per writer
+        """
+        self.writers = [dbWriter(user, pw, host, database, queueSize) for i in range(max(1, writers))]
+        self.start_time = time()
+        self.next_writer = 0
+
+    def nextWriter(self):
+        """ Returns the next writer, round robin """
+        writer = self.writers[self.next_writer]
+        self.next_writer = (self.next_writer + 1) % len(self.writers)
+        return writer
+
+    def bulkUpsert(self, tableName, columns, rows, conflict="", distinctOn=None, keyColumns=None):
+        """ Partition rows by key and queue them to the writers, see dbHandler.bulkUpsert()
+
+            :param keyColumns:  Columns that make up the row key, defaults to distinctOn.
+                                Rows are not partitioned if there are no key columns.
+
+            :return: True once queued
+        """
+        keyColumns = keyColumns or distinctOn
+
+        if (not keyColumns or len(self.writers) == 1):
+            return self.writers[0].bulkUpsert(tableName, columns, rows, conflict, distinctOn)
+
+        for idx, partition in enumerate(self.partition(columns, rows, keyColumns)):
+            if (len(partition)):
+                self.writers[idx].bulkUpsert(tableName, columns, partition, conflict, distinctOn)
+
+        return True
+
+    def bulkDelete(self, tableName, columns, rows):
+        """ Partition row keys and queue them to the writers, see dbHandler.bulkDelete()
+
+            :return: True once queued
+        """
+        if (len(self.writers) == 1):
+            return self.writers[0].bulkDelete(tableName, columns, rows)
+
+        for idx, partition in enumerate(self.partition(columns, rows, columns)):
+            if (len(partition)):
+                self.writers[idx].bulkDelete(tableName, columns, partition)
+
+        return True
+
+    def partition(self, columns, rows, keyColumns):
+        """ Partition rows by the hash of their key, one partition per writer
+
+            :param columns:     List of column names, in the same order as the row values
+            :param rows:        Iterable of row tuples
+            :param keyColumns:  Columns that make up the row key
+
+            :return: List of partitions, each a list of rows sorted by key
+        """
+        keyIdx = [columns.index(c) for c in keyColumns]
+        partitions = [[] for w in self.writers]
+
+        for row in rows:
+            key = tuple([row[i] for i in keyIdx])
+            partitions[hash(key) % len(self.writers)].append((key, row))
+
+        for idx, partition in enumerate(partitions):
+            partition.sort(key=lambda r: r[0])
+            partitions[idx] = [r[1] for r in partition]
+
+        return partitions
+
+    def bulkCopy(self, tableName, columns, rows):
+        """ Queue rows to be copied by the next writer, see dbHandler.bulkCopy()
+
+            :return: True once queued
+        """
+        return self.nextWriter().bulkCopy(tableName, columns, rows)
+
+    def queryNoResults(self, query, queryParams=None):
+        """ Queue a query to the next writer, see dbHandler.queryNoResults()
+
+            Queries run in parallel with the writes and queries queued to the other writers.
+            Call flush() first if the query depends on the previously queued writes.
+
+            :return: True once queued
+        """
+        return self.nextWriter().queryNoResults(query, queryParams)
+
+    def flush(self):
+        """ Wait for all queued writes to complete """
+        for writer in self.writers:
+            writer.flush()
+
+    def failed(self):
+        """ Returns the number of batches that failed and were skipped by all writers """
+        return sum([w.failed for w in self.writers])
+
+    def close(self):
+        """ Flush, stop all writers and print the per-writer throughput """
+        elapsed = time() - self.start_time
+
+        for idx, writer in enumerate(self.writers):
+            writer.close()
+
+            print("Writer %d: %d rows, %.1f seconds writing, %d rows/sec" % (
+                idx, writer.rows, writer.write_time,
+                writer.rows / writer.write_time if writer.write_time else 0))
+
+        total = sum([w.rows for w in self.writers])
+        print("Writers total: %d rows in %.1f seconds, %d rows/sec" % (
+            total, elapsed, total / elapsed if elapsed else 0))
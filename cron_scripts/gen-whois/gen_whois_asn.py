@@ -4,16 +4,23 @@
 
   .. moduleauthor:: Tim Evens <tim@evensweb.com>
 """
+import asyncio
 import sys
 import getopt
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import dbHandler
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import OrderedDict
-from time import sleep
-import subprocess
 import dns.resolver
+from whoisClient import whoisClient, WHOIS_CONCURRENCY, WHOIS_TIMEOUT, WHOIS_RATE
+from whoisScheduler import whoisScheduler
+from rirDelegations import rirDelegations
+from rdapClient import rdapClient
+import requests
 
 TBL_GEN_WHOIS_ASN_NAME = "info_asn"
+TBL_ASN_LOOKUP_NAME = "info_asn_lookup"
 
 # ----------------------------------------------------------------
 # Whois mapping
@@ -63,39 +70,188 @@ WHOIS_SOURCES['afrinic'] =  "whois.afrinic.net"
 WHOIS_SOURCES['lacnic'] = "whois.lacnic.net"
 WHOIS_SOURCES['ntt'] =  "rr.ntt.net"
 
+#: Source name by whois hostname, used to name the source of a referred response
+WHOIS_HOST_SOURCES = {host: source for (source, host) in WHOIS_SOURCES.items()}
+
+#: Max number of ASN lookups in progress, queued or querying
+MAX_PENDING_LOOKUPS = 1000
+
+#: Lookup engines
+ENGINES = ('whois', 'rdap')
+
+# ----------------------------------------------------------------
+# Team Cymru bulk whois
+# ----------------------------------------------------------------
+CYMRU_WHOIS_HOST = "whois.cymru.com"
+CYMRU_WHOIS_PORT = 43
+
+#: Number of ASN's to query in one bulk session
+CYMRU_BULK_SIZE = 10000
+
+#: Timeout in seconds to wait for each line of a bulk response
+CYMRU_BULK_TIMEOUT = 120
+
+#: info_asn columns of a Team Cymru record, see parseCymru()
+CYMRU_COLUMNS = ('asn', 'as_name', 'org_name', 'country', 'source')
+
+# ----------------------------------------------------------------
+# RIR delegated-extended statistics files
+# ----------------------------------------------------------------
+DELEGATED_STATS = OrderedDict()
+DELEGATED_STATS['arin'] = "https://ftp.arin.net/pub/stats/arin/delegated-arin-extended-latest"
+DELEGATED_STATS['ripe'] = "https://ftp.ripe.net/pub/stats/ripencc/delegated-ripencc-extended-latest"
+DELEGATED_STATS['apnic'] = "https://ftp.apnic.net/stats/apnic/delegated-apnic-extended-latest"
+DELEGATED_STATS['afrinic'] = "https://ftp.afrinic.net/pub/stats/afrinic/delegated-afrinic-extended-latest"
+DELEGATED_STATS['lacnic'] = "https://ftp.lacnic.net/pub/stats/lacnic/delegated-lacnic-extended-latest"
+
+#: Source prefix of info_asn entries that only have the country from the delegation.  These
+#:    are looked up again and are replaced by whois, see QUERY_AS_LIST and UpdateWhoisDb().
+DELEGATED_SOURCE_PREFIX = "delegated-"
+
+#: Cymru bulk upsert conflict clause.  Same as UpdateWhoisDb(), only entries that have just
+#:    the delegation country are replaced.
+CYMRU_CONFLICT = (
+        "ON CONFLICT (asn) DO UPDATE SET "
+        "   %s, timestamp=(now() at time zone 'utc')"
+        "   WHERE %s.source LIKE '%s%%'"
+) % (','.join(["%s=excluded.%s" % (name, name) for name in CYMRU_COLUMNS[1:]]),
+     TBL_GEN_WHOIS_ASN_NAME, DELEGATED_SOURCE_PREFIX)
+
+# ----------------------------------------------------------------
+# Lookup cache, see info_asn_lookup
+# ----------------------------------------------------------------
+
+#: Days until an ASN that was found is looked up again
+LOOKUP_HIT_TTL = 30
+
+#: Days until an ASN that was not found is looked up again.  The TTL doubles for each
+#:    consecutive miss, up to LOOKUP_MISS_MAX_TTL days.
+LOOKUP_MISS_TTL = 1
+LOOKUP_MISS_MAX_TTL = 64
+
+#: Lookup outcomes
+LOOKUP_FOUND = 'found'
+LOOKUP_COUNTRY = 'country'      # Only the delegation country was found
+LOOKUP_MISSING = 'missing'
+
+#: Number of lookups to batch before updating the lookup cache
+LOOKUP_FLUSH_SIZE = 1000
+
+INFO_ASN_LOOKUP_COLUMNS = ('asn', 'last_attempt', 'next_attempt', 'outcome', 'source', 'misses')
+
+#: Lookup cache upsert conflict clause.  Misses are counted and the retry backs off exponentially.
+INFO_ASN_LOOKUP_CONFLICT = (
+        "ON CONFLICT (asn) DO UPDATE SET "
+        "   last_attempt=excluded.last_attempt, outcome=excluded.outcome, source=excluded.source,"
+        "   misses=CASE WHEN excluded.outcome = '%(found)s' THEN 0 ELSE %(table)s.misses + 1 END,"
+        "   next_attempt=excluded.last_attempt + CASE WHEN excluded.outcome = '%(found)s'"
+        "       THEN interval '%(hit)d days'"
+        "       ELSE LEAST(interval '%(max)d days', interval '%(miss)d days' * power(2, %(table)s.misses)) END"
+) % {'found': LOOKUP_FOUND, 'table': TBL_ASN_LOOKUP_NAME, 'hit': LOOKUP_HIT_TTL,
+     'miss': LOOKUP_MISS_TTL, 'max': LOOKUP_MISS_MAX_TTL}
+
 # ----------------------------------------------------------------
 # Queries to get data
 # ----------------------------------------------------------------
 
-#: Gets a list of all distinct ASN's
+#: Gets a list of all distinct ASN's that are missing or only have the delegation country
 QUERY_AS_LIST = (
         "SELECT DISTINCT recv_origin_as FROM global_ip_rib r " +
         " LEFT JOIN info_asn i ON (i.asn = recv_origin_as) " +
-        " WHERE i.asn is null"
+        " LEFT JOIN " + TBL_ASN_LOOKUP_NAME + " l ON (l.asn = recv_origin_as) " +
+        " WHERE (i.asn is null OR i.source LIKE '" + DELEGATED_SOURCE_PREFIX + "%')"
+)
+
+#: Filter of QUERY_AS_LIST and QUERY_REFRESH_LIST to skip ASN's that are not due to be looked up again
+QUERY_AS_LIST_DUE = " AND (l.asn is null OR l.next_attempt <= (now() at time zone 'utc'))"
+
+#: Gets the ASN's with info from whois, oldest lookup first.  The lookup time is used instead
+#:    of the info_asn timestamp, which is only updated when the info changes.
+QUERY_REFRESH_LIST = (
+        "SELECT i.asn FROM info_asn i " +
+        " LEFT JOIN " + TBL_ASN_LOOKUP_NAME + " l ON (l.asn = i.asn) " +
+        " WHERE (i.source IS NULL OR i.source LIKE 'cymru-%' OR i.source IN (" +
+        ','.join(["'%s'" % source for source in WHOIS_SOURCES]) + "))"
 )
 
+#: Order of QUERY_REFRESH_LIST
+QUERY_REFRESH_LIST_ORDER = " ORDER BY COALESCE(l.last_attempt, i.timestamp) LIMIT %d"
+
+#: info_asn columns that are replaced when a record is refreshed.  Columns not in the refreshed
+#:    record are cleared.
+INFO_ASN_REFRESH_COLUMNS = ('as_name', 'org_id', 'org_name', 'remarks', 'address', 'city', 'state_prov',
+                            'postal_code', 'country', 'raw_output', 'source')
+
 
 # ----------------------------------------------------------------
 # Functions
 # ----------------------------------------------------------------
 
-def getASNList(db):
-    """ Gets the ASN list from DB
+def loadDelegations():
+    """ Downloads the RIR delegated-extended files and builds the delegation index
 
-        :param db:    instance of DbAccess class
+        A file that fails to download is skipped, its ASN's are looked up in the
+        default source order.
 
-        :return: Returns a list/array of ASN's
+        :return: rirDelegations instance
     """
-    # Run query and store data
-    rows = db.query(QUERY_AS_LIST)
-    print("Query for ASN List took %r seconds" % (db.last_query_time))
+    delegations = rirDelegations()
+
+    for source in DELEGATED_STATS:
+        try:
+            count = delegations.download(DELEGATED_STATS[source])
+            print("Loaded %d ASN delegations from %s" % (count, source))
+
+        except (OSError, ValueError) as err:
+            print("ERROR: failed to download %s delegations: %r" % (source, err))
+
+    delegations.build()
+
+    return delegations
 
-    print("total rows = %d" % len(rows))
 
-    asnList = []
+def whoisHosts(asn, delegations=None):
+    """ Gets the whois hosts to query for the ASN
+
+        The host of the RIR that the ASN is delegated by is first, followed by the
+        other sources in the WHOIS_SOURCES order.
+
+        :param asn:            ASN number
+        :param delegations:    rirDelegations instance, None to use the WHOIS_SOURCES order
+
+        :return: List of whois hostnames
+    """
+    hosts = list(WHOIS_SOURCES.values())
+    delegation = delegations.lookup(asn) if delegations else None
+
+    if (delegation and delegation[0] in WHOIS_SOURCES):
+        hosts.remove(WHOIS_SOURCES[delegation[0]])
+        hosts.insert(0, WHOIS_SOURCES[delegation[0]])
+
+    return hosts
+
+
+def getASNList(db, useCache=True):
+    """ Gets the ASN list from DB
+
+        The list is streamed from the DB using a server side cursor, so ASN's are
+        returned as soon as the query starts to return rows.  The cursor holds the
+        connection until the list is consumed, see dbHandler.queryIter().
+
+        :param db:          DbAccess instance that is only used to read the list
+        :param useCache:    True to skip ASN's that the lookup cache says are not due
+
+        :return: Returns a generator of ASN's
+    """
+    rows = 0
 
     # Append only if the ASN is not a private/reserved ASN
-    for row in rows:
+    for row in db.queryIter(QUERY_AS_LIST + (QUERY_AS_LIST_DUE if useCache else "")):
+        rows += 1
+
+        if (rows == 1):
+            print("Query for ASN List took %r seconds" % (db.last_query_time))
+
         try:
             asn_int = int(row[0])
 
@@ -105,12 +261,28 @@ def getASNList(db):
                     asn_int >= 4200000000 ):
                 pass
             else:
-                asnList.append(row[0])
+                yield row[0]
 
         except:
             pass
 
-    return asnList
+    print("total rows = %d" % rows)
+
+
+def getRefreshList(db, limit, useCache=True):
+    """ Gets the list of ASN's to refresh from DB
+
+        :param db:          DbAccess instance that is only used to read the list, see getASNList()
+        :param limit:       Max number of ASN's to refresh
+        :param useCache:    True to skip ASN's that the lookup cache says are not due
+
+        :return: Returns a generator of ASN's, oldest lookup first
+    """
+    query = (QUERY_REFRESH_LIST + (QUERY_AS_LIST_DUE if useCache else "") +
+             QUERY_REFRESH_LIST_ORDER % limit)
+
+    for row in db.queryIter(query):
+        yield row[0]
 
 def parse_whois(whois_output):
     """ Parse the whois text output
@@ -197,140 +369,528 @@ def parse_whois(whois_output):
     return record
 
 
-def whois(asn, host):
+async def whois(client, asn, host):
     """ whois the source for the given ASN
 
+        Referrals to other whois servers are followed.  The most specific response
+        that has the ASN is used.
+
+    :param client:      whoisClient instance
     :param asn:         ASN number to get info on
     :param host:        whois hostname
 
-    :return: dict of parsed attribute/values
+    :return: tuple of (host, dict of parsed attribute/values), host is the server that answered
+    """
+    responses = await client.queryReferrals(host, "AS%s" % asn)
+
+    for (rhost, output) in reversed(responses):
+        record = parse_whois(output)
+        if ('as_name' in record):
+
+            # Update record to add country and state if it has an address
+            if ('address' in record):
+                addr = record['address'].split('\n')
+                if (not 'country' in record):
+                    record['country'] = addr[len(addr)-1]
+                if (not 'state_prov' in record):
+                    record['state_prov'] = addr[len(addr)-2]
+
+            return rhost, record
+
+    return host, {}
+
+
+def parseCymru(line):
+    """ Parse a Team Cymru ASN line
+
+        The DNS TXT record and the verbose bulk whois lines have the same format::
+
+            23028 | US | arin | 2002-01-04 | TEAMCYMRU - SAUNET, US
+
+    :param line:        Cymru line, with or without the TXT record quotes
+
+    :return: dict of attribute/values, empty if the line is not an ASN entry
     """
-    WHOIS_CMD = ["whois", "-h", host, "AS%s" % asn]
+    record = {}
 
-    proc = subprocess.Popen(WHOIS_CMD,
-                            stdout= subprocess.PIPE, stdin=None)
+    txt = line.strip().strip('"').split("|")
+    if len(txt) >= 5 and txt[0].strip().isdigit():
+        a_name = txt[4].split(' - ', 2)
+        as_name = a_name[0].replace('"', '').strip()
+        org_name = a_name[1].replace('"', '').strip() if len(a_name) > 1 else as_name
 
-    output = (proc.stdout.read()).decode("utf-8", "ignore")
-    proc.communicate()
+        # Unknown ASN's have an empty or NA name
+        if (len(as_name) == 0 or as_name == 'NA'):
+            return record
 
-    return parse_whois(output)
+        record['source'] = "cymru-" + txt[2].strip()
+        record['as_number'] = txt[0].strip()
+        record['as_name'] = as_name
+        record['country'] = txt[1].strip()
+        record['org_name'] = org_name
 
+    return record
 
-def walkWhois(db, asnList):
-    """ Walks through the ASN list
 
-        The walk will pace each query and will add a delay ever N queries
-        in order to not cause abuse.  The whois starts with arin and
-        follows the referral.
+def cymruLookup(asn):
+    """ Lookup the ASN using the Team Cymru DNS TXT records
 
-        :param db:         DbAccess reference
-        :param asnList:    ASN List to
+    :param asn:         ASN number to get info on
 
-        :return: Returns a list/array of ASN's (rows from return set)
+    :return: dict of attribute/values, empty if not found
     """
-    asnList_size = len(asnList)
-    asnList_processed = 0
+    record = {}
+
+    try:
+        answers = dns.resolver.query("AS%d.asn.cymru.com" % asn, 'TXT')
+        if len(answers) >= 1:
+            record = parseCymru(str(answers[0]))
+    except:
+        pass
+
+    return record
+
+
+async def cymruBulkLookup(asns, host=CYMRU_WHOIS_HOST, port=CYMRU_WHOIS_PORT, timeout=CYMRU_BULK_TIMEOUT):
+    """ Lookup ASN's using one Team Cymru bulk whois session
+
+        The ASN's are sent between begin and end on a single connection.
 
-    # Max number of requests before requiring a delay
-    MAX_REQUESTS_PER_INTERVAL = 100
+        ..see: https://team-cymru.com/community-services/ip-asn-mapping/
 
-    requests = 0
+    :param asns:        List of ASN numbers to get info on
+    :param host:        Cymru whois hostname
+    :param port:        Cymru whois port
+    :param timeout:     Timeout in seconds to wait for each response line
 
-    for asn in asnList:
-        requests += 1
-        asnList_processed += 1
+    :return: dict of records by ASN number, see parseCymru()
+    :raises OSError: if the connection fails
+    :raises asyncio.TimeoutError: if the response times out
+    """
+    records = {}
+
+    (reader, writer) = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+
+    async def send():
+        writer.write(("begin\nverbose\n%s\nend\n" % '\n'.join(["AS%s" % asn for asn in asns])).encode('ascii'))
+        await writer.drain()
+
+    # Send while reading, the server responds before the whole request is sent
+    sender = asyncio.create_task(send())
 
-        # Try all sources
-        for source in WHOIS_SOURCES:
-            record = whois(asn, WHOIS_SOURCES[source])
-            if ('as_name' in record):
-                record['source'] = source
+    try:
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if not line:
                 break
 
-        # If not found via whois, try DNS
-        if 'as_name' not in record:
-            try:
-                answers = dns.resolver.query("AS%d.asn.cymru.com" % asn, 'TXT')
-                if len(answers) >= 1:
-                    txt = str(answers[0]).split("|")
-                    if len(txt) >= 5:
-                        a_name = txt[4].split(' - ', 2)
-                        as_name = a_name[0].replace('"', '').strip()
-                        org_name = a_name[1].replace('"', '').strip() if len(a_name) > 1 else as_name
-
-                        record['source'] = "cymru-" + txt[2].strip()
-                        record['as_number'] = txt[0].strip()
-                        record['as_name'] = as_name
-                        record['country'] = txt[1].strip()
-                        record['org_name'] = org_name
-            except:
-                pass
+            record = parseCymru(line.decode('utf-8', 'ignore'))
+            if (record):
+                records[int(record['as_number'])] = record
 
-        # Only process the record if whois responded
-        if ('as_name' in record):
+        await sender
 
-            if 'as_number' in record:
-                del record["as_number"]
+    finally:
+        sender.cancel()
+        writer.close()
 
-            # debug
-            #print ("----------------------------------------------------------------------")
-            #print "AS%s source=%s" % (asn, record['source'])
-            #for key in record:
-            #    print "attr = %s, value = %s" % (key, record[key])
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
 
-            # Update record to add country and state if it has an address
-            if ('address' in record):
-                addr = record['address'].split('\n')
-                if (not 'country' in record):
-                    record['country'] = addr[len(addr)-1]
-                if (not 'state_prov' in record):
-                    record['state_prov'] = addr[len(addr)-2]
+    return records
+
+
+async def walkCymruBulk(db, asnList, batchSize=CYMRU_BULK_SIZE, host=CYMRU_WHOIS_HOST, port=CYMRU_WHOIS_PORT):
+    """ Walks through the ASN list using Team Cymru bulk whois
+
+        ASN's are queried in batches of batchSize.  The ASN's found in a batch are written
+        with one upsert, and the ASN's not found are yielded as soon as the batch completes,
+        so that the whois walk can look them up while the next batch is queried.  A batch
+        that fails is not retried, its ASN's are yielded as not found.
+
+        :param db:          DbAccess reference
+        :param asnList:     Iterable of ASN's to lookup
+        :param batchSize:   Number of ASN's per bulk session
+        :param host:        Cymru whois hostname
+        :param port:        Cymru whois port
+
+        :return: Async generator of the ASN's that were not found
+    """
+    asnList = iter(asnList)
+    found = 0
+    missing = 0
+
+    while True:
+        batch = list(islice(asnList, batchSize))
+        if (not batch):
+            break
+
+        try:
+            records = await cymruBulkLookup(batch, host, port)
+
+        except (OSError, asyncio.TimeoutError) as err:
+            print("ERROR: cymru bulk whois of %d ASN's failed: %r" % (len(batch), err))
+            records = {}
+
+        rows = []
+        lookups = []
+        misses = []
+
+        for asn in batch:
+            record = processRecord(records.get(int(asn), {}))
+
+            if (record):
+                rows.append((asn,) + tuple(record[name][:254] for name in CYMRU_COLUMNS[1:]))
+                lookups.append(lookupRow(asn, record))
+            else:
+                misses.append(asn)
+
+        if (rows):
+            db.bulkUpsert(TBL_GEN_WHOIS_ASN_NAME, CYMRU_COLUMNS, rows, CYMRU_CONFLICT, distinctOn=('asn',))
+
+        # Missing ASN's are recorded by the whois walk
+        UpdateLookupCache(db, lookups)
+
+        found += len(rows)
+        missing += len(misses)
+        print("%s: Cymru bulk found %d, missing %d" % (datetime.utcnow(), found, missing))
+
+        for asn in misses:
+            yield asn
+
+
+async def iterAsync(asnList):
+    """ Iterates a list, generator or async generator of ASN's
+
+        :param asnList:     Iterable or async iterable of ASN's
+
+        :return: Async generator of ASN's
+    """
+    if (hasattr(asnList, '__aiter__')):
+        async for asn in asnList:
+            yield asn
+    else:
+        for asn in asnList:
+            yield asn
+
+
+async def lookupAsn(scheduler, asn, delegations=None):
+    """ Lookup the ASN by trying each whois source in order, then DNS
+
+        The RIR that delegated the ASN is tried first.  If the ASN is not found, only the
+        country from the delegation is returned.
+
+    :param scheduler:   whoisScheduler instance
+    :param asn:         ASN number to get info on
+    :param delegations: rirDelegations instance, None to try the sources in the WHOIS_SOURCES order
+
+    :return: dict of attribute/values, empty if not found
+    """
+    record = {}
+
+    # Try all sources
+    (host, result) = await scheduler.lookup(asn, whoisHosts(asn, delegations))
+
+    if (result):
+        (rhost, record) = result
+
+        # Use the source of the server that answered if a referral was followed
+        record['source'] = WHOIS_HOST_SOURCES.get(rhost.lower(), WHOIS_HOST_SOURCES[host])
+
+    # If not found via whois, try DNS
+    if 'as_name' not in record:
+        loop = asyncio.get_running_loop()
+        record = await loop.run_in_executor(None, fallbackLookup, asn, delegations)
+
+    return record
 
-            # Check if as_name is missing, if so use org_name
-            if (not 'as_name' in record and 'org_id' in record):
-                record['as_name'] = record['org_id']
+
+def fallbackLookup(asn, delegations=None):
+    """ Lookup an ASN that the whois or RDAP servers did not have
+
+        Team Cymru DNS is tried.  If the ASN is not found, only the country from the
+        delegation is returned.
+
+    :param asn:         ASN number to get info on
+    :param delegations: rirDelegations instance, can be None
+
+    :return: dict of attribute/values, empty if not found
+    """
+    record = cymruLookup(asn)
+
+    # If not found at all, use the country from the delegation
+    if ('as_name' not in record and delegations):
+        delegation = delegations.lookup(asn)
+
+        if (delegation and delegation[1]):
+            record = {'country': delegation[1], 'source': DELEGATED_SOURCE_PREFIX + delegation[0]}
+
+    return record
+
+
+def rdapLookup(rdap, asn, delegations=None):
+    """ Lookup the ASN using RDAP, then DNS
+
+    :param rdap:        rdapClient instance
+    :param asn:         ASN number to get info on
+    :param delegations: rirDelegations instance, can be None
+
+    :return: dict of attribute/values, empty if not found
+    """
+    try:
+        record = rdap.lookup(asn)
+
+    except (requests.RequestException, ValueError) as err:
+        print("AS%s: rdap failed: %r" % (asn, err))
+        record = {}
+
+    if ('as_name' not in record):
+        record = fallbackLookup(asn, delegations)
+
+    # ARIN does not have the country in structured form, use the country from the delegation
+    elif ('country' not in record and delegations):
+        delegation = delegations.lookup(asn)
+
+        if (delegation and delegation[1]):
+            record['country'] = delegation[1]
+
+    return record
+
+
+def processRecord(record):
+    """ Normalize a looked up record for the info_asn table
+
+    :param record:      dict of attribute/values from lookupAsn()
+
+    :return: dict of column names and values, None if whois did not respond
+    """
+    # Only process the record if whois responded or the delegation country is known
+    if ('as_name' not in record and 'country' not in record):
+        return None
+
+    if 'as_number' in record:
+        del record["as_number"]
+
+    # Check if as_name is missing, if so use org_name
+    if (not 'as_name' in record and 'org_id' in record):
+        record['as_name'] = record['org_id']
+
+    return record
+
+
+async def walkAsns(db, asnList, lookup, maxTasks=MAX_PENDING_LOOKUPS, status=None, refresh=False):
+    """ Walks through the ASN list, looking up ASN's concurrently
+
+        :param db:         DbAccess reference
+        :param asnList:    Iterable or async iterable of ASN's to lookup, see walkCymruBulk()
+        :param lookup:     Coroutine function of (asn) that returns the record, see processRecord()
+        :param maxTasks:   Max number of ASN lookups in progress
+        :param status:     Function that returns the status to add to the progress lines, can be None
+        :param refresh:    True to update existing entries, see UpdateWhoisDb()
+    """
+    asnList_processed = 0
+    pending = {}
+    lookups = []
+
+    def complete(done):
+        nonlocal asnList_processed
+
+        for task in done:
+            asn = pending.pop(task)
+            asnList_processed += 1
+
+            try:
+                record = processRecord(task.result())
+            except Exception as err:
+                print("AS%s: lookup failed: %r" % (asn, err))
+                record = None
 
             # Update database with required
-            UpdateWhoisDb(db, asn, record)
+            if (record):
+                UpdateWhoisDb(db, asn, record, refresh)
+
+            lookups.append(lookupRow(asn, record))
+
+            if (len(lookups) >= LOOKUP_FLUSH_SIZE):
+                UpdateLookupCache(db, lookups)
+                lookups.clear()
+
+            if (asnList_processed % 100 == 0):
+                print("%s: Processed %d%s" % (datetime.utcnow(), asnList_processed,
+                                              ", %s" % status() if status else ""))
+
+    async for asn in iterAsync(asnList):
+        if (len(pending) >= maxTasks):
+            (done, _) = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            complete(done)
+
+        pending[asyncio.create_task(lookup(asn))] = asn
 
-        # delay between queries
-        if (requests >= MAX_REQUESTS_PER_INTERVAL):
-            print("%s: Processed %d of %d" % (datetime.utcnow(), asnList_processed, asnList_size))
-            sleep(5)
-            requests = 0
+    if (pending):
+        (done, _) = await asyncio.wait(pending)
+        complete(done)
 
+    UpdateLookupCache(db, lookups)
 
-def UpdateWhoisDb(db, asn, record):
+    print("%s: Processed %d" % (datetime.utcnow(), asnList_processed))
+
+
+async def walkWhois(db, asnList, client, delegations=None, maxTasks=MAX_PENDING_LOOKUPS, refresh=False):
+    """ Walks through the ASN list using whois
+
+        ASN's are looked up concurrently, up to maxTasks at a time.  Each whois server
+        has its own queue, and the client limits the concurrency and rate of queries to
+        each server in order to not cause abuse.  The whois starts with arin and follows
+        the referral.
+
+        :param db:         DbAccess reference
+        :param asnList:    Iterable or async iterable of ASN's to lookup, see walkCymruBulk()
+        :param client:     whoisClient instance
+        :param delegations: rirDelegations instance to query the delegating RIR first, can be None
+        :param maxTasks:   Max number of ASN lookups in progress
+        :param refresh:    True to update existing entries, see UpdateWhoisDb()
+    """
+    async def query(host, asn):
+        (rhost, record) = await whois(client, asn, host)
+        return (rhost, record) if ('as_name' in record) else None
+
+    scheduler = whoisScheduler(query, client.concurrency)
+
+    try:
+        await walkAsns(db, asnList, lambda asn: lookupAsn(scheduler, asn, delegations), maxTasks,
+                       lambda: "queued %r" % scheduler.pending(), refresh)
+
+    finally:
+        await scheduler.close()
+
+
+async def walkRdap(db, asnList, rdap, threads, delegations=None, maxTasks=MAX_PENDING_LOOKUPS, refresh=False):
+    """ Walks through the ASN list using RDAP
+
+        Lookups run in a thread pool and share the pooled connections of the client.
+
+        :param db:         DbAccess reference
+        :param asnList:    Iterable or async iterable of ASN's to lookup, see walkCymruBulk()
+        :param rdap:       rdapClient instance, with the bootstrap loaded
+        :param threads:    Number of lookup threads
+        :param delegations: rirDelegations instance for the country of ASN's not found, can be None
+        :param maxTasks:   Max number of ASN lookups in progress
+        :param refresh:    True to update existing entries, see UpdateWhoisDb()
+    """
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(threads) as executor:
+        async def lookup(asn):
+            return await loop.run_in_executor(executor, rdapLookup, rdap, asn, delegations)
+
+        await walkAsns(db, asnList, lookup, maxTasks, refresh=refresh)
+
+
+def UpdateWhoisDb(db, asn, record, refresh=False):
     """ Update the whois info in the DB
 
+        Existing entries are only replaced if they have just the delegation country.  When
+        refreshing, existing entries are also replaced if the info changed, unless the
+        refreshed record is from a fallback (cymru or delegation) and the entry is not.
+
         :param db:          DbAccess reference
         :param asn:         ASN to update in the DB
         :param record:      Dictionary of column names and values
                             Key names must match the column names in DB/table
+        :param refresh:     True to replace existing entries, see INFO_ASN_REFRESH_COLUMNS
 
         :return: True if updated, False if error
     """
+    table = TBL_GEN_WHOIS_ASN_NAME
+
+    # A refreshed record replaces all the columns, clear the ones that it does not have
+    if (refresh):
+        record = dict(record)
+        for name in INFO_ASN_REFRESH_COLUMNS:
+            record.setdefault(name, None)
+
     total_columns = len(record)
 
     # get query column list and value list
     columns = ''
     values = ''
+    updates = ''
     for idx,name in enumerate(record,start=1):
         columns += name
-        values += '\'' + str(record[name])[:254] + '\''
+        if (record[name] is None):
+            values += 'NULL'
+        else:
+            values += '\'' + str(record[name])[:254].replace("'", "''") + '\''
+        updates += '%s=excluded.%s' % (name, name)
 
         if (idx != total_columns):
             columns += ','
             values += ','
+            updates += ','
+
+    # Only entries that have just the delegation country are replaced
+    where = "%s.source LIKE '%s%%'" % (table, DELEGATED_SOURCE_PREFIX)
+
+    if (refresh):
+        # raw_output has the query time and other noise, so it alone does not make a change
+        compared = [name for name in record if name != 'raw_output']
+
+        where = ("(%s OR ((excluded.source NOT LIKE 'cymru-%%' OR %s.source LIKE 'cymru-%%' OR %s.source IS NULL)"
+                 "         AND excluded.source NOT LIKE '%s%%'))"
+                 " AND (%s) IS DISTINCT FROM (%s)") % (
+                    where, table, table, DELEGATED_SOURCE_PREFIX,
+                    ','.join(["%s.%s" % (table, name) for name in compared]),
+                    ','.join(["excluded.%s" % name for name in compared]))
 
     # Build the query
     query = ("INSERT INTO %s "
-             "    (asn,%s) VALUES ('%s',%s) ON CONFLICT (asn) DO NOTHING") % (TBL_GEN_WHOIS_ASN_NAME, columns, asn, values)
+             "    (asn,%s) VALUES ('%s',%s) ON CONFLICT (asn) DO UPDATE SET %s,"
+             "    timestamp=(now() at time zone 'utc') WHERE %s") % (
+                table, columns, asn, values, updates, where)
 
     #print "QUERY = %s" % query
     db.queryNoResults(query)
 
 
+def lookupRow(asn, record):
+    """ Builds the lookup cache row for a lookup
+
+        The next attempt is for a first lookup, INFO_ASN_LOOKUP_CONFLICT computes it for
+        an ASN that was looked up before.
+
+        :param asn:         ASN that was looked up
+        :param record:      Record from processRecord(), None if not found
+
+        :return: Row tuple in INFO_ASN_LOOKUP_COLUMNS order
+    """
+    now = datetime.utcnow()
+
+    if (not record):
+        return (asn, now, now + timedelta(days=LOOKUP_MISS_TTL), LOOKUP_MISSING, None, 1)
+
+    elif ('as_name' not in record):
+        return (asn, now, now + timedelta(days=LOOKUP_MISS_TTL), LOOKUP_COUNTRY, record.get('source'), 1)
+
+    return (asn, now, now + timedelta(days=LOOKUP_HIT_TTL), LOOKUP_FOUND, record.get('source'), 0)
+
+
+def UpdateLookupCache(db, rows):
+    """ Update the lookup cache in the DB
+
+        :param db:          DbAccess reference
+        :param rows:        List of rows from lookupRow()
+
+        :return: True if updated, None if error
+    """
+    if (not rows):
+        return True
+
+    return db.bulkUpsert(TBL_ASN_LOOKUP_NAME, INFO_ASN_LOOKUP_COLUMNS, rows, INFO_ASN_LOOKUP_CONFLICT,
+                         distinctOn=('asn',))
+
+
 def script_exit(status=0):
     """ Simple wrapper to exit the script cleanly """
     exit(status)
@@ -347,22 +907,40 @@ def parseCmdArgs(argv):
                 {
                     user:       <username>,
                     password:   <password>,
-                    db_host:    <database host>
+                    db_host:    <database host>,
+                    concurrency: <max concurrent queries per whois server>,
+                    timeout:    <whois query timeout in seconds>,
+                    rate:       <max queries per second per whois server>,
+                    delegations: <True to use the RIR delegations to pick the whois source>,
+                    cymru_bulk: <True to lookup with Team Cymru bulk whois before the whois sources>,
+                    engine:     <lookup engine, whois or rdap>,
+                    use_cache:  <True to skip ASN's that the lookup cache says are not due>,
+                    refresh:    <number of the oldest entries to refresh, 0 to not refresh>
                 }
     """
     REQUIRED_ARGS = 3
     found_req_args = 0
     cmd_args = { 'user': None,
                  'password': None,
-                 'db_host': None }
+                 'db_host': None,
+                 'concurrency': WHOIS_CONCURRENCY,
+                 'timeout': WHOIS_TIMEOUT,
+                 'rate': WHOIS_RATE,
+                 'delegations': True,
+                 'cymru_bulk': False,
+                 'engine': 'whois',
+                 'use_cache': True,
+                 'refresh': 0 }
 
     if (len(argv) < 3):
         usage(argv[0])
         sys.exit(1)
 
     try:
-        (opts, args) = getopt.getopt(argv[1:], "hu:p:",
-                                     ["help", "user", "password"])
+        (opts, args) = getopt.getopt(argv[1:], "hu:p:c:t:r:be:R:",
+                                     ["help", "user=", "password=", "concurrency=", "timeout=", "rate=",
+                                      "noDelegations", "cymruBulk", "engine=", "ignoreCache",
+                                      "refresh="])
 
         for o, a in opts:
             if o in ("-h", "--help"):
@@ -377,6 +955,35 @@ def parseCmdArgs(argv):
                 found_req_args += 1
                 cmd_args['password'] = a
 
+            elif o in ("-c", "--concurrency"):
+                cmd_args['concurrency'] = int(a)
+
+            elif o in ("-t", "--timeout"):
+                cmd_args['timeout'] = int(a)
+
+            elif o in ("-r", "--rate"):
+                cmd_args['rate'] = float(a)
+
+            elif o in ("--noDelegations",):
+                cmd_args['delegations'] = False
+
+            elif o in ("-b", "--cymruBulk"):
+                cmd_args['cymru_bulk'] = True
+
+            elif o in ("--ignoreCache",):
+                cmd_args['use_cache'] = False
+
+            elif o in ("-R", "--refresh"):
+                cmd_args['refresh'] = int(a)
+
+            elif o in ("-e", "--engine"):
+                if (a not in ENGINES):
+                    print("ERROR: Invalid engine '%s', must be one of %s" % (a, ', '.join(ENGINES)))
+                    usage(argv[0])
+                    sys.exit(1)
+
+                cmd_args['engine'] = a
+
             else:
                 usage(argv[0])
                 sys.exit(1)
@@ -400,7 +1007,7 @@ def parseCmdArgs(argv):
 
         return cmd_args
 
-    except (getopt.GetoptError, TypeError) as err:
+    except (getopt.GetoptError, TypeError, ValueError) as err:
         print(str(err))  # will print something like "option -a not recognized"
         usage(argv[0])
         sys.exit(2)
@@ -420,6 +1027,14 @@ def usage(prog):
 
     print ("OPTIONAL OPTIONS:")
     print ("  -h, --help".ljust(30) + "Print this help menu")
+    print ("  -c, --concurrency".ljust(30) + "Max concurrent queries per whois/RDAP server, default %d" % WHOIS_CONCURRENCY)
+    print ("  -t, --timeout".ljust(30) + "Whois query timeout in seconds, default %d" % WHOIS_TIMEOUT)
+    print ("  -r, --rate".ljust(30) + "Max queries per second per whois server, default %s" % WHOIS_RATE)
+    print ("  --noDelegations".ljust(30) + "Do not download the RIR delegations to query the delegating RIR first")
+    print ("  -b, --cymruBulk".ljust(30) + "Lookup with Team Cymru bulk whois first, whois the ASN's not found")
+    print ("  -e, --engine".ljust(30) + "Lookup engine, whois (default) or rdap")
+    print ("  --ignoreCache".ljust(30) + "Lookup all missing ASN's, even if a recent lookup did not find them")
+    print ("  -R, --refresh <count>".ljust(30) + "Lookup the <count> oldest entries again and update the ones that changed")
 
 
 
@@ -431,9 +1046,49 @@ def main():
     db = dbHandler.dbHandler()
     db.connectDb(cfg['user'], cfg['password'], cfg['db_host'], "openbmp")
 
-    asnList = getASNList(db)
-    walkWhois(db,asnList)
+    # The ASN lists are streamed on their own connection, so that the writes while
+    #    walking them do not end the read transaction
+    reader = dbHandler.dbHandler()
+    reader.connectDb(cfg['user'], cfg['password'], cfg['db_host'], "openbmp")
+
+    delegations = loadDelegations() if cfg['delegations'] else None
+
+    asnList = getASNList(reader, cfg['use_cache'])
+
+    if (cfg['cymru_bulk']):
+        # Runs in the event loop of the first walk, which looks up the misses of each batch
+        asnList = walkCymruBulk(db, asnList)
+
+    # Missing ASN's first, then the oldest entries to refresh
+    walks = [(asnList, False)]
+
+    if (cfg['refresh'] > 0):
+        walks.append((getRefreshList(reader, cfg['refresh'], cfg['use_cache']), True))
+
+    if (cfg['engine'] == 'rdap'):
+        threads = cfg['concurrency'] * len(WHOIS_SOURCES)
+        rdap = rdapClient(threads, cfg['timeout'])
+
+        try:
+            print("Loaded %d ASN ranges from the RDAP bootstrap" % rdap.loadBootstrap())
+        except (requests.RequestException, ValueError) as err:
+            print("ERROR: failed to load the RDAP bootstrap: %r" % err)
+            reader.close()
+            db.close()
+            script_exit(1)
+
+        for (asns, refresh) in walks:
+            asyncio.run(walkRdap(db, asns, rdap, threads, delegations, refresh=refresh))
+
+        rdap.close()
+
+    else:
+        for (asns, refresh) in walks:
+            # The client is bound to the event loop of the walk
+            client = whoisClient(cfg['concurrency'], cfg['timeout'], cfg['rate'])
+            asyncio.run(walkWhois(db, asns, client, delegations, refresh=refresh))
 
+    reader.close()
     db.close()
 
 
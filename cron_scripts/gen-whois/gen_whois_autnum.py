@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+  Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+
+  Imports the aut-num objects of the RIR database dumps into info_asn
+
+  The dumps are streamed and parsed while they download.  The aut-num attributes are mapped
+  to info_asn columns using gen_whois_asn.WHOIS_ATTR_MAP, the same as the whois lookups.
+"""
+import getopt
+import sys
+import traceback
+import urllib.request
+from collections import OrderedDict
+from time import time
+
+import dbHandler
+import gzipReader
+from gen_whois_asn import WHOIS_ATTR_MAP
+from gen_whois_route import RR_DB_FTP, RR_DB_FILES, RR_NRTM
+
+# ----------------------------------------------------------------
+# RIR database dumps
+#    organisation is an optional dump of the organisation objects, used to add
+#    the org_name and country of the aut-num org
+# ----------------------------------------------------------------
+RIR_DB_DUMPS = OrderedDict()
+RIR_DB_DUMPS['ripe'] = {'autnum': 'ftp://ftp.ripe.net/ripe/dbase/split/ripe.db.aut-num.gz',
+                        'organisation': 'ftp://ftp.ripe.net/ripe/dbase/split/ripe.db.organisation.gz'}
+RIR_DB_DUMPS['apnic'] = {'autnum': 'ftp://ftp.apnic.net/pub/apnic/whois/apnic.db.aut-num.gz',
+                         'organisation': 'ftp://ftp.apnic.net/pub/apnic/whois/apnic.db.organisation.gz'}
+RIR_DB_DUMPS['afrinic'] = {'autnum': 'ftp://ftp.afrinic.net/pub/dbase/afrinic.db.gz'}
+
+#: RIR whois sources, see gen_whois_asn.WHOIS_SOURCES
+RIR_SOURCES = ('arin', 'ripe', 'apnic', 'afrinic', 'lacnic')
+
+#: IRR sources that gen_whois_route.py imports aut-num objects from.  An IRR source that has the
+#:    name of an RIR cannot be told apart from the RIR whois, so it is not listed.
+IRR_SOURCES = tuple([s for s in OrderedDict.fromkeys(list(RR_DB_FTP) + list(RR_DB_FILES) + list(RR_NRTM))
+                     if s not in RIR_SOURCES])
+
+#: info_asn columns that are imported
+INFO_ASN_COLUMNS = ('asn', 'as_name', 'org_id', 'org_name', 'remarks', 'address', 'country', 'source')
+
+#: info_asn upsert conflict clause.  The dump replaces entries from the same source, entries
+#:    without a source, IRR aut-num objects, the cymru DNS fallback and the delegated stats
+#:    placeholders.  Any other source, such as another RIR or PeeringDB, is not replaced.
+INFO_ASN_CONFLICT = ("ON CONFLICT (asn) DO UPDATE SET "
+                     "   as_name=excluded.as_name, org_id=excluded.org_id, org_name=excluded.org_name,"
+                     "   remarks=excluded.remarks, address=excluded.address, country=excluded.country,"
+                     "   source=excluded.source, timestamp=(now() at time zone 'utc') "
+                     " WHERE info_asn.source IS NULL OR info_asn.source = excluded.source"
+                     "       OR info_asn.source LIKE 'cymru-%' OR info_asn.source LIKE 'delegated-%'"
+                     + (" OR info_asn.source IN (%s)" % ','.join(["'%s'" % s for s in IRR_SOURCES])
+                        if IRR_SOURCES else ""))
+
+#: Max number of rows to bulk upsert at once
+MAX_BULK_ROWS = 20000
+
+#: Size of the chunks read from the download
+READ_CHUNK_SIZE = 1024 * 1024
+
+#: Download socket timeout in seconds
+DOWNLOAD_TIMEOUT = 300
+
+
+def stream_dump(url, gzip_backend=None):
+    """ Downloads a database dump, decompressing it while it downloads
+
+    :param url:             URL of the dump
+    :param gzip_backend:    Backend to decompress the dump, see gzipReader.selectBackend()
+
+    :return: Generator of bytes chunks
+    """
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as resp:
+        chunks = iter(lambda: resp.read(READ_CHUNK_SIZE), b'')
+
+        if (url.endswith(".gz")):
+            chunks = gzipReader.decompressChunks(chunks, gzip_backend)
+
+        yield from chunks
+
+
+def parse_objects(chunks, object_class):
+    """ Parses RPSL objects of a class
+
+    Only the object class attribute and the attributes in WHOIS_ATTR_MAP are decoded.  Repeated
+    attributes are joined with a newline, except for country, as they are by gen_whois_asn.parse_whois().
+
+    :param chunks:          Iterable of bytes chunks, which do not need to be object aligned
+    :param object_class:    Object class, such as aut-num
+
+    :return: Generator of dictionaries of RPSL attribute names and values
+    """
+    prefix = object_class.encode('ascii') + b':'
+    rest = b''
+
+    for chunk in chunks:
+        objs = (rest + chunk).split(b'\n\n')
+
+        # Last object may continue in the next chunk
+        rest = objs.pop()
+
+        for obj in objs:
+            # The object class is the first attribute, which may follow comment lines
+            if obj.startswith(prefix) or (b'\n' + prefix) in obj:
+                yield parse_object(obj, object_class)
+
+    if rest.startswith(prefix) or (b'\n' + prefix) in rest:
+        yield parse_object(rest, object_class)
+
+
+def parse_object(obj, object_class):
+    """ Parses the object class and WHOIS_ATTR_MAP attributes of an RPSL object
+
+    :param obj:             RPSL object bytes
+    :param object_class:    Object class, such as aut-num
+
+    :return: Dictionary of RPSL attribute names and values
+    """
+    record = {}
+    prev_attr = None
+
+    for line in obj.split(b'\n'):
+        first = line[:1]
+
+        if (first == b'#' or first == b'%' or not first):
+            continue
+
+        # Continuation of the previous attribute
+        elif (first in (b' ', b'\t', b'+')):
+            if (prev_attr):
+                record[prev_attr] += "\n" + line[1:].strip().decode('utf-8', 'ignore')
+            continue
+
+        (attr, sep, value) = line.partition(b':')
+        attr = attr.strip().decode('utf-8', 'ignore')
+        prev_attr = None
+
+        if (not sep or (attr not in WHOIS_ATTR_MAP and attr != object_class)):
+            continue
+
+        value = value.strip().decode('utf-8', 'ignore')
+
+        if (attr in record and attr != 'country'):
+            record[attr] += "\n" + value
+        else:
+            record[attr] = value
+
+        prev_attr = attr
+
+    return record
+
+
+def load_organisations(url, gzip_backend=None):
+    """ Loads the organisation dump
+
+    :param url:             URL of the organisation dump
+    :param gzip_backend:    Backend to decompress the dump, see gzipReader.selectBackend()
+
+    :return: Dictionary of org id to organisation attributes
+    """
+    orgs = {}
+
+    for obj in parse_objects(stream_dump(url, gzip_backend), 'organisation'):
+        orgs[obj['organisation']] = obj
+
+    return orgs
+
+
+def autnum_row(obj, source, orgs):
+    """ Maps an aut-num object to an info_asn row
+
+    :param obj:             aut-num attributes, see parse_object()
+    :param source:          Source of the data (i.e. key value of RIR_DB_DUMPS dict)
+    :param orgs:            Dictionary of organisations, see load_organisations()
+
+    :return: info_asn row tuple in INFO_ASN_COLUMNS order, None if the aut-num does not parse
+    """
+    record = {}
+
+    for attr in obj:
+        if (attr in WHOIS_ATTR_MAP and attr != 'source'):
+            record[WHOIS_ATTR_MAP[attr]] = obj[attr]
+
+    # Add the org name and country from the organisation
+    org = orgs.get(record.get('org_id'), {})
+    for attr in ('org-name', 'country', 'address'):
+        if (attr in org and WHOIS_ATTR_MAP[attr] not in record):
+            record[WHOIS_ATTR_MAP[attr]] = org[attr]
+
+    try:
+        asn = record['as_number'].upper()
+        asn = int(asn[2:] if asn.startswith('AS') else asn)
+
+    except (KeyError, ValueError):
+        return None
+
+    row = [asn]
+    for column in INFO_ASN_COLUMNS[1:-1]:
+        row.append(record[column][:254] if column in record else None)
+    row.append(source)
+
+    return tuple(row)
+
+
+def import_rir_dump(db, source, dump, gzip_backend=None):
+    """ Imports the aut-num objects of a RIR dump into info_asn
+
+    :param db:              DbAccess reference
+    :param source:          Source of the data (i.e. key value of RIR_DB_DUMPS dict)
+    :param dump:            Dump URLs, see RIR_DB_DUMPS
+    :param gzip_backend:    Backend to decompress the dump, see gzipReader.selectBackend()
+
+    :return: Number of aut-nums imported, None if error
+    """
+    orgs = {}
+    rows = []
+    count = 0
+
+    if ('organisation' in dump):
+        print("%s: loading organisations from %s" % (source, dump['organisation']))
+        orgs = load_organisations(dump['organisation'], gzip_backend)
+
+    print("%s: importing aut-nums from %s" % (source, dump['autnum']))
+    for obj in parse_objects(stream_dump(dump['autnum'], gzip_backend), 'aut-num'):
+        row = autnum_row(obj, source, orgs)
+
+        if (row):
+            rows.append(row)
+
+        if (len(rows) >= MAX_BULK_ROWS):
+            if (not db.bulkUpsert("info_asn", INFO_ASN_COLUMNS, rows,
+                                  conflict=INFO_ASN_CONFLICT, distinctOn=('asn',))):
+                return None
+
+            count += len(rows)
+            rows = []
+
+    if (len(rows)):
+        if (not db.bulkUpsert("info_asn", INFO_ASN_COLUMNS, rows,
+                              conflict=INFO_ASN_CONFLICT, distinctOn=('asn',))):
+            return None
+
+        count += len(rows)
+
+    return count
+
+
+def parseCmdArgs(argv):
+    """ Parse commandline arguments
+
+        Usage is printed and program is terminated if there is an error.
+
+        :param argv:   ARGV as provided by sys.argv.  Arg 0 is the program name
+
+        :returns:  dictionary defined as::
+                {
+                    user:       <username>,
+                    password:   <password>,
+                    db_host:    <database host>,
+                    db_name:    <database name>,
+                    sources:    <list of RIR_DB_DUMPS sources to import>,
+                    gzip:       <gzip backend, None to select the fastest available>
+                }
+    """
+    REQUIRED_ARGS = 3
+    found_req_args = 0
+    cmd_args = {'user': None,
+                'password': None,
+                'db_host': None,
+                'db_name': "openbmp",
+                'sources': list(RIR_DB_DUMPS),
+                'gzip': None}
+
+    if (len(argv) < 3):
+        usage(argv[0])
+        sys.exit(1)
+
+    try:
+        (opts, args) = getopt.getopt(argv[1:], "hu:p:d:s:z:",
+                                     ["help", "user=", "password=", "dbName=", "sources=", "gzip="])
+
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage(argv[0])
+                sys.exit(0)
+
+            elif o in ("-u", "--user"):
+                found_req_args += 1
+                cmd_args['user'] = a
+
+            elif o in ("-p", "--password"):
+                found_req_args += 1
+                cmd_args['password'] = a
+
+            elif o in ("-d", "--dbName"):
+                cmd_args['db_name'] = a
+
+            elif o in ("-s", "--sources"):
+                cmd_args['sources'] = a.split(',')
+
+                for source in cmd_args['sources']:
+                    if (source not in RIR_DB_DUMPS):
+                        raise ValueError("unknown source '%s'" % source)
+
+            elif o in ("-z", "--gzip"):
+                cmd_args['gzip'] = gzipReader.selectBackend(a, stream=True)
+
+            else:
+                usage(argv[0])
+                sys.exit(1)
+
+        # The last arg should be the command
+        if (len(args) <= 0):
+            print("ERROR: Missing the database host/IP")
+            usage(argv[0])
+            sys.exit(1)
+
+        else:
+            found_req_args += 1
+            cmd_args['db_host'] = args[0]
+
+        # The last arg should be the command
+        if (found_req_args < REQUIRED_ARGS):
+            print("ERROR: Missing required args, found %d required %d" % (found_req_args, REQUIRED_ARGS))
+            usage(argv[0])
+            sys.exit(1)
+
+        return cmd_args
+
+    except (getopt.GetoptError, TypeError, ValueError) as err:
+        print(str(err))  # will print something like "option -a not recognized"
+        usage(argv[0])
+        sys.exit(2)
+
+
+def usage(prog):
+    """ Usage - Prints the usage for this program.
+
+        :param prog:  Program name
+    """
+    print ("")
+    print ("Usage: %s [OPTIONS] <database host/ip address>" % prog)
+    print ("")
+    print ("  -u, --user".ljust(30) + "Database username")
+    print ("  -p, --password".ljust(30) + "Database password")
+    print ("")
+
+    print ("OPTIONAL OPTIONS:")
+    print ("  -h, --help".ljust(30) + "Print this help menu")
+    print ("  -d, --dbName".ljust(30) + "Database name, default is 'openbmp'")
+    print ("  -s, --sources".ljust(30) + "Comma separated list of RIR dumps to import, default is '%s'"
+           % ','.join(RIR_DB_DUMPS))
+    print ("  -z, --gzip".ljust(30) + "gzip backend, one of auto, isal, zlib.  Default is auto")
+
+
+def main():
+    """
+    """
+    cfg = parseCmdArgs(sys.argv)
+
+    db = dbHandler.dbHandler()
+    db.connectDb(cfg['user'], cfg['password'], cfg['db_host'], cfg['db_name'])
+
+    # Each RIR is imported independently, so a failed download does not stop the others
+    for source in cfg['sources']:
+        start_time = time()
+
+        try:
+            count = import_rir_dump(db, source, RIR_DB_DUMPS[source], cfg['gzip'])
+
+            if (count is not None):
+                print("%s: imported %d aut-nums in %.1f seconds" % (source, count, time() - start_time))
+
+        except:
+            print("Error importing %s, skipping" % source)
+            traceback.print_exc()
+
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,24 @@
   .. moduleauthor:: Tim Evens <tim@evensweb.com>
 """
 import getopt
-import gzip
+import hashlib
+import json
+import multiprocessing
 import os
+import pickle
+import re
 import sys
+import threading
 from collections import OrderedDict, deque
-from ftplib import FTP
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from ftplib import FTP, error_perm
+from queue import Queue, Full
+from time import time
 import traceback
 
 import dbHandler
+import gzipReader
+import nrtmClient
 
 # ----------------------------------------------------------------
 # RR Database download sites
@@ -20,7 +30,8 @@ import dbHandler
 RR_DB_FTP = OrderedDict()
 
 # Only add RADB as it mirrors the others.
-RR_DB_FTP['radb'] = {'site': 'ftp.radb.net', 'path': '/radb/dbase/', 'filename': 'radb.db.gz'}
+RR_DB_FTP['radb'] = {'site': 'ftp.radb.net', 'path': '/radb/dbase/', 'filename': 'radb.db.gz',
+                     'serial_filename': 'RADB.CURRENTSERIAL'}
 
 #RR_DB_FTP['nttcom'] = {'site': 'rr1.ntt.net', 'path': '/nttcomRR/', 'filename': 'nttcom.db.gz'}
 #RR_DB_FTP['level3'] = {'site': 'ftp.radb.net', 'path': '/radb/dbase/', 'filename': 'level3.db.gz'}
@@ -46,195 +57,1192 @@ RR_DB_FILES['radb'] = {'filename': 'radb.db.gz'}
 # RR_DB_FILES['ripe_v6'] = {'filename': 'ripe.db.route6.gz'}
 
 # ----------------------------------------------------------------
-# Whois mapping
+# RR NRTM mirror servers
+#    The source database file is imported once to bootstrap the mirror, using the
+#    serial_filename of RR_DB_FTP as the serial of the file.
 # ----------------------------------------------------------------
-WHOIS_ATTR_MAP = {
-    # RADB
-    'route': 'prefix',
-    'route6': 'prefix',
-    'descr': 'descr',
-    'origin': 'origin_as',
-}
+RR_NRTM = OrderedDict()
+RR_NRTM['radb'] = {'host': 'nrtm.radb.net', 'port': 43, 'source': 'RADB'}
 
 #: Bulk insert queue
 bulk_insert_queue = deque()
-MAX_BULK_INSERT_QUEUE_SIZE = 2000
+MAX_BULK_INSERT_QUEUE_SIZE = 20000
+
+#: info_route columns, in the order of the bulk insert queue tuples
+INFO_ROUTE_COLUMNS = ('prefix', 'prefix_len', 'origin_as', 'descr', 'source')
+
+#: info_route primary key columns
+INFO_ROUTE_KEY_COLUMNS = ('prefix', 'prefix_len', 'origin_as', 'source')
+
+#: info_route upsert conflict clause
+INFO_ROUTE_CONFLICT = ("ON CONFLICT (prefix,prefix_len,origin_as,source) DO UPDATE SET "
+                       "   descr=excluded.descr, timestamp=now()")
+
+#: Bulk aut-num insert queue
+bulk_autnum_queue = deque()
+
+#: Marker in the first value of aut-num tuples, see parse_autnum_object()
+AUTNUM = 'aut-num'
+
+#: info_asn columns, in the order of the aut-num tuples after the marker
+INFO_ASN_COLUMNS = ('asn', 'as_name', 'org_id', 'remarks', 'source')
+
+#: info_asn upsert conflict clause.  aut-num objects from the RR DB files replace entries from the
+#:    same source, entries without a source and entries from the cymru DNS fallback.  Entries from
+#:    the RIR whois (see gen_whois_asn.py) are authoritative and are not replaced.
+INFO_ASN_CONFLICT = ("ON CONFLICT (asn) DO UPDATE SET "
+                     "   as_name=excluded.as_name, org_id=excluded.org_id, remarks=excluded.remarks,"
+                     "   source=excluded.source, timestamp=(now() at time zone 'utc') "
+                     " WHERE info_asn.source IS NULL OR info_asn.source = excluded.source"
+                     "       OR info_asn.source LIKE 'cymru-%' OR info_asn.source LIKE 'delegated-%'")
+
+#: Regex to find the aut-num attributes that are imported
+RE_AUTNUM_ATTR = re.compile(rb'^(aut-num|as-name|descr|org):[ \t]*(.*?)[ \t]*$', re.M)
+
+#: Indexes built on a new source partition after it is loaded, keyed by index name suffix.
+#:    These must match the info_route indexes so that they are used when the partition is attached.
+INFO_ROUTE_INDEXES = {
+    "pkey": "CREATE UNIQUE INDEX {name} ON {table} (prefix,prefix_len,origin_as,source)",
+    "origin_as_idx": "CREATE INDEX {name} ON {table} (origin_as)",
+    "prefix_gist_idx": "CREATE INDEX {name} ON {table} USING GIST (prefix inet_ops)",
+    "prefix_idx": "CREATE INDEX {name} ON {table} (prefix inet_ops)",
+}
+
+#: Size of the chunks read from the RR DB file
+READ_CHUNK_SIZE = 1024 * 1024
+
+#: FTP socket timeout in seconds
+FTP_TIMEOUT = 300
+
+#: Max number of downloaded blocks queued while streaming, before the download waits for the parser
+STREAM_QUEUE_SIZE = 256
 
 #: Temp directory
 TMP_DIR = '/tmp/rr_dbase'
 
+#: State directory, used to keep the route snapshot of the last import per source
+STATE_DIR = '/var/lib/openbmp/rr_dbase'
+
 
 # ----------------------------------------------------------------
 
 
-def import_rr_db_file(db, source, db_filename):
+def import_rr_db_file(db, source, db_filename, table=None, snapshot=None, jobs=1, stream=None,
+                      gzip_backend=None, autnum=False):
     """ Reads RR DB file and imports into database
 
     ..see: http://irr.net/docs/list.html for details of RR FTP/DB files
 
-    :param db:              DbAccess reference
+    When a snapshot of the previous import is given, only the routes that were added or
+    changed are upserted and the routes that are no longer in the file are deleted.
+
+    aut-num objects are always upserted into info_asn, see INFO_ASN_CONFLICT.
+
+    A route that is in the file more than once is written last, so that the last one in
+    the file is kept, see write_duplicate_routes().
+
+    :param db:              dbWriter or dbWriterPool reference
     :param source:          Source of the data (i.e. key value of RR_DB_FTP dict)
     :param db_filename:     Filename of DB file to import
+    :param table:           Table to copy the routes into, None to upsert into info_route
+    :param snapshot:        Route snapshot of the previous import (see route_key_hash()), None to
+                            import all routes.  Routes found in the file are removed from it.
+    :param jobs:            Number of parser processes, 1 to parse in this process
+    :param stream:          rrStream to import instead of reading db_filename
+    :param gzip_backend:    Backend to decompress the file, see gzipReader.selectBackend()
+    :param autnum:          True to also import the aut-num objects into info_asn
+
+    :return: Route snapshot of this import
     """
-    record = {'source': source}
     inf = None
+    new_snapshot = {}
+    duplicates = {}
+    changed = 0
+    autnums = 0
+
+    if (stream is not None):
+        print("Parsing %s while downloading" % source)
+        chunks = stream
+
+    else:
+        print("Parsing %s" % db_filename)
+        if (db_filename.endswith(".gz")):
+            inf = gzipReader.openGzip(db_filename, gzip_backend)
+        else:
+            inf = open(db_filename, 'rb')
+
+        chunks = iter(lambda: inf.read(READ_CHUNK_SIZE), b'')
 
-    print("Parsing %s" % db_filename)
-    if (db_filename.endswith(".gz")):
-        inf = gzip.open(db_filename, 'rb')
+    if (jobs > 1):
+        routes = parse_rr_parallel(align_rr_chunks(chunks), source, jobs, autnum)
     else:
-        inf = open(db_filename, 'r')
+        routes = parse_rr_objects(chunks, source, autnum)
+
+    for route in routes:
+        if route[0] == AUTNUM:
+            add_autnum_to_db(db, route)
+            autnums += 1
+            continue
+
+        # Routes without a descr are not imported
+        if route[3] is None:
+            continue
+
+        (key, content_hash) = route_key_hash(route)
+
+        if key in new_snapshot:
+            duplicates[key] = route
+            new_snapshot[key] = content_hash
+            continue
 
+        new_snapshot[key] = content_hash
+
+        if snapshot is None or snapshot.pop(key, None) != content_hash:
+            add_route_to_db(db, route, table=table)
+            changed += 1
+
+    # Commit any pending items
+    add_route_to_db(db, None, commit=True, table=table)
+    add_autnum_to_db(db, None, commit=True)
+
+    if (duplicates):
+        print("%s: %d routes are in the file more than once, the last one is kept" % (source, len(duplicates)))
+        write_duplicate_routes(db, duplicates.values(), table)
+
+    # Close the file
     if (inf != None):
-        recordComplete = False
-        prev_attr = ""
+        inf.close()
+
+    if autnum:
+        print("%s: %d aut-num objects imported" % (source, autnums))
+
+    if snapshot is not None:
+        print("%s: %d routes added/changed, %d routes deleted" % (source, changed, len(snapshot)))
+        delete_routes_from_db(db, source, snapshot)
+
+    return new_snapshot
+
+
+def parse_rr_objects(chunks, source, autnum=False):
+    """ Parses route objects from RPSL data
+
+    Objects are cut on empty lines without decoding the data, see parse_rr_object().
+
+    :param chunks:          Iterable of bytes chunks, which do not need to be object aligned
+    :param source:          Source of the data (i.e. key value of RR_DB_FTP dict)
+    :param autnum:          True to also return aut-num tuples, see parse_autnum_object()
+
+    :return: Generator of route tuples, see parse_rr_object()
+    """
+    rest = b''
+
+    for chunk in chunks:
+        objs = (rest + chunk).split(b'\n\n')
+
+        # Last object may continue in the next chunk
+        rest = objs.pop()
+
+        for obj in objs:
+            route = parse_rr_object(obj, source, autnum)
+            if route:
+                yield route
+
+    # Last object may not be followed by an empty line
+    route = parse_rr_object(rest, source, autnum)
+    if route:
+        yield route
+
+
+def align_rr_chunks(chunks, size=READ_CHUNK_SIZE):
+    """ Joins and cuts chunks so that they end at an object boundary
+
+    :param chunks:          Iterable of bytes chunks
+    :param size:            Minimum size of the chunks, chunks are cut at the last empty line
+
+    :return: Generator of bytes chunks that end at an object boundary
+    """
+    pending = []
+    pending_size = 0
+
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_size += len(chunk)
+
+        if pending_size < size:
+            continue
+
+        data = b''.join(pending)
+        end = data.rfind(b'\n\n')
+
+        if end < 0:
+            pending = [data]
+        else:
+            pending = [data[end + 2:]]
+            yield data[:end]
 
-        for line in inf:
-            line = line.decode("utf-8", "ignore")
-            line = line.rstrip('\n')
-            line = line.replace("\t", " ")
+        pending_size = len(pending[0])
 
-            # empty line means record is complete
-            if len(line) == 0:
-                recordComplete = True
+    if pending_size:
+        yield b''.join(pending)
+
+
+def parse_rr_chunk(chunk, source, autnum=False):
+    """ Parses the route objects of an object aligned chunk, used by the parser processes
+
+    :param chunk:           Bytes chunk, see align_rr_chunks()
+    :param source:          Source of the data (i.e. key value of RR_DB_FTP dict)
+    :param autnum:          True to also return aut-num tuples, see parse_autnum_object()
+
+    :return: List of route tuples, see parse_rr_object()
+    """
+    return list(parse_rr_objects((chunk,), source, autnum))
+
+
+def parse_rr_parallel(chunks, source, jobs, autnum=False):
+    """ Parses object aligned chunks using a pool of processes
+
+    The routes are returned in file order.  The number of chunks being parsed is limited
+    so that reading does not get ahead of the parsers.
+
+    :param chunks:          Iterable of object aligned chunks, see align_rr_chunks()
+    :param source:          Source of the data (i.e. key value of RR_DB_FTP dict)
+    :param jobs:            Number of parser processes
+    :param autnum:          True to also return aut-num tuples, see parse_autnum_object()
+
+    :return: Generator of route tuples, see parse_rr_object()
+    """
+    pending = deque()
+
+    # Downloads may still be running in other threads, so the parsers are not forked from this process
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('forkserver')) as pool:
+        for chunk in chunks:
+            pending.append(pool.submit(parse_rr_chunk, chunk, source, autnum))
+
+            if len(pending) >= jobs * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+
+def parse_rr_object(obj, source, autnum=False):
+    """ Parses a route or route6 object
+
+    Only the descr value is decoded. Other object types and objects that do not
+    parse are skipped.
+
+    :param obj:             RPSL object bytes, without the empty line that ends the object
+    :param source:          Source of the data (i.e. key value of RR_DB_FTP dict)
+    :param autnum:          True to also parse aut-num objects, see parse_autnum_object()
+
+    :return: tuple of ('<prefix>/<len>', prefix_len, origin_as, descr, source), where descr is None
+             if the object has no descr.  None if the object is not a route object.
+    """
+    if not (obj.startswith(b'route') or b'\nroute' in obj):
+        if autnum and (obj.startswith(b'aut-num') or b'\naut-num' in obj):
+            return parse_autnum_object(obj, source)
+
+        return None
+
+    if b'\t' in obj:
+        obj = obj.replace(b'\t', b' ')
+
+    prefix = None
+    prefix_len = None
+    origin_as = None
+    descr = None
+    prev_attr = None
+
+    try:
+        for line in obj.split(b'\n'):
+            first = line[:1]
 
             # Skip lines with a comment
-            elif line[0] == '#' or line[0] == '%':
+            if first == b'#' or first == b'%' or not first:
+                continue
+
+            elif first == b' ':
+                # Line is a continuation of previous attribute
+                if prev_attr == b'descr':
+                    descr += b'\n' + line.strip()
+                continue
+
+            (attr, sep, value) = line.partition(b': ')
+            if not sep:
                 continue
 
-            elif line[0] == ' ':
-                if prev_attr == 'descr':
-                    #print "continuation: (%s) '%s'\n\t\t%r" % (prev_attr, line, record)
-                    # Line is a continuation of previous attribute
-                    try:
-                        value = line.strip()
-                        value = value.replace("'", "")
-                        value = value.replace("\\", "")
+            attr = attr.strip()
+            value = value.strip()
 
-                        record[WHOIS_ATTR_MAP[prev_attr]] += "\n" + value
+            if (attr == b'origin'):
+                # Strip off characters 'AS'
+                value = value[2:].split(b' ', 1)[0]
 
-                    except:
-                        print("problem with continuation: (%s) '%s'\n\t\t%r" % (prev_attr, line, record))
-                        pass
+                # Convert from dot notation back to numeric
+                if b'.' in value:
+                    a = value.split(b'.', 1)
+                    origin_as = (int(a[0]) << 16) + int(a[1])
 
-            elif ': ' in line:
-                # Parse the attributes and build record
-                (attr, value) = line.split(': ', 1)
-                attr = attr.strip()
-                value = value.strip()
-                value = value.replace("'", "")
-                value = value.replace("\\", "")
+                else:
+                    origin_as = int(value)
 
-                if (attr == 'origin'):
-                    # Strip off characters 'AS'
-                    value = value[2:]
+            elif (attr == b'route' or attr == b'route6'):
+                # Extract out the prefix_len
+                a = value.split(b'/')
+                prefix_len = int(a[1])
+                prefix = a[0].decode('utf-8', 'ignore')
 
-                    if ' ' in value:
-                        value = value.split(' ', 1)[0]
+            # allow appending duplicate attributes
+            elif (attr == b'descr'):
+                descr = value if descr is None else descr + b' \n' + value
 
-                    # Convert from dot notation back to numeric
-                    if "." in value:
-                        a = value.split('.', 1)
-                        record[WHOIS_ATTR_MAP[attr]] = (int(a[0]) << 16) + int(a[1])
+            prev_attr = attr
 
-                    else:
-                        record[WHOIS_ATTR_MAP[attr]] = int(value)
+    except (ValueError, IndexError):
+        print("problem parsing object: %r" % obj[:200])
+        return None
 
-                elif (attr == 'route' or attr == 'route6'):
-                    # Extract out the prefix_len
-                    a = value.split('/')
-                    record['prefix_len'] = int(a[1])
-                    record[WHOIS_ATTR_MAP[attr]] = a[0]
+    if prefix is None or origin_as is None:
+        return None
 
-                # allow appending duplicate attributes
-                elif (attr == 'descr' and WHOIS_ATTR_MAP[attr] in record):
-                    record[WHOIS_ATTR_MAP[attr]] += ' \n' + value
+    if descr is not None:
+        descr = descr.decode('utf-8', 'ignore')[:254]
 
-                elif (attr in WHOIS_ATTR_MAP):
-                    record[WHOIS_ATTR_MAP[attr]] = value
+    return ("%s/%d" % (prefix, prefix_len), prefix_len, origin_as, descr, source)
 
-                prev_attr = attr
 
-            if recordComplete:
-                recordComplete = False
+def parse_autnum_object(obj, source):
+    """ Parses an aut-num object
 
-                if 'prefix' in record:
-                    add_route_to_db(db, record)
+    Only the attributes that are imported into info_asn are decoded.  Multiple descr
+    attributes are joined, as they are by gen_whois_asn.parse_whois().
 
-                record = {'source': source}
+    :param obj:             RPSL object bytes, without the empty line that ends the object
+    :param source:          Source of the data (i.e. key value of RR_DB_FTP dict)
 
-        # Commit any pending items
-        add_route_to_db(db, {}, commit=True)
+    :return: tuple of (AUTNUM, asn, as_name, org_id, remarks, source), None if the object does not parse
+    """
+    attrs = {}
 
-        # Close the file
-        inf.close()
+    for m in RE_AUTNUM_ATTR.finditer(obj):
+        if m.group(1) in attrs and m.group(1) == b'descr':
+            attrs[b'descr'] += b'\n' + m.group(2)
+        elif m.group(1) not in attrs:
+            attrs[m.group(1)] = m.group(2)
 
+    try:
+        value = attrs[b'aut-num'].upper()
+        value = value[2:] if value.startswith(b'AS') else value
+
+        # Convert from dot notation back to numeric
+        if b'.' in value:
+            a = value.split(b'.', 1)
+            asn = (int(a[0]) << 16) + int(a[1])
+        else:
+            asn = int(value)
+
+    except (KeyError, ValueError):
+        return None
+
+    values = [attrs[attr].decode('utf-8', 'ignore')[:254] if attr in attrs else None
+              for attr in (b'as-name', b'org', b'descr')]
+
+    return (AUTNUM, asn, values[0], values[1], values[2], source)
+
+
+def route_key_hash(route):
+    """ Returns the snapshot key and content hash of a route
+
+    :param route:       Route tuple, see parse_rr_object()
+
+    :return: tuple of (key, hash) where key is '<prefix>/<len> <origin_as>' and the hash
+             is a 64 bit int of the values that are not part of the key
+    """
+    key = "%s %d" % (route[0], route[2])
+    content_hash = int.from_bytes(hashlib.blake2b(route[3].encode('utf-8'), digest_size=8).digest(), 'big')
 
-def add_route_to_db(db, record, commit=False):
+    return key, content_hash
+
+
+def delete_routes_from_db(db, source, keys):
+    """ Deletes routes from DB
+
+    :param db:          DbAccess reference
+    :param source:      Source of the routes
+    :param keys:        Iterable of route snapshot keys, see route_key_hash()
+    """
+    rows = []
+
+    for key in keys:
+        (prefix, origin_as) = key.split(' ')
+        rows.append((prefix, int(prefix.split('/')[1]), int(origin_as), source))
+
+        if (len(rows) >= MAX_BULK_INSERT_QUEUE_SIZE):
+            db.bulkDelete("info_route", INFO_ROUTE_KEY_COLUMNS, rows)
+            rows = []
+
+    if (len(rows)):
+        db.bulkDelete("info_route", INFO_ROUTE_KEY_COLUMNS, rows)
+
+
+def load_snapshot(filename):
+    """ Loads the route snapshot of the previous import
+
+    :param filename:    Snapshot filename
+
+    :return: Snapshot dictionary, None if there is no usable snapshot
+    """
+    try:
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+    except FileNotFoundError:
+        return None
+
+    except Exception as err:
+        print("Unable to load snapshot %s, ignoring it: %s" % (filename, err))
+        return None
+
+
+def save_snapshot(filename, snapshot):
+    """ Saves the route snapshot of this import, replacing the previous snapshot
+
+    :param filename:    Snapshot filename
+    :param snapshot:    Snapshot dictionary, None to remove the snapshot
+    """
+    if (snapshot is None):
+        if (os.path.exists(filename)):
+            os.remove(filename)
+        return
+
+    if (not os.path.exists(os.path.dirname(filename))):
+        os.makedirs(os.path.dirname(filename))
+
+    with open(filename + '.tmp', 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(filename + '.tmp', filename)
+
+
+def add_route_to_db(db, route, commit=False, table=None):
     """ Adds/updates route in DB
 
     :param db:          DbAccess reference
-    :param record:      Dictionary of column names and values
-    :param commit:      True to flush/commit the queue and this record, False to queue
+    :param route:       Route tuple, see parse_rr_object(), or None to only commit
+    :param commit:      True to flush/commit the queue and this route, False to queue
                         and perform bulk insert.
+    :param table:       Table to copy the routes into, None to upsert into info_route
 
     :return: True if updated, False if error
     """
     # Add entry to queue
-    if (len(record) > 4):
-        bulk_insert_queue.append("('%s/%d'::inet,%d,%u,'%s', '%s')" % (record['prefix'], record['prefix_len'],
-                                                                       record['prefix_len'],
-                                                                       record['origin_as'],
-                                                                       record['descr'][:254],
-                                                                       record['source']))
+    if (route):
+        bulk_insert_queue.append(route)
 
     # Insert/commit the queue if commit is True or if reached max queue size
     if ((commit == True or len(bulk_insert_queue) > MAX_BULK_INSERT_QUEUE_SIZE) and
             len(bulk_insert_queue)):
-        query = "INSERT INTO info_route (prefix,prefix_len,origin_as,descr,source) "
-        query += " SELECT DISTINCT ON (prefix,origin_as) * FROM ( VALUES "
+        if (table):
+            db.bulkCopy(table, INFO_ROUTE_COLUMNS, bulk_insert_queue)
+        else:
+            db.bulkUpsert("info_route", INFO_ROUTE_COLUMNS, bulk_insert_queue,
+                          conflict=INFO_ROUTE_CONFLICT, distinctOn=('prefix', 'origin_as'))
+
+        bulk_insert_queue.clear()
+
+
+def write_duplicate_routes(db, routes, table=None):
+    """ Writes the last occurrence of the routes that are in the file more than once
+
+    The first occurrence was already queued.  Batches are written in parallel by the
+    writers, so the queued writes are flushed first and the first occurrence is then
+    replaced, regardless of which writer wrote it.
+
+    :param db:          dbWriter or dbWriterPool reference
+    :param routes:      Iterable of route tuples, see parse_rr_object()
+    :param table:       Table the routes were copied into, None if upserted into info_route
+    """
+    routes = list(routes)
+
+    db.flush()
+
+    if (table):
+        db.bulkDelete(table, INFO_ROUTE_KEY_COLUMNS, [(r[0], r[1], r[2], r[4]) for r in routes])
+        db.flush()
+        db.bulkCopy(table, INFO_ROUTE_COLUMNS, routes)
+    else:
+        db.bulkUpsert("info_route", INFO_ROUTE_COLUMNS, routes,
+                      conflict=INFO_ROUTE_CONFLICT, distinctOn=('prefix', 'origin_as'))
+
+
+def add_autnum_to_db(db, autnum, commit=False):
+    """ Adds/updates aut-num in info_asn
+
+    :param db:          DbAccess reference
+    :param autnum:      aut-num tuple, see parse_autnum_object(), or None to only commit
+    :param commit:      True to flush/commit the queue, False to queue and perform bulk insert.
+    """
+    if (autnum):
+        bulk_autnum_queue.append(autnum[1:])
+
+    if ((commit == True or len(bulk_autnum_queue) > MAX_BULK_INSERT_QUEUE_SIZE) and
+            len(bulk_autnum_queue)):
+        db.bulkUpsert("info_asn", INFO_ASN_COLUMNS, bulk_autnum_queue,
+                      conflict=INFO_ASN_CONFLICT, distinctOn=('asn',))
+
+        bulk_autnum_queue.clear()
+
+
+def prepare_source_partition(db, source):
+    """ Creates an empty table, without indexes, to load a new partition for the source
+
+    :param db:          DbAccess reference
+    :param source:      Source of the data (i.e. key value of RR_DB_FILES dict)
+
+    :return: Name of the table to load, None if error
+    """
+    table = "info_route_%s_new" % source
+
+    if (not db.queryNoResults("DROP TABLE IF EXISTS %s;"
+                              "CREATE TABLE %s (LIKE info_route INCLUDING DEFAULTS)" % (table, table))):
+        return None
+
+    return table
+
+
+def build_source_partition(writer, source, table):
+    """ Builds the indexes of the loaded partition table and analyzes it
+
+    The table has no duplicate routes, see write_duplicate_routes().  The indexes are
+    queued to the writers so they are built in parallel when there is more than one writer.
+
+    :param writer:      dbWriterPool used to load the table
+    :param source:      Source of the data (i.e. key value of RR_DB_FILES dict)
+    :param table:       Loaded table
+    """
+    writer.flush()
+
+    for suffix in INFO_ROUTE_INDEXES:
+        writer.queryNoResults(INFO_ROUTE_INDEXES[suffix].format(name="%s_%s" % (table, suffix), table=table))
+    writer.flush()
+
+    # The check constraint allows the partition to be attached without scanning it
+    writer.queryNoResults("ALTER TABLE %s ADD CONSTRAINT %s_pkey PRIMARY KEY USING INDEX %s_pkey;"
+                          "ALTER TABLE %s ADD CONSTRAINT %s_source_check CHECK (source = '%s');"
+                          "ANALYZE %s" % (table, table, table, table, table, source, table))
+    writer.flush()
+
+
+def swap_source_partition(db, source, table):
+    """ Replaces the source partition of info_route with the loaded table in one transaction
+
+    :param db:          DbAccess reference
+    :param source:      Source of the data (i.e. key value of RR_DB_FILES dict)
+    :param table:       Loaded table, see build_source_partition()
+
+    :return: True if swapped, None if error
+    """
+    partition = "info_route_%s" % source
+
+    exists = table_exists(db, partition)
+    if (exists is None):
+        return None
+
+    stmts = ["SET LOCAL lock_timeout = '60s'"]
+
+    if (exists):
+        stmts += ["ALTER TABLE info_route DETACH PARTITION %s" % partition,
+                  "DROP TABLE %s" % partition]
+
+    # Routes for the source may be in the default partition, such as after migrating from
+    #    a non partitioned table
+    stmts += ["DELETE FROM info_route_default WHERE source = '%s'" % source,
+              "ALTER TABLE %s RENAME TO %s" % (table, partition)]
+
+    for suffix in INFO_ROUTE_INDEXES:
+        if (suffix == 'pkey'):
+            stmts.append("ALTER TABLE %s RENAME CONSTRAINT %s_pkey TO %s_pkey" % (partition, table, partition))
+        else:
+            stmts.append("ALTER INDEX %s_%s RENAME TO %s_%s" % (table, suffix, partition, suffix))
+
+    stmts += ["ALTER TABLE info_route ATTACH PARTITION %s FOR VALUES IN ('%s')" % (partition, source),
+              "ALTER TABLE %s DROP CONSTRAINT %s_source_check" % (partition, table)]
+
+    return db.queryNoResults(';'.join(stmts))
+
+
+def mirror_rr_source(db, source, serial, host, port):
+    """ Applies the NRTM changes after the serial to info_route
+
+    Consecutive operations of the same type are applied in one batch, so that the changes
+    are applied in serial order.
+
+    :param db:          DbAccess reference
+    :param source:      Source of the data (i.e. key value of RR_NRTM dict)
+    :param serial:      Last serial that was applied
+    :param host:        NRTM server host
+    :param port:        NRTM server port
+
+    :return: Last serial that was applied
+    :raises nrtmClient.nrtmError: if the NRTM server returns an error, such as the serial no
+                                  longer being available
+    """
+    client = nrtmClient.nrtmClient(host, port)
+    pending = OrderedDict()
+    pending_op = None
+    applied_serial = serial
+    counts = {'ADD': 0, 'DEL': 0}
+
+    # Querying past the last serial is an error, which would force a bootstrap
+    try:
+        available = client.currentSerial(RR_NRTM[source]['source'])
+
+    except OSError as err:
+        print("%s: NRTM sources query to %s failed: %s" % (source, host, err))
+        return serial
+
+    if (available is None):
+        raise nrtmClient.nrtmError("%s is not available for mirroring from %s" % (source, host))
+
+    elif (available[1] <= serial):
+        print("%s: no new NRTM serials after %d" % (source, serial))
+        return serial
+
+    elif (available[0] > serial + 1):
+        raise nrtmClient.nrtmError("serial %d is no longer available, first serial is %d" % (
+            serial + 1, available[0]))
+
+    try:
+        for (op, op_serial, lines) in client.query(RR_NRTM[source]['source'], serial + 1):
+            route = parse_rr_object('\n'.join(lines).encode('utf-8'), source)
+
+            if route:
+                # Routes without a descr are not imported, the same as import_rr_db_file(),
+                #    so an update that removes the descr deletes the route
+                if (op == 'ADD' and route[3] is None):
+                    op = 'DEL'
+
+                if (op != pending_op or len(pending) >= MAX_BULK_INSERT_QUEUE_SIZE):
+                    if (not write_nrtm_changes(db, pending_op, pending)):
+                        return applied_serial
+
+                    applied_serial = serial
+                    pending_op = op
+                    pending.clear()
+
+                pending[(route[0], route[2])] = route
+                counts[op] += 1
+
+            serial = op_serial
+
+    except OSError as err:
+        # Changes received before the connection failed are still applied
+        print("%s: NRTM query to %s failed: %s" % (source, host, err))
+
+    if (write_nrtm_changes(db, pending_op, pending)):
+        applied_serial = serial
 
+    print("%s: applied NRTM serials up to %d, %d routes added/changed, %d routes deleted" % (
+        source, applied_serial, counts['ADD'], counts['DEL']))
 
-        # try:
-        while bulk_insert_queue:
-            query += "%s," % bulk_insert_queue.popleft()
+    return applied_serial
 
-        # except IndexError:
-        #     # No more entries
-        #     pass
 
-        # Remove the last comma if present
-        if (query.endswith(',')):
-            query = query[:-1]
+def write_nrtm_changes(db, op, changes):
+    """ Writes a batch of NRTM changes to info_route
 
-        query += " ) t(prefix,prefix_len,origin_as,descr,source) " # add order by if needed
-        query += " ON CONFLICT (prefix,prefix_len,origin_as) DO UPDATE SET "
-        query += "   descr=excluded.descr, source=excluded.source, timestamp=now()"
+    :param db:          DbAccess reference
+    :param op:          NRTM operation, ADD or DEL
+    :param changes:     Dictionary of info_route row tuples
+
+    :return: True if written, None if error
+    """
+    if (len(changes) == 0):
+        return True
+
+    elif (op == 'ADD'):
+        return db.bulkUpsert("info_route", INFO_ROUTE_COLUMNS, list(changes.values()),
+                             conflict=INFO_ROUTE_CONFLICT)
+
+    else:
+        return db.bulkDelete("info_route", INFO_ROUTE_KEY_COLUMNS,
+                             [(r[0], r[1], r[2], r[4]) for r in changes.values()])
+
+
+def load_serial(filename):
+    """ Loads a serial number from a file
+
+    :param filename:    Serial filename, such as the CURRENTSERIAL file of the source
+
+    :return: Serial number, None if there is no serial
+    """
+    try:
+        with open(filename, 'r') as f:
+            return int(f.read().strip())
+
+    except (OSError, ValueError):
+        return None
+
+
+def save_serial(filename, serial):
+    """ Saves the last applied NRTM serial
+
+    :param filename:    Serial filename
+    :param serial:      Serial number, None to remove the serial
+    """
+    if (serial is None):
+        if (os.path.exists(filename)):
+            os.remove(filename)
+        return
+
+    if (not os.path.exists(os.path.dirname(filename))):
+        os.makedirs(os.path.dirname(filename))
+
+    with open(filename + '.tmp', 'w') as f:
+        f.write("%d\n" % serial)
+
+    os.replace(filename + '.tmp', filename)
+
+
+def table_exists(db, table):
+    """ Checks if a table exists
+
+    :param db:          DbAccess reference
+    :param table:       Table name
 
-        # print "QUERY = %s" % query
-        # print "----------------------------------------------------------------"
-        db.queryNoResults(query)
+    :return: True if it exists, False if not, None if error
+    """
+    rows = db.query("SELECT to_regclass('%s')" % table)
+    if (rows is None):
+        return None
+
+    return rows[0][0] is not None
+
+
+def get_remote_file_info(ftp, filename):
+    """ Gets the modification time and size of a file on the FTP server
+
+    :param ftp:         Connected FTP reference, in the directory of the file
+    :param filename:    Filename
+
+    :return: Dictionary of mdtm and size, values are None if the server does not support them
+    """
+    info = {'mdtm': None, 'size': None}
+
+    try:
+        info['mdtm'] = ftp.sendcmd("MDTM %s" % filename).split(' ', 1)[1].strip()
+    except error_perm:
+        pass
+
+    try:
+        ftp.voidcmd("TYPE I")
+        info['size'] = ftp.size(filename)
+    except error_perm:
+        pass
+
+    return info
+
+
+def file_unchanged(info, state):
+    """ Checks if the remote file is the same as the file of the last import
+
+    :param info:        Remote file info, see get_remote_file_info()
+    :param state:       File state of the last import, see load_file_state()
+
+    :return: True if the modification time and size are known and have not changed
+    """
+    if (not state or info['mdtm'] is None or info['size'] is None):
+        return False
+
+    return state.get('mdtm') == info['mdtm'] and state.get('size') == info['size']
+
+
+def load_file_state(filename):
+    """ Loads the file state of the last import
+
+    :param filename:    State filename
+
+    :return: Dictionary of mdtm, size and sha256 of the imported file, None if there is no state
+    """
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+
+    except (OSError, ValueError):
+        return None
+
+
+def save_file_state(filename, state):
+    """ Saves the file state of the last import
+
+    :param filename:    State filename
+    :param state:       Dictionary of mdtm, size and sha256 of the imported file
+    """
+    if (not os.path.exists(os.path.dirname(filename))):
+        os.makedirs(os.path.dirname(filename))
+
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(state, f)
+
+    os.replace(filename + '.tmp', filename)
+
+
+def download_data_file(source, state=None):
+    """ Download the RR data file of a source
+
+    The file is downloaded to a temp name and renamed when complete, so a failed
+    download does not leave a partial file to import.
+
+    :param source:      Source to download (i.e. key value of RR_DB_FTP dict)
+    :param state:       File state of the last import, None to always download
+
+    :return: tuple of (file info, changed).  The file info is the remote file info and the
+             sha256 of the file.  Changed is False if the file is the same as the last import.
+    """
+    start_time = time()
+
+    print ("Downloading %s..." % source)
+    ftp = FTP(RR_DB_FTP[source]['site'], timeout=FTP_TIMEOUT)
+
+    try:
+        ftp.login()
+        ftp.cwd(RR_DB_FTP[source]['path'])
+
+        info = get_remote_file_info(ftp, RR_DB_FTP[source]['filename'])
+        if (file_unchanged(info, state)):
+            print ("      %s has not changed, skipping" % source)
+            ftp.quit()
+            return state, False
+
+        # The serial is downloaded first, so it is not newer than the file
+        filenames = [RR_DB_FTP[source]['filename']]
+        if ('serial_filename' in RR_DB_FTP[source]):
+            filenames.insert(0, RR_DB_FTP[source]['serial_filename'])
+
+        for filename in filenames:
+            sha256 = hashlib.sha256()
+
+            with open("%s/%s.tmp" % (TMP_DIR, filename), 'wb') as f:
+                def write(data):
+                    f.write(data)
+                    sha256.update(data)
+
+                ftp.retrbinary("RETR %s" % filename, write)
+
+        for filename in filenames:
+            os.replace("%s/%s.tmp" % (TMP_DIR, filename), "%s/%s" % (TMP_DIR, filename))
+
+        ftp.quit()
+
+    finally:
+        ftp.close()
+
+    # Hash is of the last file, which is the data file
+    info['sha256'] = sha256.hexdigest()
+
+    print ("      Done downloading %s in %.1f seconds" % (source, time() - start_time))
+
+    if (state and state.get('sha256') == info['sha256']):
+        print ("      %s content has not changed, skipping" % source)
+        return info, False
+
+    return info, True
+
+
+class rrStream:
+    """ Streams a RR data file from FTP, decompressing it while it downloads
+
+        The FTP connection is opened and the serial file is downloaded when the stream is created.
+        The data file is downloaded by a thread while the stream is iterated.
+    """
+
+    def __init__(self, source, tee=False, state=None, gzip_backend=None):
+        """ Constructor
+
+            :param source:      Source to download (i.e. key value of RR_DB_FTP dict)
+            :param tee:         True to also save the compressed data file to TMP_DIR
+            :param state:       File state of the last import, None to always download.  If the
+                                file has not changed, unchanged is set and nothing is downloaded.
+            :param gzip_backend: Backend to decompress the stream, see gzipReader.selectBackend()
+        """
+        self.source = source
+        self.filename = RR_DB_FTP[source]['filename']
+        self.tee = tee
+        self.gzip_backend = gzip_backend
+        self.queue = Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.abort = threading.Event()
+        self.thread = None
+        self.info = None
+        self.unchanged = False
+
+        if (not os.path.exists(TMP_DIR)):
+            os.makedirs(TMP_DIR)
+
+        print ("Streaming %s..." % source)
+        self.ftp = FTP(RR_DB_FTP[source]['site'], timeout=FTP_TIMEOUT)
+
+        try:
+            self.ftp.login()
+            self.ftp.cwd(RR_DB_FTP[source]['path'])
+
+            # sha256 is added once the whole file is streamed
+            self.info = get_remote_file_info(self.ftp, self.filename)
+            if (file_unchanged(self.info, state)):
+                print ("      %s has not changed, skipping" % source)
+                self.unchanged = True
+                self.ftp.quit()
+                self.ftp.close()
+                return
+
+            if ('serial_filename' in RR_DB_FTP[source]):
+                filename = RR_DB_FTP[source]['serial_filename']
+
+                with open("%s/%s.tmp" % (TMP_DIR, filename), 'wb') as f:
+                    self.ftp.retrbinary("RETR %s" % filename, f.write)
+
+                os.replace("%s/%s.tmp" % (TMP_DIR, filename), "%s/%s" % (TMP_DIR, filename))
+
+        except:
+            self.ftp.close()
+            raise
+
+        self.thread = threading.Thread(target=self._download, daemon=True)
+        self.thread.start()
+
+    def _download(self):
+        """ Downloads the data file into the queue, ending with None or the exception """
+        try:
+            self.ftp.retrbinary("RETR %s" % self.filename, self._put)
+            self.ftp.quit()
+            self._put(None)
 
+        except Exception as err:
+            if (not self.abort.is_set()):
+                self._put(err)
 
-def download_data_file():
+        finally:
+            self.ftp.close()
+
+    def _put(self, data):
+        while True:
+            if (self.abort.is_set()):
+                raise EOFError("stream closed")
+
+            try:
+                self.queue.put(data, timeout=1)
+                return
+
+            except Full:
+                pass
+
+    def __iter__(self):
+        """ Returns the decompressed data chunks """
+        if (self.filename.endswith(".gz")):
+            return gzipReader.decompressChunks(self._chunks(), self.gzip_backend)
+
+        return self._chunks()
+
+    def _chunks(self):
+        """ Returns the downloaded data chunks
+
+            The tee file is only kept if the whole file was downloaded.
+        """
+        tee_filename = "%s/%s" % (TMP_DIR, self.filename)
+        tee_file = open(tee_filename + '.tmp', 'wb') if self.tee else None
+        sha256 = hashlib.sha256()
+
+        try:
+            while True:
+                data = self.queue.get()
+
+                if (data is None):
+                    break
+
+                elif (isinstance(data, Exception)):
+                    raise data
+
+                sha256.update(data)
+
+                if (tee_file):
+                    tee_file.write(data)
+
+                yield data
+
+            self.info['sha256'] = sha256.hexdigest()
+
+            if (tee_file):
+                tee_file.close()
+                tee_file = None
+                os.replace(tee_filename + '.tmp', tee_filename)
+
+        finally:
+            if (tee_file):
+                tee_file.close()
+                os.remove(tee_filename + '.tmp')
+
+            self.close()
+
+    def close(self):
+        """ Stops the download if it is still running """
+        self.abort.set()
+
+        if (self.thread):
+            self.thread.join()
+
+
+def download_data_files(sources, cfg):
     """ Download the RR data files
+
+    Files are downloaded concurrently, one thread per source.  When streaming, each source
+    is opened as a stream one at a time instead.  Files that have not changed since the last
+    import are skipped, unless forced.
+
+    :param sources:     List of sources to download
+    :param cfg:         Config, see parseCmdArgs()
+
+    :return: Generator of tuples of (source, stream, file info) as the downloads complete.
+             Sources that are not in RR_DB_FTP are returned first, with a stream and file
+             info of None.  Sources that fail to download are skipped.
     """
     if (not os.path.exists(TMP_DIR)):
         os.makedirs(TMP_DIR)
 
-    for source in RR_DB_FTP:
-        try:
-            print ("Downloading %s..." % source)
-            ftp = FTP(RR_DB_FTP[source]['site'])
-            ftp.login()
-            ftp.cwd(RR_DB_FTP[source]['path'])
-            ftp.retrbinary("RETR %s" % RR_DB_FTP[source]['filename'],
-                           open("%s/%s" % (TMP_DIR, RR_DB_FTP[source]['filename']), 'wb').write)
-            ftp.quit()
-            print ("      Done downloading %s" % source)
-        except:
-            print ("Error processing %s, skipping" % source)
-            traceback.print_exc()
+    for source in sources:
+        if (source not in RR_DB_FTP):
+            yield source, None, None
+
+    downloads = OrderedDict()
+    for source in sources:
+        if (source not in RR_DB_FTP):
+            continue
+
+        state_filename = "%s/%s.file" % (cfg['state_dir'], source)
+
+        # A mirror bootstrap always needs the file
+        if (cfg['force'] or (cfg['mirror'] and source in RR_NRTM)):
+            downloads[source] = None
+        else:
+            downloads[source] = load_file_state(state_filename)
+
+    if (cfg['stream']):
+        for source in downloads:
+            try:
+                stream = rrStream(source, tee=cfg['tee'], state=downloads[source], gzip_backend=cfg['gzip'])
+
+            except:
+                print ("Error downloading %s, skipping" % source)
+                traceback.print_exc()
+                continue
+
+            if (not stream.unchanged):
+                yield source, stream, stream.info
+
+    elif (len(downloads)):
+        with ThreadPoolExecutor(max_workers=len(downloads)) as pool:
+            futures = {pool.submit(download_data_file, source, downloads[source]): source
+                       for source in downloads}
+
+            for future in as_completed(futures):
+                source = futures[future]
+
+                try:
+                    (info, changed) = future.result()
+
+                except:
+                    print ("Error downloading %s, skipping" % source)
+                    traceback.print_exc()
+                    continue
+
+                if (changed):
+                    yield source, None, info
+
+                # Same content with a new modification time, so it is not downloaded again
+                else:
+                    save_file_state("%s/%s.file" % (cfg['state_dir'], source), info)
+
+
+def import_source(db, writer, cfg, source, stream=None):
+    """ Imports the downloaded RR data file of a source
+
+    The source is either updated with only the changes since the last import, or is loaded
+    into a new partition that replaces the existing source partition.
+
+    :param db:          DbAccess reference
+    :param writer:      dbWriterPool reference
+    :param cfg:         Config, see parseCmdArgs()
+    :param source:      Source of the data (i.e. key value of RR_DB_FILES dict)
+    :param stream:      rrStream to import instead of the downloaded file
+
+    :return: True if imported, False if error
+    """
+    snapshot_filename = "%s/%s.snapshot" % (cfg['state_dir'], source)
+    db_filename = "%s/%s" % (TMP_DIR, RR_DB_FILES[source]['filename'])
+    new_snapshot = None
+    success = False
+
+    try:
+        # The previous mirror serial is removed first, so that a failed bootstrap is retried on the next run
+        mirror_serial = None
+        if (cfg['mirror'] and source in RR_NRTM):
+            mirror_serial = load_serial("%s/%s" % (TMP_DIR, RR_DB_FTP[source]['serial_filename']))
+            save_serial("%s/%s.serial" % (cfg['state_dir'], source), None)
+
+        failed = writer.failed()
+        snapshot = None if cfg['full'] or mirror_serial else load_snapshot(snapshot_filename)
+
+        if (snapshot is not None and table_exists(db, "info_route_%s" % source)):
+            new_snapshot = import_rr_db_file(writer, source, db_filename, snapshot=snapshot,
+                                             jobs=cfg['jobs'], stream=stream, gzip_backend=cfg['gzip'],
+                                             autnum=cfg['autnum'])
+            writer.flush()
+
+        else:
+            table = prepare_source_partition(db, source)
+
+            if (table):
+                new_snapshot = import_rr_db_file(writer, source, db_filename, table, jobs=cfg['jobs'],
+                                                 stream=stream, gzip_backend=cfg['gzip'],
+                                                 autnum=cfg['autnum'])
+                build_source_partition(writer, source, table)
+
+                if (swap_source_partition(db, source, table)):
+                    print("Replaced info_route partition for %s" % source)
+                else:
+                    new_snapshot = None
+
+        # The snapshot is only valid if every batch was written
+        if (writer.failed() != failed):
+            new_snapshot = None
+
+        success = new_snapshot is not None
+
+        # The mirror is bootstrapped, NRTM changes will be applied starting after the file serial.
+        #    The snapshot is not saved since NRTM changes will make it out of date.
+        if (mirror_serial and new_snapshot is not None):
+            save_serial("%s/%s.serial" % (cfg['state_dir'], source), mirror_serial)
+            print("%s: NRTM mirror bootstrapped at serial %d" % (source, mirror_serial))
+            new_snapshot = None
+
+    except:
+        traceback.print_exc()
+        new_snapshot = None
+        success = False
+
+    finally:
+        if (stream):
+            stream.close()
+
+        # Rows left queued by a failed import must not be written with the next source
+        bulk_insert_queue.clear()
+        bulk_autnum_queue.clear()
+
+    try:
+        save_snapshot(snapshot_filename, new_snapshot)
+
+    except OSError as err:
+        print("Unable to save snapshot %s: %s" % (snapshot_filename, err))
+
+    return success
 
 
 def script_exit(status=0):
@@ -253,7 +1261,19 @@ def parseCmdArgs(argv):
                 {
                     user:       <username>,
                     password:   <password>,
-                    db_host:    <database host>
+                    db_host:    <database host>,
+                    db_name:    <database name>,
+                    writers:    <number of DB writers>,
+                    state_dir:  <state directory>,
+                    full:       <True to import all routes>,
+                    jobs:       <number of parser processes>,
+                    stream:     <True to import while downloading>,
+                    tee:        <True to keep the streamed file>,
+                    force:      <True to import files that have not changed>,
+                    gzip:       <gzip backend, None to select the fastest available>,
+                    autnum:     <True to import aut-num objects into info_asn>,
+                    mirror:     <True to mirror using NRTM>,
+                    nrtm_host:  <NRTM server host:port, None to use RR_NRTM>
                 }
     """
     REQUIRED_ARGS = 3
@@ -261,15 +1281,28 @@ def parseCmdArgs(argv):
     cmd_args = {'user': None,
                 'password': None,
                 'db_host': None,
-                'db_name': "openbmp"}
+                'db_name': "openbmp",
+                'writers': 1,
+                'state_dir': STATE_DIR,
+                'full': False,
+                'jobs': 1,
+                'stream': False,
+                'tee': False,
+                'force': False,
+                'gzip': None,
+                'autnum': True,
+                'mirror': False,
+                'nrtm_host': None}
 
     if (len(argv) < 3):
         usage(argv[0])
         sys.exit(1)
 
     try:
-        (opts, args) = getopt.getopt(argv[1:], "hu:p:d:",
-                                     ["help", "user=", "password=", "dbName="])
+        (opts, args) = getopt.getopt(argv[1:], "hu:p:d:w:s:fmj:Sz:",
+                                     ["help", "user=", "password=", "dbName=", "writers=", "stateDir=", "full",
+                                      "mirror", "nrtmHost=", "jobs=", "stream", "tee", "force",
+                                      "gzip=", "noAutNum"])
 
         for o, a in opts:
             if o in ("-h", "--help"):
@@ -288,6 +1321,39 @@ def parseCmdArgs(argv):
                 found_req_args += 1
                 cmd_args['db_name'] = a
 
+            elif o in ("-w", "--writers"):
+                cmd_args['writers'] = int(a)
+
+            elif o in ("-s", "--stateDir"):
+                cmd_args['state_dir'] = a
+
+            elif o in ("-f", "--full"):
+                cmd_args['full'] = True
+
+            elif o in ("-j", "--jobs"):
+                cmd_args['jobs'] = int(a)
+
+            elif o in ("-S", "--stream"):
+                cmd_args['stream'] = True
+
+            elif o in ("--tee",):
+                cmd_args['tee'] = True
+
+            elif o in ("--force",):
+                cmd_args['force'] = True
+
+            elif o in ("--noAutNum",):
+                cmd_args['autnum'] = False
+
+            elif o in ("-z", "--gzip"):
+                cmd_args['gzip'] = gzipReader.selectBackend(a)
+
+            elif o in ("-m", "--mirror"):
+                cmd_args['mirror'] = True
+
+            elif o in ("--nrtmHost",):
+                cmd_args['nrtm_host'] = a
+
             else:
                 usage(argv[0])
                 sys.exit(1)
@@ -310,7 +1376,7 @@ def parseCmdArgs(argv):
 
         return cmd_args
 
-    except (getopt.GetoptError, TypeError) as err:
+    except (getopt.GetoptError, TypeError, ValueError) as err:
         print (str(err))  # will print something like "option -a not recognized"
         usage(argv[0])
         sys.exit(2)
@@ -331,6 +1397,19 @@ def usage(prog):
     print ("OPTIONAL OPTIONS:")
     print ("  -h, --help".ljust(30) + "Print this help menu")
     print ("  -d, --dbName".ljust(30) + "Database name, default is 'openbmp'")
+    print ("  -w, --writers".ljust(30) + "Number of parallel DB writers/connections, default is 1")
+    print ("  -s, --stateDir".ljust(30) + "Directory to keep the last import snapshots, default is '%s'" % STATE_DIR)
+    print ("  -f, --full".ljust(30) + "Import all routes, instead of only the changes since the last import")
+    print ("  -j, --jobs".ljust(30) + "Number of processes to parse the RR DB files, default is 1")
+    print ("  -S, --stream".ljust(30) + "Import the RR DB files while they download, without saving them")
+    print ("  --tee".ljust(30) + "With --stream, also save the RR DB files to '%s'" % TMP_DIR)
+    print ("  -z, --gzip".ljust(30) + "gzip backend, one of auto, %s.  Default is auto, which is %s"
+           % (', '.join(gzipReader.BACKENDS), gzipReader.selectBackend()))
+    print ("  --noAutNum".ljust(30) + "Do not import the aut-num objects of the RR DB files into info_asn")
+    print ("  --force".ljust(30) + "Download and import the RR DB files even if they have not changed")
+    print ("  -m, --mirror".ljust(30) + "Apply NRTM changes to the sources in RR_NRTM, importing the files")
+    print ("".ljust(30) + "  only to bootstrap the mirror")
+    print ("  --nrtmHost".ljust(30) + "NRTM server host[:port] to use instead of the RR_NRTM servers")
 
 
 def main():
@@ -338,21 +1417,53 @@ def main():
     """
     cfg = parseCmdArgs(sys.argv)
 
-    # Download the RR data files
-    download_data_file()
-
     db = dbHandler.dbHandler()
     db.connectDb(cfg['user'], cfg['password'], cfg['db_host'], cfg['db_name'])
 
-    for source in RR_DB_FILES:
-        try:
-            import_rr_db_file(db, source, "%s/%s" % (TMP_DIR, RR_DB_FILES[source]['filename']))
-        except:
-            traceback.print_exc()
+    # Mirrored sources are updated using NRTM, once they have been bootstrapped from the file
+    sources = list(RR_DB_FILES)
+
+    if (cfg['mirror']):
+        for source in RR_NRTM:
+            serial_filename = "%s/%s.serial" % (cfg['state_dir'], source)
+            serial = load_serial(serial_filename)
+
+            if (serial is None or not table_exists(db, "info_route_%s" % source)):
+                continue
+
+            sources.remove(source)
+
+            if (cfg['nrtm_host']):
+                (host, port) = (cfg['nrtm_host'].split(':', 1) + [43])[:2]
+            else:
+                (host, port) = (RR_NRTM[source]['host'], RR_NRTM[source]['port'])
+
+            try:
+                save_serial(serial_filename, mirror_rr_source(db, source, serial, host, int(port)))
+
+            except nrtmClient.nrtmError as err:
+                # Serial is likely no longer available, so bootstrap again on the next run
+                print("%s: NRTM error, mirror will be bootstrapped on the next run: %s" % (source, err))
+                save_serial(serial_filename, None)
+
+    # Batches are written by write-behind threads while parsing continues
+    writer = dbHandler.dbWriterPool(cfg['user'], cfg['password'], cfg['db_host'], cfg['db_name'],
+                                    writers=cfg['writers'])
+
+    # Each source is imported as soon as its download completes, while the others continue to download.
+    #    When streaming, sources are downloaded one at a time while they are imported.
+    for (source, stream, file_info) in download_data_files(sources, cfg):
+        start_time = time()
+
+        # The file state is saved after a successful import, so unchanged files are skipped next time
+        if (import_source(db, writer, cfg, source, stream) and file_info):
+            save_file_state("%s/%s.file" % (cfg['state_dir'], source), file_info)
 
+        print("Imported %s in %.1f seconds" % (source, time() - start_time))
 
     #rmtree(TMP_DIR)
 
+    writer.close()
     db.close()
 
 
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+  Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+
+  This program and the accompanying materials are made available under the
+  terms of the Eclipse Public License v1.0 which accompanies this distribution,
+  and is available at http://www.eclipse.org/legal/epl-v10.html
+
+  Gzip decompression using the fastest available backend
+
+  Backends are:
+      isal  - python-isal (igzip) bindings, if installed
+      pigz  - 'pigz -dc' subprocess, if pigz is in the path.  Only for files.
+      zlib  - Python zlib, always available
+"""
+import gzip
+import io
+import shutil
+import subprocess
+import zlib
+
+try:
+    from isal import igzip, isal_zlib
+except ImportError:
+    igzip = None
+    isal_zlib = None
+
+#: Backends in order of preference
+BACKENDS = ('isal', 'pigz', 'zlib')
+
+#: Size of the pipe buffer for the pigz subprocess
+PIGZ_BUFFER_SIZE = 1024 * 1024
+
+
+def availableBackends():
+    """ Returns the backends that are available
+
+        :return: List of backend names, in order of preference
+    """
+    available = []
+
+    if (igzip is not None):
+        available.append('isal')
+
+    if (shutil.which('pigz')):
+        available.append('pigz')
+
+    available.append('zlib')
+
+    return available
+
+
+def selectBackend(backend=None, stream=False):
+    """ Selects a backend
+
+        :param backend:     Backend name, None or 'auto' to select the fastest available
+        :param stream:      True if the backend is used to decompress a stream instead of a file
+
+        :return: Backend name
+        :raises ValueError: if the backend is unknown or not available
+    """
+    available = availableBackends()
+
+    # pigz reads a file, so it is not used for streams
+    if (stream and 'pigz' in available):
+        available.remove('pigz')
+
+    if (backend is None or backend == 'auto'):
+        return available[0]
+
+    if (backend not in BACKENDS):
+        raise ValueError("unknown gzip backend '%s', must be one of auto, %s" % (backend, ', '.join(BACKENDS)))
+
+    if (backend not in available):
+        raise ValueError("gzip backend '%s' is not available" % backend)
+
+    return backend
+
+
+def openGzip(filename, backend=None):
+    """ Opens a gzip file for reading
+
+        :param filename:    Gzip filename
+        :param backend:     Backend name, see selectBackend()
+
+        :return: Binary file object of the decompressed data
+    """
+    backend = selectBackend(backend)
+
+    if (backend == 'isal'):
+        return igzip.open(filename, 'rb')
+
+    elif (backend == 'pigz'):
+        return io.BufferedReader(pigzFile(filename), PIGZ_BUFFER_SIZE)
+
+    return gzip.open(filename, 'rb')
+
+
+def decompressObj(backend=None):
+    """ Returns a decompressor for a gzip stream
+
+        The decompressor has the zlib.decompressobj interface, see eof and unused_data
+        for multi-member streams.
+
+        :param backend:     Backend name, see selectBackend()
+
+        :return: Decompress object
+    """
+    if (selectBackend(backend, stream=True) == 'isal'):
+        return isal_zlib.decompressobj(wbits=31)
+
+    return zlib.decompressobj(wbits=31)
+
+
+def decompressChunks(chunks, backend=None):
+    """ Decompresses a gzip stream
+
+        :param chunks:      Iterable of compressed bytes chunks, such as the blocks of a download
+        :param backend:     Backend name, see selectBackend()
+
+        :return: Generator of decompressed bytes chunks
+        :raises EOFError: if the stream ends in the middle of a gzip member, such as a cut
+                          short download
+    """
+    decompressor = decompressObj(backend)
+    partial = False
+
+    for data in chunks:
+        # The stream may have more than one gzip member
+        while data:
+            out = decompressor.decompress(data)
+            partial = True
+
+            if out:
+                yield out
+
+            if decompressor.eof:
+                # Null padding after a member is ignored, as it is by gzip.open
+                data = decompressor.unused_data.lstrip(b'\x00')
+                decompressor = decompressObj(backend)
+                partial = False
+            else:
+                data = b''
+
+    if (partial):
+        raise EOFError("compressed stream ended before the end-of-stream marker was reached")
+
+
+class pigzFile(io.RawIOBase):
+    """ Raw file object that reads the output of 'pigz -dc'
+
+        Decompression runs in the pigz process, in parallel with reading.
+    """
+
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+        self.proc = subprocess.Popen(['pigz', '-dc', filename], stdout=subprocess.PIPE,
+                                     bufsize=PIGZ_BUFFER_SIZE)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self.proc.stdout.readinto(b)
+
+    def close(self):
+        """ Closes the pipe and checks that pigz completed
+
+            :raises OSError: if pigz failed
+        """
+        if (self.closed):
+            return
+
+        try:
+            complete = not self.proc.stdout.read(1)
+            self.proc.stdout.close()
+
+            if (not complete):
+                self.proc.kill()
+
+            if (self.proc.wait() != 0 and complete):
+                raise OSError("pigz failed to decompress %s, exit code %d" % (self.filename, self.proc.returncode))
+
+        finally:
+            super().close()
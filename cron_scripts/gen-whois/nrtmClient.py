@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+  Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+
+  This program and the accompanying materials are made available under the
+  terms of the Eclipse Public License v1.0 which accompanies this distribution,
+  and is available at http://www.eclipse.org/legal/epl-v10.html
+
+  NRTM (Near Real Time Mirroring) v3 client
+
+  ..see: https://www.ripe.net/manage-ips-and-asns/db/support/documentation/ripe-database-documentation/mirroring
+"""
+import re
+import socket
+
+#: Default socket timeout in seconds
+NRTM_TIMEOUT = 120
+
+#: Regex to parse the start of an NRTM v3 response, such as '%START Version: 3 RADB 100-200'
+RE_START = re.compile(r'^%START Version: *(\d+) +(\S+) +(\d+)-(\d+)')
+
+#: Regex to parse a source in the sources query response, such as 'RADB:3:N:1-200'
+RE_SOURCE = re.compile(r'^(\S+):(\d+):([XYN]):(\d+)-(\d+)')
+
+#: Regex to parse an operation, such as 'ADD 100'
+RE_OPERATION = re.compile(r'^(ADD|DEL) +(\d+)$')
+
+
+class nrtmError(Exception):
+    """ Error reported by the NRTM server, such as an invalid serial range """
+    pass
+
+
+class nrtmClient:
+    """ NRTM v3 client
+
+        Each query uses a new connection, similar to whois.
+    """
+
+    def __init__(self, host, port=43, timeout=NRTM_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def _request(self, request):
+        """ Sends a request and returns a line iterator of the response
+
+            :param request:     Request without the line ending
+
+            :return: Generator of the response lines, without the line ending
+        """
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+            sock.sendall(("%s\n" % request).encode('ascii'))
+
+            with sock.makefile('rb') as f:
+                for line in f:
+                    yield line.decode('utf-8', 'ignore').rstrip('\r\n')
+
+    def currentSerial(self, source):
+        """ Gets the serial range available for the source
+
+            :param source:      IRR source, such as RADB
+
+            :return: tuple of (first, last) serials, None if the source is not mirrorable
+        """
+        for line in self._request("-q sources"):
+            m = RE_SOURCE.match(line)
+
+            if m and m.group(1).upper() == source.upper():
+                if m.group(3) == 'N':
+                    return None
+
+                return int(m.group(4)), int(m.group(5))
+
+        return None
+
+    def query(self, source, first, last='LAST'):
+        """ Gets the operations for a serial range
+
+            Operations are returned in serial order.
+
+            :param source:      IRR source, such as RADB
+            :param first:       First serial to get
+            :param last:        Last serial to get, or LAST for the most recent
+
+            :return: Generator of tuples of (operation, serial, lines), where operation is
+                     ADD or DEL and lines is the list of object lines
+            :raises nrtmError: if the server returns an error
+            :raises ConnectionError: if the response is incomplete
+        """
+        lines = self._request("-g %s:3:%d-%s" % (source.upper(), first, last))
+        started = False
+        op = None
+        obj = []
+
+        for line in lines:
+            if not started:
+                if line.startswith('%START'):
+                    m = RE_START.match(line)
+                    if not m or m.group(1) != '3':
+                        raise nrtmError("unsupported response: %s" % line)
+                    started = True
+
+                elif line.startswith('%ERROR') or line.startswith('%% ERROR'):
+                    raise nrtmError(line)
+
+                continue
+
+            if op is None:
+                m = RE_OPERATION.match(line)
+
+                if m:
+                    op = (m.group(1), int(m.group(2)))
+
+                elif line.startswith('%END'):
+                    return
+
+                elif line.startswith('%ERROR') or line.startswith('%% ERROR'):
+                    raise nrtmError(line)
+
+            # Blank line after the operation, before the object
+            elif len(line) == 0 and len(obj) == 0:
+                continue
+
+            # Blank line at the end of the object
+            elif len(line) == 0:
+                yield op[0], op[1], obj
+                op = None
+                obj = []
+
+            # End without a blank line after the last object
+            elif line.startswith('%END'):
+                yield op[0], op[1], obj
+                return
+
+            else:
+                obj.append(line)
+
+        if not started:
+            raise ConnectionError("no response from %s" % self.host)
+
+        raise ConnectionError("response from %s ended without %%END" % self.host)
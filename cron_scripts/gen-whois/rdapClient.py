@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+  Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+
+  This program and the accompanying materials are made available under the
+  terms of the Eclipse Public License v1.0 which accompanies this distribution,
+  and is available at http://www.eclipse.org/legal/epl-v10.html
+
+  RDAP client for ASN (autnum) lookups
+
+  The RDAP server for an ASN is found using the IANA ASN bootstrap registry.  HTTP
+  keep-alive connections are pooled per server and shared by the lookup threads.
+
+  ..see: https://www.rfc-editor.org/rfc/rfc9224 (bootstrap)
+         https://www.rfc-editor.org/rfc/rfc9083 (responses)
+"""
+from bisect import bisect_right
+from time import sleep
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+#: IANA ASN bootstrap registry
+RDAP_BOOTSTRAP_URL = "https://data.iana.org/rdap/asn.json"
+
+#: Timeout in seconds for an RDAP request
+RDAP_TIMEOUT = 30
+
+#: Max number of pooled connections per RDAP server
+RDAP_POOL_SIZE = 8
+
+#: Max number of times a rate limited (429) request is retried
+RDAP_MAX_RETRIES = 3
+
+#: Seconds to wait before retrying a rate limited request if the server does not send Retry-After
+RDAP_RETRY_AFTER = 10
+
+#: Whois source name by a part of the RDAP server hostname, see gen_whois_asn.WHOIS_SOURCES
+RDAP_SOURCES = (('arin', 'arin'), ('ripe', 'ripe'), ('apnic', 'apnic'),
+                ('afrinic', 'afrinic'), ('lacnic', 'lacnic'))
+
+
+class rdapClient:
+    """ RDAP ASN client
+
+        The client is thread safe after the bootstrap is loaded.
+    """
+
+    def __init__(self, poolSize=RDAP_POOL_SIZE, timeout=RDAP_TIMEOUT, bootstrapUrl=RDAP_BOOTSTRAP_URL):
+        """ Constructor
+
+            :param poolSize:        Max number of pooled connections per server, should be
+                                    at least the number of lookup threads
+            :param timeout:         Timeout in seconds for a request
+            :param bootstrapUrl:    URL of the IANA ASN bootstrap registry
+        """
+        self.timeout = timeout
+        self.bootstrapUrl = bootstrapUrl
+
+        self.session = requests.Session()
+        self.session.headers['Accept'] = 'application/rdap+json'
+        adapter = HTTPAdapter(pool_connections=len(RDAP_SOURCES), pool_maxsize=poolSize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.starts = []
+        self.ends = []
+        self.servers = []
+
+    def close(self):
+        self.session.close()
+
+    def loadBootstrap(self):
+        """ Loads the ASN ranges and servers from the bootstrap registry
+
+            :return: Number of ASN ranges loaded
+            :raises requests.RequestException: if the download fails
+        """
+        resp = self.session.get(self.bootstrapUrl, timeout=self.timeout)
+        resp.raise_for_status()
+
+        ranges = []
+
+        for (asnRanges, urls) in resp.json().get('services', []):
+            # Prefer https
+            urls = sorted(urls, key=lambda url: not url.startswith('https'))
+            server = urls[0] if urls[0].endswith('/') else urls[0] + '/'
+
+            for r in asnRanges:
+                (start, _, end) = r.partition('-')
+                ranges.append((int(start), int(end or start), server))
+
+        ranges.sort()
+
+        self.starts = [r[0] for r in ranges]
+        self.ends = [r[1] for r in ranges]
+        self.servers = [r[2] for r in ranges]
+
+        return len(ranges)
+
+    def server(self, asn):
+        """ Finds the RDAP server base URL of an ASN
+
+            :param asn:         ASN number
+
+            :return: Base URL, ending with a slash, None if the ASN is not in the bootstrap
+        """
+        i = bisect_right(self.starts, int(asn)) - 1
+
+        if (i >= 0 and int(asn) <= self.ends[i]):
+            return self.servers[i]
+
+        return None
+
+    def query(self, asn):
+        """ Queries the RDAP server for an ASN
+
+            :param asn:         ASN number
+
+            :return: tuple of (server, dict of the RDAP autnum response), (server, None) if
+                     the ASN is not found
+            :raises requests.RequestException: if the request fails
+        """
+        server = self.server(asn)
+        if (not server):
+            return None, None
+
+        for attempt in range(RDAP_MAX_RETRIES + 1):
+            resp = self.session.get("%sautnum/%s" % (server, asn), timeout=self.timeout)
+
+            if (resp.status_code == 429 and attempt < RDAP_MAX_RETRIES):
+                try:
+                    sleep(int(resp.headers.get('Retry-After', RDAP_RETRY_AFTER)))
+                except ValueError:
+                    sleep(RDAP_RETRY_AFTER)
+                continue
+
+            if (resp.status_code == 404):
+                return server, None
+
+            resp.raise_for_status()
+            return server, resp.json()
+
+    def lookup(self, asn):
+        """ Lookup an ASN
+
+            :param asn:         ASN number
+
+            :return: dict of info_asn column names and values, empty if not found
+            :raises requests.RequestException: if the request fails
+        """
+        (server, autnum) = self.query(asn)
+
+        if (not autnum):
+            return {}
+
+        return parseAutnum(autnum, sourceName(server))
+
+
+def sourceName(server):
+    """ Gets the whois source name of an RDAP server
+
+        :param server:      RDAP server base URL
+
+        :return: Source name, or the server hostname if it is not a known RIR
+    """
+    host = urlparse(server).hostname or server
+
+    for (name, source) in RDAP_SOURCES:
+        if (name in host.split('.')):
+            return source
+
+    return host
+
+
+def clean(value):
+    """ Removes the characters that whois values have removed, see gen_whois_asn.parse_whois() """
+    return value.replace("'", "").replace("\\", "").strip()
+
+
+def parseVcard(vcardArray):
+    """ Parses the vCard (jCard) of an entity
+
+        :param vcardArray:  RDAP vcardArray, ["vcard", [[name, params, type, value], ...]]
+
+        :return: dict of info_asn column names and values
+    """
+    record = {}
+
+    if (len(vcardArray) < 2):
+        return record
+
+    for prop in vcardArray[1]:
+        if (len(prop) < 4):
+            continue
+
+        (name, params, value) = (prop[0], prop[1], prop[3])
+
+        if (name == 'fn' and isinstance(value, str)):
+            record['org_name'] = clean(value)
+
+        elif (name == 'adr'):
+            if (isinstance(params, dict) and isinstance(params.get('label'), str)):
+                record['address'] = clean(params['label'])
+
+            # Structured address: pobox, ext, street, locality, region, code, country
+            if (isinstance(value, list) and len(value) >= 7):
+                for (col, idx) in (('city', 3), ('state_prov', 4), ('postal_code', 5), ('country', 6)):
+                    if (isinstance(value[idx], str) and value[idx]):
+                        record[col] = clean(value[idx])
+
+                if ('address' not in record):
+                    street = value[2] if isinstance(value[2], list) else [value[2]]
+                    lines = [v for v in street + value[3:7] if isinstance(v, str) and v]
+                    if (lines):
+                        record['address'] = clean('\n'.join(lines))
+
+            if (isinstance(params, dict) and isinstance(params.get('cc'), str)):
+                record['country'] = clean(params['cc'])
+
+    return record
+
+
+def parseAutnum(autnum, source):
+    """ Parses an RDAP autnum response
+
+        The registrant entity is used for the org values.
+
+        :param autnum:      dict of the RDAP autnum response
+        :param source:      Source name of the server
+
+        :return: dict of info_asn column names and values, empty if there is no name
+    """
+    if (not autnum.get('name')):
+        return {}
+
+    record = {'as_name': clean(autnum['name']), 'source': source}
+
+    remarks = []
+    for remark in autnum.get('remarks', []):
+        remarks.extend(remark.get('description', []))
+
+    if (remarks):
+        record['remarks'] = clean('\n'.join(remarks))
+
+    for entity in autnum.get('entities', []):
+        if ('registrant' in entity.get('roles', [])):
+            if (entity.get('handle')):
+                record['org_id'] = clean(entity['handle'])
+
+            record.update(parseVcard(entity.get('vcardArray', [])))
+            break
+
+    if (autnum.get('country')):
+        record['country'] = clean(autnum['country'])
+
+    return record
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+  Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+
+  This program and the accompanying materials are made available under the
+  terms of the Eclipse Public License v1.0 which accompanies this distribution,
+  and is available at http://www.eclipse.org/legal/epl-v10.html
+
+  Index of the ASN delegations in the RIR delegated-extended statistics files
+
+  Each line of the file is registry|cc|type|start|value|date|status[|opaque-id[|extensions...]]
+  For type asn, start is the first ASN and value is the number of ASN's.
+
+  ..see: https://ftp.ripe.net/pub/stats/ripencc/RIR-Statistics-Exchange-Format.txt
+"""
+import urllib.request
+from bisect import bisect_right
+
+#: Timeout in seconds for downloading a file
+DOWNLOAD_TIMEOUT = 300
+
+#: Delegation status values that are indexed, others are available or reserved
+DELEGATED_STATUS = ('allocated', 'assigned')
+
+#: Registry name in the file to the whois source name, see gen_whois_asn.WHOIS_SOURCES
+REGISTRY_SOURCES = {'ripencc': 'ripe'}
+
+
+class rirDelegations:
+    """ ASN delegation index
+
+        Delegated ranges are kept in sorted arrays so that a lookup is a bisect
+        of the range starts.
+    """
+
+    def __init__(self):
+        self.ranges = []
+        self.starts = []
+        self.ends = []
+        self.values = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def parse(self, lines):
+        """ Adds the ASN delegations from a delegated-extended file
+
+            The index must be rebuilt by build() after adding all the files.
+
+            :param lines:       Iterable of the file lines, str or bytes
+
+            :return: Number of ASN ranges added
+        """
+        count = 0
+
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', 'ignore')
+
+            fields = line.strip().split('|')
+
+            # Skip comments, the version line and the summary lines
+            if (len(fields) < 7 or line[0] == '#' or fields[2] != 'asn' or fields[3] == '*'):
+                continue
+
+            if (fields[6] not in DELEGATED_STATUS):
+                continue
+
+            try:
+                start = int(fields[3])
+                end = start + int(fields[4]) - 1
+            except ValueError:
+                continue
+
+            registry = REGISTRY_SOURCES.get(fields[0], fields[0])
+            country = fields[1].upper() if fields[1] else None
+
+            self.ranges.append((start, end, registry, country))
+            count += 1
+
+        return count
+
+    def download(self, url):
+        """ Downloads and adds a delegated-extended file
+
+            :param url:         URL of the file
+
+            :return: Number of ASN ranges added
+        """
+        with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as resp:
+            return self.parse(resp)
+
+    def build(self):
+        """ Builds the sorted lookup arrays from the added ranges """
+        self.ranges.sort()
+
+        self.starts = [r[0] for r in self.ranges]
+        self.ends = [r[1] for r in self.ranges]
+        self.values = [(r[2], r[3]) for r in self.ranges]
+
+    def lookup(self, asn):
+        """ Finds the registry and country of an ASN
+
+            :param asn:         ASN number
+
+            :return: tuple of (registry, country), None if the ASN is not delegated
+        """
+        i = bisect_right(self.starts, int(asn)) - 1
+
+        if (i >= 0 and int(asn) <= self.ends[i]):
+            return self.values[i]
+
+        return None
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+  Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+
+  This program and the accompanying materials are made available under the
+  terms of the Eclipse Public License v1.0 which accompanies this distribution,
+  and is available at http://www.eclipse.org/legal/epl-v10.html
+
+  Benchmark of the gzipReader backends
+
+  Decompresses a gzip file, or a synthetic RR DB dump, with each available backend,
+  both as a file (openGzip) and as a stream (decompressChunks).  Prints the MB/sec of
+  each and checks that every backend returns the same data.  isal is used when
+  python-isal is installed and pigz when it is in the path.
+
+  Run from cron_scripts/gen-whois:
+      python3 test/bench_gzip.py [-f <file.gz>] [-s <MB>]
+"""
+import getopt
+import gzip
+import hashlib
+import os
+import random
+import sys
+import tempfile
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gzipReader
+
+#: Size in MB of the uncompressed synthetic dump
+DEFAULT_SIZE = 256
+
+#: Size of the chunks read, the same as gen_whois_route.READ_CHUNK_SIZE
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def synthetic_dump(filename, size, seed=1):
+    """ Writes a synthetic RR DB dump, as two gzip members like a concatenated download
+
+    :param filename:    gzip filename to write
+    :param size:        Uncompressed size in MB
+    :param seed:        Random seed, so that runs are comparable
+
+    :return: sha256 hex digest of the uncompressed data
+    """
+    rnd = random.Random(seed)
+    digest = hashlib.sha256()
+    written = 0
+    i = 0
+
+    with open(filename, 'wb') as raw:
+        for member in range(2):
+            with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+                while written < size * 1024 * 1024 * (member + 1) // 2:
+                    objs = []
+
+                    for n in range(1000):
+                        i += 1
+                        objs.append("route:      10.%d.%d.0/24\ndescr:      Customer %d\norigin:     AS%d\n"
+                                    "mnt-by:     MAINT-%d\nsource:     RADB\n\n" % (
+                                        i % 256, i // 256 % 256, i, rnd.randint(1, 400000), i % 1000))
+
+                    data = ''.join(objs).encode('utf-8')
+                    f.write(data)
+                    digest.update(data)
+                    written += len(data)
+
+    return digest.hexdigest()
+
+
+def read_file(filename, backend):
+    """ Decompresses a file using openGzip()
+
+    :return: tuple of (size, sha256 hex digest)
+    """
+    digest = hashlib.sha256()
+    size = 0
+
+    with gzipReader.openGzip(filename, backend) as f:
+        for data in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(data)
+            size += len(data)
+
+    return size, digest.hexdigest()
+
+
+def read_stream(filename, backend):
+    """ Decompresses a file as a stream of chunks using decompressChunks(), as while downloading
+
+    :return: tuple of (size, sha256 hex digest)
+    """
+    digest = hashlib.sha256()
+    size = 0
+
+    with open(filename, 'rb') as f:
+        for data in gzipReader.decompressChunks(iter(lambda: f.read(READ_CHUNK_SIZE), b''), backend):
+            digest.update(data)
+            size += len(data)
+
+    return size, digest.hexdigest()
+
+
+def usage(prog):
+    print("Usage: %s [options]" % prog)
+    print("")
+    print("  -f | --file     <filename>  gzip file to decompress, such as radb.db.gz")
+    print("  -s | --size     <MB>        Uncompressed size of the synthetic dump (default %d)" % DEFAULT_SIZE)
+
+
+def main():
+    filename = None
+    size = DEFAULT_SIZE
+
+    try:
+        (opts, args) = getopt.getopt(sys.argv[1:], "hf:s:", ["help", "file=", "size="])
+
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage(sys.argv[0])
+        sys.exit(2)
+
+    for (o, a) in opts:
+        if o in ("-h", "--help"):
+            usage(sys.argv[0])
+            sys.exit(0)
+        elif o in ("-f", "--file"):
+            filename = a
+        elif o in ("-s", "--size"):
+            size = int(a)
+
+    expected = None
+    tmp = None
+
+    if (not filename):
+        tmp = tempfile.NamedTemporaryFile(suffix='.gz', delete=False)
+        tmp.close()
+        filename = tmp.name
+
+        print("Writing %d MB synthetic dump to %s" % (size, filename))
+        expected = synthetic_dump(filename, size)
+
+    available = gzipReader.availableBackends()
+    for backend in gzipReader.BACKENDS:
+        if (backend not in available):
+            print("%s is not available, skipped" % backend)
+
+    runs = [('file', backend, read_file) for backend in available]
+
+    # pigz only reads files, see gzipReader.selectBackend()
+    runs += [('stream', backend, read_stream) for backend in available if backend != 'pigz']
+
+    # Python's gzip is run first, it is the reference when there is no synthetic dump
+    runs.sort(key=lambda run: run[:2] != ('file', 'zlib'))
+
+    failed = False
+
+    try:
+        for (mode, backend, func) in runs:
+            start = time()
+            (length, digest) = func(filename, backend)
+            elapsed = time() - start
+
+            expected = expected or digest
+
+            print("%-6s %-5s %8.1f MB  %6.2f seconds  %8.1f MB/sec  %s" % (
+                mode, backend, length / (1024 * 1024), elapsed,
+                length / (1024 * 1024) / elapsed if elapsed else 0,
+                "ok" if digest == expected else "MISMATCH"))
+
+            failed = failed or digest != expected
+
+    finally:
+        if (tmp):
+            os.remove(filename)
+
+    if (failed):
+        print("ERROR: backends returned different data")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+  Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+
+  This program and the accompanying materials are made available under the
+  terms of the Eclipse Public License v1.0 which accompanies this distribution,
+  and is available at http://www.eclipse.org/legal/epl-v10.html
+
+  Benchmark of the gen_whois_route RR object parser
+
+  Parses an RR DB file, or a synthetic one, with the replaced line by line parser,
+  parse_rr_objects() and parse_rr_parallel().  Prints the routes per second of each
+  and checks that they return the same routes.
+
+  Run from cron_scripts/gen-whois:
+      python3 test/bench_parse_rr.py [-f <radb.db[.gz]>] [-n <objects>] [-j <jobs>]
+"""
+import getopt
+import os
+import random
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gen_whois_route
+import gzipReader
+from test_gen_whois_route import reference_parse, imported_routes
+
+#: Number of objects in the synthetic file
+DEFAULT_OBJECTS = 200000
+
+
+def synthetic_db(count, seed=1):
+    """ Builds a synthetic RR DB file, with a mix of objects similar to radb.db
+
+    :param count:       Number of objects
+    :param seed:        Random seed, so that runs are comparable
+
+    :return: File data as bytes
+    """
+    rnd = random.Random(seed)
+    objs = []
+
+    for i in range(count):
+        k = rnd.random()
+
+        if k < 0.05:
+            objs.append("aut-num:    AS%d\nas-name:    AS-%d\ndescr:      Network %d\nsource:     RADB" % (i, i, i))
+            continue
+
+        if k < 0.2:
+            lines = ["route6:     2001:db8:%x::/48" % i]
+        else:
+            lines = ["route:      10.%d.%d.0/24" % (i % 256, i // 256 % 256)]
+
+        lines.append("descr:      Customer %d" % i)
+
+        if rnd.random() < 0.2:
+            lines.append("            continued line")
+
+        lines += ["origin:     AS%d" % rnd.randint(1, 400000),
+                  "mnt-by:     MAINT-%d" % (i % 1000),
+                  "changed:    noc@example.com 20220101",
+                  "source:     RADB"]
+        objs.append("\n".join(lines))
+
+    return ("\n\n".join(objs) + "\n\n").encode('utf-8')
+
+
+def bench(name, func, expected=None):
+    """ Runs and times a parser
+
+    :param name:        Name to print
+    :param func:        Function that returns the list of imported routes
+    :param expected:    Routes to check the result against, None to not check
+
+    :return: List of routes
+    """
+    start = time()
+    routes = func()
+    elapsed = time() - start
+
+    print("%-20s %8d routes  %6.2f seconds  %10.0f routes/sec" % (
+        name, len(routes), elapsed, len(routes) / elapsed if elapsed else 0))
+
+    if (expected is not None and routes != expected):
+        print("ERROR: %s routes do not match the reference parser" % name)
+        sys.exit(1)
+
+    return routes
+
+
+def usage(prog):
+    print("Usage: %s [options]" % prog)
+    print("")
+    print("  -f | --file     <filename>  RR DB file to parse, can be gzip compressed (.gz)")
+    print("  -n | --objects  <number>    Number of objects in the synthetic file (default %d)" % DEFAULT_OBJECTS)
+    print("  -j | --jobs     <number>    Number of parser processes for the parallel parser (default %d)" % (
+        os.cpu_count() or 1))
+
+
+def main():
+    filename = None
+    count = DEFAULT_OBJECTS
+    jobs = os.cpu_count() or 1
+
+    try:
+        (opts, args) = getopt.getopt(sys.argv[1:], "hf:n:j:", ["help", "file=", "objects=", "jobs="])
+
+    except getopt.GetoptError as err:
+        print(str(err))
+        usage(sys.argv[0])
+        sys.exit(2)
+
+    for (o, a) in opts:
+        if o in ("-h", "--help"):
+            usage(sys.argv[0])
+            sys.exit(0)
+        elif o in ("-f", "--file"):
+            filename = a
+        elif o in ("-n", "--objects"):
+            count = int(a)
+        elif o in ("-j", "--jobs"):
+            jobs = int(a)
+
+    if (filename):
+        if (filename.endswith(".gz")):
+            with gzipReader.openGzip(filename) as f:
+                data = f.read()
+        else:
+            with open(filename, 'rb') as f:
+                data = f.read()
+    else:
+        data = synthetic_db(count)
+
+    print("Parsing %d MB" % (len(data) // (1024 * 1024)))
+
+    chunks = [data[i:i + gen_whois_route.READ_CHUNK_SIZE] for i in range(0, len(data), gen_whois_route.READ_CHUNK_SIZE)]
+
+    expected = bench("reference", lambda: reference_parse(data.splitlines(keepends=True), 'radb'))
+
+    bench("parse_rr_objects", lambda: imported_routes(gen_whois_route.parse_rr_objects(chunks, 'radb')), expected)
+
+    bench("parse_rr_parallel", lambda: imported_routes(gen_whois_route.parse_rr_parallel(
+        gen_whois_route.align_rr_chunks(chunks), 'radb', jobs)), expected)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+  Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+
+  This program and the accompanying materials are made available under the
+  terms of the Eclipse Public License v1.0 which accompanies this distribution,
+  and is available at http://www.eclipse.org/legal/epl-v10.html
+
+  Tests of the gen_whois_route RR object parser
+
+  The parser output is checked against the line by line parser that it replaced,
+  see reference_parse().
+
+  Run from cron_scripts/gen-whois:
+      python3 -m unittest discover -s test
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import gen_whois_route
+except ImportError as err:
+    # psycopg2 is imported by dbHandler
+    raise unittest.SkipTest("gen_whois_route dependencies are not installed: %s" % err)
+
+#: RPSL sample with the object variations seen in the RR DB files
+SAMPLE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'radb-sample.db')
+
+#: Attribute map of the replaced parser
+REFERENCE_ATTR_MAP = {
+    'route': 'prefix',
+    'route6': 'prefix',
+    'descr': 'descr',
+    'origin': 'origin_as',
+}
+
+
+def reference_parse(lines, source):
+    """ Line by line parser that gen_whois_route.parse_rr_objects() replaced
+
+    Kept as it was, other than returning the route tuples instead of building the
+    INSERT VALUES.  It removed quotes and backslashes since the values were put into
+    the SQL statement, which COPY does not need.
+
+    :param lines:       Iterable of the file lines as bytes
+    :param source:      Source of the data
+
+    :return: List of route tuples, see gen_whois_route.parse_rr_object()
+    """
+    routes = []
+    record = {'source': source}
+    recordComplete = False
+    prev_attr = ""
+
+    for line in lines:
+        line = line.decode("utf-8", "ignore")
+        line = line.rstrip('\n')
+        line = line.replace("\t", " ")
+
+        # empty line means record is complete
+        if len(line) == 0:
+            recordComplete = True
+
+        # Skip lines with a comment
+        elif line[0] == '#' or line[0] == '%':
+            continue
+
+        elif line[0] == ' ':
+            if prev_attr == 'descr':
+                # Line is a continuation of previous attribute
+                value = line.strip()
+                value = value.replace("'", "")
+                value = value.replace("\\", "")
+
+                record[REFERENCE_ATTR_MAP[prev_attr]] += "\n" + value
+
+        elif ': ' in line:
+            # Parse the attributes and build record
+            (attr, value) = line.split(': ', 1)
+            attr = attr.strip()
+            value = value.strip()
+            value = value.replace("'", "")
+            value = value.replace("\\", "")
+
+            if (attr == 'origin'):
+                # Strip off characters 'AS'
+                value = value[2:]
+
+                if ' ' in value:
+                    value = value.split(' ', 1)[0]
+
+                # Convert from dot notation back to numeric
+                if "." in value:
+                    a = value.split('.', 1)
+                    record[REFERENCE_ATTR_MAP[attr]] = (int(a[0]) << 16) + int(a[1])
+
+                else:
+                    record[REFERENCE_ATTR_MAP[attr]] = int(value)
+
+            elif (attr == 'route' or attr == 'route6'):
+                # Extract out the prefix_len
+                a = value.split('/')
+                record['prefix_len'] = int(a[1])
+                record[REFERENCE_ATTR_MAP[attr]] = a[0]
+
+            # allow appending duplicate attributes
+            elif (attr == 'descr' and REFERENCE_ATTR_MAP[attr] in record):
+                record[REFERENCE_ATTR_MAP[attr]] += ' \n' + value
+
+            elif (attr in REFERENCE_ATTR_MAP):
+                record[REFERENCE_ATTR_MAP[attr]] = value
+
+            prev_attr = attr
+
+        if recordComplete:
+            recordComplete = False
+
+            # Routes without a descr were not imported
+            if 'prefix' in record and len(record) > 4:
+                routes.append(("%s/%d" % (record['prefix'], record['prefix_len']), record['prefix_len'],
+                               record['origin_as'], record['descr'][:254], record['source']))
+
+            record = {'source': source}
+
+    return routes
+
+
+def imported_routes(routes):
+    """ Returns the routes that import_rr_db_file() imports, the same as the reference parser
+
+    :param routes:      Iterable of route tuples from gen_whois_route.parse_rr_objects()
+
+    :return: List of route tuples, with the characters removed that the reference parser removed
+    """
+    return [r[:3] + (r[3].replace("'", "").replace("\\", ""),) + r[4:]
+            for r in routes if r[0] != gen_whois_route.AUTNUM and r[3] is not None]
+
+
+class parseRrObjectsTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(SAMPLE_DB, 'rb') as f:
+            self.data = f.read()
+
+    def test_matches_reference(self):
+        expected = reference_parse(self.data.splitlines(keepends=True), 'radb')
+        routes = imported_routes(gen_whois_route.parse_rr_objects((self.data,), 'radb'))
+
+        self.assertEqual(len(expected), 10)
+        self.assertEqual(routes, expected)
+
+    def test_golden_values(self):
+        routes = {(r[0], r[2]): r for r in gen_whois_route.parse_rr_objects((self.data,), 'radb')}
+
+        self.assertEqual(routes[('192.0.2.0/24', 64496)], ('192.0.2.0/24', 24, 64496, 'Example Networks', 'radb'))
+        self.assertEqual(routes[('2001:db8::/32', 64497)][:4], ('2001:db8::/32', 32, 64497, 'Documentation prefix'))
+        self.assertEqual(routes[('198.51.100.0/24', 64498)][3], 'Tab separated')
+        self.assertEqual(routes[('203.0.113.0/24', 64499)][3],
+                         'First descr line\ncontinued on the next line \nSecond descr')
+        self.assertEqual(routes[('192.0.2.128/25', 65546)][3], 'Dot notation origin')
+        self.assertEqual(routes[('10.1.0.0/16', 64500)][3], 'Origin with a comment')
+        self.assertIsNone(routes[('10.2.0.0/16', 64501)][3])
+        self.assertEqual(routes[('10.3.0.0/16', 64502)][3], 'Café Unicode')
+        self.assertEqual(routes[('2001:db8:1::/48', 4200000000)][3], '')
+        self.assertEqual(routes[('10.4.0.0/16', 64503)][3], "O'Brien \\\\ Sons")
+
+    def test_chunk_boundaries(self):
+        expected = list(gen_whois_route.parse_rr_objects((self.data,), 'radb', autnum=True))
+
+        for size in (1, 7, 64, 333):
+            chunks = [self.data[i:i + size] for i in range(0, len(self.data), size)]
+            self.assertEqual(list(gen_whois_route.parse_rr_objects(chunks, 'radb', autnum=True)), expected)
+
+    def test_aligned_chunks(self):
+        expected = list(gen_whois_route.parse_rr_objects((self.data,), 'radb', autnum=True))
+        chunks = [self.data[i:i + 50] for i in range(0, len(self.data), 50)]
+
+        routes = []
+        for chunk in gen_whois_route.align_rr_chunks(chunks, size=200):
+            routes += gen_whois_route.parse_rr_chunk(chunk, 'radb', autnum=True)
+
+        self.assertEqual(routes, expected)
+
+    def test_autnum(self):
+        autnums = [r for r in gen_whois_route.parse_rr_objects((self.data,), 'radb', autnum=True)
+                   if r[0] == gen_whois_route.AUTNUM]
+
+        self.assertEqual(autnums, [(gen_whois_route.AUTNUM, 64496, 'EXAMPLE-AS', None, 'Example Networks', 'radb')])
+
+    def test_nrtm_object(self):
+        # NRTM objects are parsed from their lines, see mirror_rr_source()
+        lines = ['route:      203.0.113.0/24', 'descr:      First descr line',
+                 '            continued on the next line', 'origin:     AS64499', 'source:     RADB']
+
+        self.assertEqual(gen_whois_route.parse_rr_object('\n'.join(lines).encode('utf-8'), 'radb'),
+                         ('203.0.113.0/24', 24, 64499, 'First descr line\ncontinued on the next line', 'radb'))
+
+    def test_bad_object(self):
+        self.assertIsNone(gen_whois_route.parse_rr_object(b'route: 10.0.0.0\norigin: AS1\ndescr: x', 'radb'))
+        self.assertIsNone(gen_whois_route.parse_rr_object(b'route: 10.0.0.0/8\norigin: ASX\ndescr: x', 'radb'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+  Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+
+  This program and the accompanying materials are made available under the
+  terms of the Eclipse Public License v1.0 which accompanies this distribution,
+  and is available at http://www.eclipse.org/legal/epl-v10.html
+
+  Asyncio whois (port 43) client
+
+  ..see: https://www.rfc-editor.org/rfc/rfc3912
+"""
+import asyncio
+import re
+from time import monotonic
+
+#: Default whois port
+WHOIS_PORT = 43
+
+#: Default timeout in seconds for a whois query, including connect
+WHOIS_TIMEOUT = 30
+
+#: Default max number of concurrent queries per whois server
+WHOIS_CONCURRENCY = 2
+
+#: Default max queries per second per whois server
+WHOIS_RATE = 2.0
+
+#: Lowest rate in queries per second that a rate limited server is reduced to
+MIN_RATE = 0.1
+
+#: Max number of times a rate limited query is retried
+MAX_RETRIES = 3
+
+#: Initial and max pause in seconds of a server after it rate limits a query.  The pause
+#:    doubles for each consecutive rate limited response.
+BACKOFF_INITIAL = 10
+BACKOFF_MAX = 600
+
+#: Max number of referrals to follow for a query
+MAX_REFERRALS = 3
+
+#: Max size of a whois response
+MAX_RESPONSE_SIZE = 1024 * 1024
+
+#: Regex to find a referral to another whois server, such as ARIN 'ReferralServer: whois://whois.ripe.net'
+#:    or IANA 'refer: whois.ripe.net'.  rwhois referrals are not followed.
+RE_REFERRAL = re.compile(r'^\s*(?:ReferralServer|refer|whois):\s*(?:whois://)?([\w.-]+)(?::(\d+))?/?\s*$',
+                         re.M | re.I)
+
+#: Regex to find a rate limit or access control error in a response, such as RIPE/APNIC/AFRINIC
+#:    '%ERROR:201: access denied' or ARIN/LACNIC 'Query rate limit exceeded'
+RE_RATE_LIMIT = re.compile(r'^(?:%+\s*ERROR:20[12]\b'
+                           r'|[%#].*\b(?:rate limit|limit exceeded|access denied|too many)'
+                           r'|(?:query rate limit exceeded|too many (?:queries|requests|connections)))',
+                           re.M | re.I)
+
+
+class whoisRateLimited(Exception):
+    """ Query was rejected by the server due to a rate limit or access control """
+    pass
+
+
+class tokenBucket:
+    """ Token bucket rate limiter
+
+        Tokens are added at rate per second, up to burst tokens.  Each acquire takes a token.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = monotonic()
+
+    def setRate(self, rate):
+        self._refill()
+        self.rate = rate
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    async def acquire(self):
+        """ Waits for and takes a token """
+        while True:
+            self._refill()
+
+            if (self.tokens >= 1):
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class whoisHost:
+    """ Limits for a whois server
+
+        The rate is reduced and the server is paused when it rate limits a query.  The
+        rate is increased back to the max rate as queries succeed.
+    """
+
+    def __init__(self, concurrency, rate):
+        self.maxRate = rate
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = tokenBucket(rate)
+        self.pausedUntil = 0
+        self.backoff = BACKOFF_INITIAL
+
+    async def wait(self):
+        """ Waits until a query can be sent to the server """
+        pause = self.pausedUntil - monotonic()
+        if (pause > 0):
+            await asyncio.sleep(pause)
+
+        await self.bucket.acquire()
+
+    def limited(self):
+        """ Server rate limited a query, halve the rate and pause the server """
+        self.bucket.setRate(max(MIN_RATE, self.bucket.rate / 2))
+        self.pausedUntil = max(self.pausedUntil, monotonic() + self.backoff)
+        self.backoff = min(BACKOFF_MAX, self.backoff * 2)
+
+    def succeeded(self):
+        """ Server answered a query, step the rate back up """
+        if (self.bucket.rate < self.maxRate):
+            self.bucket.setRate(min(self.maxRate, self.bucket.rate + self.maxRate / 20))
+
+        self.backoff = BACKOFF_INITIAL
+
+
+class whoisClient:
+    """ Asyncio whois client
+
+        Queries to the same server are limited to a number of concurrent queries and
+        a rate in queries per second.  Each server has its own limits.
+    """
+
+    def __init__(self, concurrency=WHOIS_CONCURRENCY, timeout=WHOIS_TIMEOUT, rate=WHOIS_RATE, rates=None):
+        """ Constructor
+
+            :param concurrency:     Max number of concurrent queries per server
+            :param timeout:         Timeout in seconds for a query
+            :param rate:            Max queries per second per server
+            :param rates:           Dictionary of max queries per second by hostname, overrides rate
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.rate = rate
+        self.rates = {host.lower(): r for (host, r) in (rates or {}).items()}
+        self.hosts = {}
+
+    def hostKey(self, host, port):
+        return "%s:%d" % (host.lower(), port)
+
+    def host(self, host, port=WHOIS_PORT):
+        """ Gets the limits for a server
+
+            :param host:        whois server hostname
+            :param port:        whois server port
+
+            :return: whoisHost instance
+        """
+        key = self.hostKey(host, port)
+        if key not in self.hosts:
+            self.hosts[key] = whoisHost(self.concurrency, self.rates.get(host.lower(), self.rate))
+
+        return self.hosts[key]
+
+    async def query(self, host, query, port=WHOIS_PORT):
+        """ Queries a whois server
+
+            :param host:        whois server hostname
+            :param query:       Query, without the line ending
+            :param port:        whois server port
+
+            :return: Response text
+            :raises OSError: if the connection fails
+            :raises asyncio.TimeoutError: if the query times out
+            :raises whoisRateLimited: if the query is still rate limited after retries
+        """
+        limits = self.host(host, port)
+
+        for attempt in range(MAX_RETRIES + 1):
+            async with limits.semaphore:
+                await limits.wait()
+
+                try:
+                    response = await asyncio.wait_for(self._query(host, query, port), self.timeout)
+
+                # Some servers drop the connection instead of returning an error
+                except ConnectionResetError:
+                    response = None
+
+            if (response is not None and not RE_RATE_LIMIT.search(response)):
+                limits.succeeded()
+                return response
+
+            limits.limited()
+
+        raise whoisRateLimited("%s rate limited query %s" % (host, query))
+
+    async def _query(self, host, query, port):
+        (reader, writer) = await asyncio.open_connection(host, port)
+
+        try:
+            writer.write(("%s\r\n" % query).encode('utf-8'))
+            await writer.drain()
+
+            data = b''
+
+            while len(data) < MAX_RESPONSE_SIZE:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+
+                data += chunk
+
+            return data.decode('utf-8', 'ignore')
+
+        finally:
+            writer.close()
+
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def queryReferrals(self, host, query, port=WHOIS_PORT, maxReferrals=MAX_REFERRALS):
+        """ Queries a whois server and follows the referrals to other servers
+
+            :param host:            whois server hostname
+            :param query:           Query, without the line ending
+            :param port:            whois server port
+            :param maxReferrals:    Max number of referrals to follow
+
+            :return: List of tuples of (host, response text), in the order they were queried.
+                     The last entry is the most specific response.
+        """
+        responses = []
+        queried = set()
+
+        while True:
+            queried.add(self.hostKey(host, port))
+            response = await self.query(host, query, port)
+            responses.append((host, response))
+
+            m = RE_REFERRAL.search(response)
+            if (not m or len(responses) > maxReferrals):
+                break
+
+            (host, port) = (m.group(1), int(m.group(2) or WHOIS_PORT))
+
+            if (self.hostKey(host, port) in queried):
+                break
+
+        return responses
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+  Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+
+  This program and the accompanying materials are made available under the
+  terms of the Eclipse Public License v1.0 which accompanies this distribution,
+  and is available at http://www.eclipse.org/legal/epl-v10.html
+
+  Schedules whois lookups with a queue per whois server
+
+  A lookup tries a list of servers in order.  Each server has its own queue and
+  workers, so a slow or rate limited server does not hold up lookups that are
+  waiting on other servers.
+"""
+import asyncio
+
+from whoisClient import whoisRateLimited
+
+
+class whoisLookup:
+    """ Lookup in progress """
+
+    def __init__(self, key, hosts, future):
+        self.key = key
+        self.hosts = hosts
+        self.index = 0
+        self.future = future
+
+
+class whoisScheduler:
+    """ Whois lookup scheduler
+
+        Lookups are done by queryFunc(host, key), which returns the result or None
+        if the host does not have it.  The number of workers per host should match the
+        concurrency of the client, which does the rate limiting.
+    """
+
+    def __init__(self, queryFunc, workers):
+        """ Constructor
+
+            :param queryFunc:   Coroutine function of (host, key) that returns the result or None
+            :param workers:     Number of workers per host
+        """
+        self.queryFunc = queryFunc
+        self.workers = workers
+        self.queues = {}
+        self.tasks = []
+
+    def queue(self, host):
+        """ Gets the queue for a host, starting its workers if needed """
+        if host not in self.queues:
+            self.queues[host] = asyncio.Queue()
+
+            for i in range(self.workers):
+                self.tasks.append(asyncio.create_task(self._worker(host)))
+
+        return self.queues[host]
+
+    def pending(self):
+        """ Returns a dictionary of the number of queued lookups by host """
+        return {host: queue.qsize() for (host, queue) in self.queues.items()}
+
+    async def lookup(self, key, hosts):
+        """ Lookup the key by trying the hosts in order
+
+            :param key:         Key to lookup, passed to queryFunc
+            :param hosts:       List of hosts to try, in order
+
+            :return: tuple of (host, result), (None, None) if no host has the key
+        """
+        if (not hosts):
+            return None, None
+
+        lookup = whoisLookup(key, hosts, asyncio.get_running_loop().create_future())
+        self.queue(hosts[0]).put_nowait(lookup)
+
+        return await lookup.future
+
+    async def _worker(self, host):
+        queue = self.queues[host]
+
+        while True:
+            lookup = await queue.get()
+
+            try:
+                result = await self.queryFunc(host, lookup.key)
+
+            except (OSError, asyncio.TimeoutError, whoisRateLimited) as err:
+                print("%s: whois %s failed: %r" % (lookup.key, host, err))
+                result = None
+
+            except Exception as err:
+                lookup.future.set_exception(err)
+                continue
+
+            if (result):
+                lookup.future.set_result((host, result))
+
+            # Try the next host
+            else:
+                lookup.index += 1
+
+                if (lookup.index < len(lookup.hosts)):
+                    self.queue(lookup.hosts[lookup.index]).put_nowait(lookup)
+                else:
+                    lookup.future.set_result((None, None))
+
+    async def close(self):
+        """ Stops the workers """
+        for task in self.tasks:
+            task.cancel()
+
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queues = {}
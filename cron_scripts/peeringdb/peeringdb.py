@@ -6,13 +6,20 @@
   .. moduleauthor:: Tim Evens <tievens@cisco.com>
 """
 import click
-import psycopg2 # postgres connector
 import requests
 import json
+import os.path
+import sys
 import time # time the sync
 import logging
 from random import randint
 
+# dbHandler.py is shared with cron_scripts/gen-whois.  It is installed next to this script,
+#    or is found in the source tree.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gen-whois'))
+
+import dbHandler
+
 
 # setup logging
 log_format = ('[%(asctime)s] %(levelname)-8s %(name)-12s %(message)s')
@@ -36,8 +43,10 @@ MAX_BULK = 1000
 
 # Upsert bulk query
 UPSERT_INFO_ASN = {
-    "insert": "INSERT INTO info_asn (asn, as_name, org_id, org_name, remarks, address, city, state_prov, postal_code, country, source)",
-    "values":  "VALUES ",
+    "table": "info_asn",
+    "columns": ("asn", "as_name", "org_id", "org_name", "remarks", "address", "city", "state_prov", "postal_code",
+                "country", "source"),
+    "distinct": ("asn",),
     "conflict": (" ON CONFLICT (asn) DO UPDATE SET "
                  "   as_name=excluded.as_name,org_id=excluded.org_id,org_name=excluded.org_name,remarks=excluded.remarks,"
                  "   address=excluded.address,city=excluded.city,state_prov=excluded.state_prov,postal_code=excluded.postal_code,"
@@ -46,9 +55,10 @@ UPSERT_INFO_ASN = {
 }
 
 UPSERT_PDB_IX_PEERS = {
-    "insert": ("INSERT INTO pdb_exchange_peers (ix_id,ix_name,ix_prefix_v4,ix_prefix_v6,rs_peer,peer_name,peer_ipv4,peer_ipv6,peer_asn,"
-               "speed,policy,poc_policy_email,poc_noc_email,ix_city,ix_country,ix_region) "),
-    "values": "VALUES ",
+    "table": "pdb_exchange_peers",
+    "columns": ("ix_id", "ix_name", "ix_prefix_v4", "ix_prefix_v6", "rs_peer", "peer_name", "peer_ipv4", "peer_ipv6",
+                "peer_asn", "speed", "policy", "poc_policy_email", "poc_noc_email", "ix_city", "ix_country", "ix_region"),
+    "distinct": ("ix_id", "peer_ipv4", "peer_ipv6"),
     "conflict": (" ON CONFLICT (ix_id,peer_ipv4,peer_ipv6) DO UPDATE SET "
                  "   ix_name=excluded.ix_name, ix_prefix_v4=excluded.ix_prefix_v4,ix_prefix_v6=excluded.ix_prefix_v6,"
                  "   rs_peer=excluded.rs_peer,peer_name=excluded.peer_name,peer_asn=excluded.peer_asn,"
@@ -63,11 +73,8 @@ class apiDb:
     """ Peering DB API class to import data from Peering DB to OBMP postgres
     """
 
-    #: Connection handle
-    conn = None
-
-    #: Cursor handle
-    cursor = None
+    #: dbHandler instance
+    db = None
 
     #: PeeringDB ORGs as dictionary
     pdb_orgs = None
@@ -100,9 +107,8 @@ class apiDb:
     def connect_db(self):
         logger.info(f"Connecting to postgres {self.pghost}/{self.pgdatabase}")
         # setup DB connection
-        self.conn = psycopg2.connect(database=self.pgdatabase, user=self.pguser,
-                                     password=self.pgpassword, host=self.pghost)
-        self.cursor = self.conn.cursor()
+        self.db = dbHandler.dbHandler()
+        self.db.connectDb(self.pguser, self.pgpassword, self.pghost, self.pgdatabase)
 
         logger.info(f"Connected to postgres {self.pghost}/{self.pgdatabase}")
 
@@ -111,9 +117,9 @@ class apiDb:
             logger.error(f"DB error: {error}")
             logger.info(f"DB query: {query}")
 
-        if self.conn:
+        if self.db:
             logger.info("Close DB")
-            self.conn.close()
+            self.db.close()
 
     def api_get(self, url):
         """ Gets JSON from URL response and returns dictionary of result
@@ -289,13 +295,13 @@ class apiDb:
                 logger.debug(f"Skipping non operational: {entry}")
                 continue
 
-            ix_name = entry['name'].replace("'", "''")
+            ix_name = entry['name']
             ix_id = entry['ix_id']
-            peer_ipv4 = f"'{entry['ipaddr4']}'" if entry['ipaddr4'] else "'0.0.0.0'"
-            peer_ipv6 = f"'{entry['ipaddr6']}'" if entry['ipaddr6'] else "'::'"
+            peer_ipv4 = entry['ipaddr4'] if entry['ipaddr4'] else "0.0.0.0"
+            peer_ipv6 = entry['ipaddr6'] if entry['ipaddr6'] else "::"
 
             # If both ipv4 and ipv6 are null/empty peer IPs, then skip
-            if peer_ipv4 == "'0.0.0.0'" and peer_ipv6 == "'::'":
+            if peer_ipv4 == "0.0.0.0" and peer_ipv6 == "::":
                 logger.debug(f"Skipping null IPs: {entry}")
                 continue
 
@@ -303,22 +309,22 @@ class apiDb:
             speed = entry['speed']
             rs_peer = entry['is_rs_peer']
 
-            ix_city = self.pdb_ixs[entry['ix_id']]['city'].replace("'", "''")
+            ix_city = self.pdb_ixs[entry['ix_id']]['city']
             ix_country = self.pdb_ixs[entry['ix_id']]['country']
-            ix_region = self.pdb_ixs[entry['ix_id']]['region_continent'].replace("'", "''")
+            ix_region = self.pdb_ixs[entry['ix_id']]['region_continent']
 
-            ix_prefix_v4 = "null"
-            ix_prefix_v6 = "null"
+            ix_prefix_v4 = None
+            ix_prefix_v6 = None
             poc_noc_email = ""
             poc_policy_email = ""
 
             try:
-                ix_prefix_v4 = f"'{self.pdb_ix_pfxs['v4'][entry['ixlan_id']]['prefix']}'"
+                ix_prefix_v4 = self.pdb_ix_pfxs['v4'][entry['ixlan_id']]['prefix']
             except:
                 pass
 
             try:
-                ix_prefix_v6 = f"'{self.pdb_ix_pfxs['v6'][entry['ixlan_id']]['prefix']}'"
+                ix_prefix_v6 = self.pdb_ix_pfxs['v6'][entry['ixlan_id']]['prefix']
             except:
                 pass
 
@@ -332,7 +338,7 @@ class apiDb:
             except:
                 pass
 
-            peer_name = f"{self.pdb_nets[entry['net_id']]['name']} | {self.pdb_nets[entry['net_id']]['aka']}".replace("'", "")
+            peer_name = f"{self.pdb_nets[entry['net_id']]['name']} | {self.pdb_nets[entry['net_id']]['aka']}"
             policy = self.pdb_nets[entry['net_id']]['policy_general']
 
             # bulk update
@@ -344,9 +350,9 @@ class apiDb:
                 logger.info(f"IX Peer Time: {t2}, number of peers processed: {processed}")
 
             # Append value to bulk update
-            value=(f"({ix_id}, '{ix_name}', {ix_prefix_v4}::inet, {ix_prefix_v6}::inet, {rs_peer}, '{peer_name[:254]}',"
-                   f"{peer_ipv4}::inet, {peer_ipv6}::inet, '{peer_asn}', '{speed}', '{policy}',"
-                   f"'{poc_policy_email}','{poc_noc_email}','{ix_city[:128]}','{ix_country}','{ix_region[:128]}')")
+            value=(ix_id, ix_name[:128], ix_prefix_v4, ix_prefix_v6, rs_peer, peer_name[:254],
+                   peer_ipv4, peer_ipv6, peer_asn, speed, policy,
+                   poc_policy_email, poc_noc_email, ix_city[:128], ix_country, ix_region[:128])
 
             values_list.append(value)
 
@@ -374,18 +380,17 @@ class apiDb:
         values_list = []
         for entry in self.pdb_nets.values():
             asn = entry['asn']
-            as_name=entry['name'][:240].replace("'", "''")
-            aka=entry['aka'][:240].replace("'", "''")
-            org_name=f"{as_name} - {aka}"[:240].replace("'", "''")
+            as_name=entry['name'][:240]
+            aka=entry['aka'][:240]
+            org_name=f"{as_name} - {aka}"[:240]
 
-            route_server=entry['route_server'][:240].replace("'", "''")
-            looking_glass=entry['looking_glass'][:240].replace("'", "''")
+            route_server=entry['route_server'][:240]
+            looking_glass=entry['looking_glass'][:240]
             notes=entry['notes'][:1500]
 
             remarks = f"route_server: {route_server}\n" if len(route_server) > 1 else ""
             remarks += f"looking_glass: {looking_glass}" if len(looking_glass) > 1 else ""
             remarks += f"{notes}"
-            remarks = remarks.replace("'", "''")
 
             # pull out Org_ID
             org_id = entry['org_id']
@@ -396,10 +401,10 @@ class apiDb:
 
             address1 = self.pdb_orgs[org_id]['address1'][:250]
             address2 = self.pdb_orgs[org_id]['address2'][:250]
-            address = f"{address1}, {address2}"[:240].replace("'", "''") # need to join address1 and 2 for DB
-            city = self.pdb_orgs[org_id]['city'][:240].replace("'", "''")
-            state_prov = self.pdb_orgs[org_id]['state'][:240].replace("'", "''")
-            country = self.pdb_orgs[org_id]['country'][:240].replace("'", "''")
+            address = f"{address1}, {address2}"[:240] # need to join address1 and 2 for DB
+            city = self.pdb_orgs[org_id]['city'][:240]
+            state_prov = self.pdb_orgs[org_id]['state'][:240]
+            country = self.pdb_orgs[org_id]['country'][:240]
             postal_code = self.pdb_orgs[org_id]['zipcode'][:200]
 
             # bulk update
@@ -411,8 +416,8 @@ class apiDb:
                 logger.info(f"Time: {t2}, number of AS processed: {processed}")
 
             # Append value to bulk update
-            value=(f"({asn}, '{as_name}', '{org_id}', '{org_name}', '{remarks}', '{address}',"
-                   f"'{city}', '{state_prov}', '{postal_code}', '{country}', 'peeringdb')")
+            value=(asn, as_name, org_id, org_name, remarks, address,
+                   city, state_prov, postal_code, country, 'peeringdb')
             values_list.append(value)
 
         # Insert last entries
@@ -425,24 +430,14 @@ class apiDb:
         logger.info(f"ASN Import from PeeringDB successful: processed: {len(self.pdb_nets)}, time: {t2}")
 
     def upsert(self, upsert, values_list):
-        try:
-            values = ','.join(values_list)
-            upsert_stmt= upsert['insert'] + upsert['values'] + values + upsert['conflict']
-
-            logger.debug(f"sql: {upsert_stmt}")
-
-            self.cursor.execute (upsert_stmt)
-            self.conn.commit()
-        
-        except (Exception, psycopg2.IntegrityError) as error:
-            self.conn.rollback()
-            logger.error(f"PSQL error: {error}")
-            logger.debug(upsert_stmt)
-
-        except (Exception, psycopg2.DatabaseError) as error:
-            self.conn.rollback()
-            logger.error(f"PSQL error: {error}")
-            logger.debug(upsert_stmt)
+        """ Bulk upsert rows, see dbHandler.bulkUpsert()
+
+            :param upsert:          Upsert definition, such as UPSERT_INFO_ASN
+            :param values_list:     List of row tuples in the order of the upsert columns
+        """
+        if not self.db.bulkUpsert(upsert['table'], upsert['columns'], values_list, upsert['conflict'],
+                                  distinctOn=upsert['distinct']):
+            logger.error(f"Failed to upsert {len(values_list)} rows into {upsert['table']}")
 
 
 @click.command(context_settings=dict(help_option_names=['-h', '--help'], max_content_width=200))
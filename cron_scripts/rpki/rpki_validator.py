@@ -19,14 +19,50 @@ from time import time
 # Global variables
 # ----------------------------------------------------------------
 
+#: rpki_validator columns, in the order of the loaded row tuples
+RPKI_COLUMNS = ('prefix', 'prefix_len', 'prefix_len_max', 'origin_as')
+
+#: Staging table that the export snapshot is loaded into before merging
+RPKI_STAGING_TABLE = 'rpki_validator_staging'
+
+#: Creates and clears the staging table
+QUERY_PREPARE_STAGING = (
+    "CREATE UNLOGGED TABLE IF NOT EXISTS %s (LIKE rpki_validator INCLUDING DEFAULTS);"
+    "TRUNCATE %s" % (RPKI_STAGING_TABLE, RPKI_STAGING_TABLE)
+)
+
+#: Applies the difference between the staging table and rpki_validator, in one transaction
+QUERY_MERGE_STAGING = (
+    "ANALYZE %(staging)s;"
+    "DELETE FROM rpki_validator r"
+    "  WHERE NOT EXISTS (SELECT 1 FROM %(staging)s s"
+    "                      WHERE s.prefix = r.prefix AND s.prefix_len_max = r.prefix_len_max"
+    "                        AND s.origin_as = r.origin_as);"
+    "INSERT INTO rpki_validator (prefix,prefix_len,prefix_len_max,origin_as)"
+    "  SELECT DISTINCT ON (prefix,prefix_len_max,origin_as) prefix,prefix_len,prefix_len_max,origin_as"
+    "    FROM %(staging)s s"
+    "    WHERE NOT EXISTS (SELECT 1 FROM rpki_validator r"
+    "                        WHERE r.prefix = s.prefix AND r.prefix_len_max = s.prefix_len_max"
+    "                          AND r.origin_as = s.origin_as)"
+    "  ON CONFLICT (prefix,prefix_len_max,origin_as) DO NOTHING;"
+    "TRUNCATE %(staging)s" % {'staging': RPKI_STAGING_TABLE}
+)
+
 
 # ----------------------------------------------------------------
 # Functions
 # ----------------------------------------------------------------
 def load_export(db, server, rpkiuser, rpkipassword):
+    """ Load the RPKI validator export into the staging table
+
+    :param db:              DbAccess reference
+    :param server:          RPKI validator export URL
+    :param rpkiuser:        RPKI server username
+    :param rpkipassword:    RPKI server password
+
+    :return: Number of ROAs loaded, None if error
+    """
     urllib3.disable_warnings()
-    query_begin = 'INSERT INTO rpki_validator (prefix, prefix_len, prefix_len_max, origin_as) VALUES '
-    query_end = ' ON CONFLICT (prefix,prefix_len_max,origin_as) DO UPDATE SET timestamp=now()'
 
     # get json data
     data = []
@@ -42,35 +78,36 @@ def load_export(db, server, rpkiuser, rpkipassword):
         json_response = json.loads(req)
         data = json_response['roas'] # json
 
-    except requests.exceptions.RequestException as e:
-        print ("Error connecting to rpki server: %r") % err
-        return 
+    except requests.exceptions.RequestException as err:
+        print ("Error connecting to rpki server: %r" % err)
+        return None
 
-    query = query_begin
     count = 0
+    rows = []
     for line in data:
-
-        if count > 0:
-            query += ','
-
         asn, prefix_full, max_length = line['asn'], line['prefix'], line['maxLength']
         # remove the characters "AS", some RPKI vendors include this in their data
         asn = asn.replace('AS','')
 
         prefix, prefix_len = prefix_full.split('/')[0], prefix_full.split('/')[1]
 
-        query += "('%s'::inet, %d, %d, %d)" % (prefix_full, int(prefix_len), int(max_length), int(asn))
-        count += 1
+        rows.append((prefix_full, int(prefix_len), int(max_length), int(asn)))
+
+        if (len(rows) >= 20000):    # Bulk copy
+            if not db.bulkCopy(RPKI_STAGING_TABLE, RPKI_COLUMNS, rows):
+                return None
 
-        if (count > 200):    # Bulk insert/upset
-            db.queryNoResults(query + query_end)
-            query = query_begin
-            count = 0
+            count += len(rows)
+            rows = []
 
-    # process remaining items in the query
-    if query.endswith(','):
-        query = query[:-1]
-        db.queryNoResults(query + query_end)
+    # process remaining items
+    if len(rows):
+        if not db.bulkCopy(RPKI_STAGING_TABLE, RPKI_COLUMNS, rows):
+            return None
+
+        count += len(rows)
+
+    return count
 
 
 def parseCmdArgs(argv):
@@ -198,12 +235,23 @@ def main():
     server = cfg['server']
     rpkiuser = cfg['rpkiuser']
     rpkipassword = cfg['rpkipassword']
-    load_export(db, server, rpkiuser, rpkipassword);
-    print ("Loaded rpki roas")
 
-    # Purge old entries that didn't get updated
-    db.queryNoResults("DELETE FROM rpki_validator WHERE timestamp < now() - interval '1 hour'")
-    print("purged old roas")
+    # Load the export snapshot into the staging table
+    db.queryNoResults(QUERY_PREPARE_STAGING)
+    count = load_export(db, server, rpkiuser, rpkipassword);
+
+    if not count:
+        print("ERROR: No rpki roas loaded, rpki_validator is unchanged")
+        db.close()
+        sys.exit(1)
+
+    print ("Loaded %d rpki roas into staging" % count)
+
+    # Apply only the added and removed roas to rpki_validator
+    if db.queryNoResults(QUERY_MERGE_STAGING):
+        print("Merged rpki roas in %r seconds" % db.last_query_time)
+
+    db.close()
 
     print("Done")
 
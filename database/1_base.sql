@@ -431,7 +431,27 @@ CREATE TABLE info_asn (
 );
 
 
+-- Table structure for table info_asn_lookup
+--    Last lookup of each ASN by gen_whois_asn.py.  An ASN is not looked up again until
+--    next_attempt, which grows exponentially with the number of consecutive misses.
+--    Databases created before schema 2.3.0 are upgraded by upgrade/2.2.0-to-2.3.0.sql.
+DROP TABLE IF EXISTS info_asn_lookup CASCADE;
+CREATE TABLE info_asn_lookup (
+    asn                     bigint              NOT NULL,
+    last_attempt            timestamp           without time zone default (now() at time zone 'utc') NOT NULL,
+    next_attempt            timestamp           without time zone NOT NULL,
+    outcome                 varchar(16)         NOT NULL,
+    source                  varchar(64)         DEFAULT NULL,
+    misses                  int                 NOT NULL DEFAULT 0,
+    PRIMARY KEY (asn)
+);
+CREATE INDEX ON info_asn_lookup (next_attempt);
+
+
 -- Table structure for table info_route (based on whois)
+--    Partitioned by source. gen_whois_route.py builds a new partition for each source
+--    and swaps it with the existing one (info_route_<source>) on import.
+--    Databases created before schema 2.2.0 are upgraded by upgrade/2.1.0-to-2.2.0.sql.
 DROP TABLE IF EXISTS info_route CASCADE;
 CREATE TABLE info_route (
     prefix                  inet                NOT NULL,
@@ -440,12 +460,14 @@ CREATE TABLE info_route (
     origin_as               bigint              NOT NULL,
     source                  varchar(32)         NOT NULL,
     timestamp               timestamp           without time zone default (now() at time zone 'utc') NOT NULL,
-    PRIMARY KEY (prefix,prefix_len,origin_as)
-);
+    PRIMARY KEY (prefix,prefix_len,origin_as,source)
+) PARTITION BY LIST (source);
 CREATE INDEX ON info_route (origin_as);
 CREATE INDEX ON info_route USING GIST (prefix inet_ops);
 CREATE INDEX ON info_route (prefix inet_ops);
 
+CREATE TABLE info_route_default PARTITION OF info_route DEFAULT;
+
 -- Table structure for table peering DB peerings by exchange
 DROP TABLE IF EXISTS pdb_exchange_peers CASCADE;
 CREATE TABLE pdb_exchange_peers (
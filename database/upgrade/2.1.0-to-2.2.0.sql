@@ -0,0 +1,64 @@
+-- -----------------------------------------------------------------------
+-- Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+--
+-- Upgrade schema 2.1.0 to 2.2.0
+--
+--    info_route is partitioned by source and source is part of the primary key.
+--    The existing routes are moved to the default partition.  The next import of each
+--    source by gen_whois_route.py replaces them with the source partition.
+--
+--    Run once against an existing 2.1.0 database, with gen_whois_route.py stopped:
+--        psql -v ON_ERROR_STOP=1 -f 2.1.0-to-2.2.0.sql
+-- -----------------------------------------------------------------------
+
+BEGIN;
+
+SET LOCAL lock_timeout = '60s';
+
+LOCK TABLE info_route IN ACCESS EXCLUSIVE MODE;
+
+-- Keep the old table until the routes are copied, its index names are freed for the new table
+ALTER TABLE info_route RENAME TO info_route_old;
+ALTER TABLE info_route_old RENAME CONSTRAINT info_route_pkey TO info_route_old_pkey;
+ALTER INDEX IF EXISTS info_route_origin_as_idx RENAME TO info_route_old_origin_as_idx;
+ALTER INDEX IF EXISTS info_route_prefix_idx RENAME TO info_route_old_prefix_idx;
+ALTER INDEX IF EXISTS info_route_prefix_idx1 RENAME TO info_route_old_prefix_idx1;
+
+-- Same as 1_base.sql
+CREATE TABLE info_route (
+    prefix                  inet                NOT NULL,
+    prefix_len              smallint            NOT NULL DEFAULT 0,
+    descr                   text,
+    origin_as               bigint              NOT NULL,
+    source                  varchar(32)         NOT NULL,
+    timestamp               timestamp           without time zone default (now() at time zone 'utc') NOT NULL,
+    PRIMARY KEY (prefix,prefix_len,origin_as,source)
+) PARTITION BY LIST (source);
+CREATE INDEX ON info_route (origin_as);
+CREATE INDEX ON info_route USING GIST (prefix inet_ops);
+CREATE INDEX ON info_route (prefix inet_ops);
+
+CREATE TABLE info_route_default PARTITION OF info_route DEFAULT;
+
+INSERT INTO info_route (prefix,prefix_len,descr,origin_as,source,timestamp)
+    SELECT prefix,prefix_len,descr,origin_as,source,timestamp FROM info_route_old;
+
+-- Copy the grants of the old table
+DO $$
+DECLARE
+    g record;
+BEGIN
+    FOR g IN SELECT a.privilege_type,
+                    CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END AS grantee
+               FROM pg_class c, aclexplode(c.relacl) a
+               WHERE c.oid = 'info_route_old'::regclass AND a.grantee <> c.relowner
+    LOOP
+        EXECUTE format('GRANT %s ON info_route TO %s', g.privilege_type, g.grantee);
+    END LOOP;
+END $$;
+
+DROP TABLE info_route_old;
+
+COMMIT;
+
+ANALYZE info_route;
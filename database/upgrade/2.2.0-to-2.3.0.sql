@@ -0,0 +1,42 @@
+-- -----------------------------------------------------------------------
+-- Copyright (c) 2022 Cisco Systems, Inc. and others.  All rights reserved.
+--
+-- Upgrade schema 2.2.0 to 2.3.0
+--
+--    Adds info_asn_lookup, the lookup cache of gen_whois_asn.py.  The table starts empty,
+--    so the first run after the upgrade looks up every ASN as before.  It gets the same
+--    grants as info_asn.
+--
+--    Run once against an existing 2.2.0 database, with gen_whois_asn.py stopped:
+--        psql -v ON_ERROR_STOP=1 -f 2.2.0-to-2.3.0.sql
+-- -----------------------------------------------------------------------
+
+BEGIN;
+
+-- Same as 1_base.sql
+CREATE TABLE info_asn_lookup (
+    asn                     bigint              NOT NULL,
+    last_attempt            timestamp           without time zone default (now() at time zone 'utc') NOT NULL,
+    next_attempt            timestamp           without time zone NOT NULL,
+    outcome                 varchar(16)         NOT NULL,
+    source                  varchar(64)         DEFAULT NULL,
+    misses                  int                 NOT NULL DEFAULT 0,
+    PRIMARY KEY (asn)
+);
+CREATE INDEX ON info_asn_lookup (next_attempt);
+
+-- Copy the grants of info_asn
+DO $$
+DECLARE
+    g record;
+BEGIN
+    FOR g IN SELECT a.privilege_type,
+                    CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END AS grantee
+               FROM pg_class c, aclexplode(c.relacl) a
+               WHERE c.oid = 'info_asn'::regclass AND a.grantee <> c.relowner
+    LOOP
+        EXECUTE format('GRANT %s ON info_asn_lookup TO %s', g.privilege_type, g.grantee);
+    END LOOP;
+END $$;
+
+COMMIT;
@@ -14,11 +14,9 @@ wget -O /tmp/dbip.csv.gz https://download.db-ip.com/free/dbip-city-lite-$(date "
 echo $?
 
 if [[ $? == 0 ]]; then
-    echo "decompress db-ip CSV"
-    gzip -d /tmp/dbip.csv.gz
-
+    # The CSV is decompressed while it is imported
     echo "Running geo csv import script"
-    /usr/local/openbmp/geo-csv-to-psql.py --db_ip_file /tmp/dbip.csv
+    /usr/local/openbmp/geo-csv-to-psql.py --swap --db_ip_file /tmp/dbip.csv.gz
 else
     echo "ERROR: Failed to download dbip-city-lite-2022-06.csv.gz"
     exit 1
@@ -17,21 +17,30 @@
   sudo pip3 install psycopg2
   sudo pip3 install netaddr
   sudo pip3 install click
+
+  Install cron_scripts/gen-whois/dbHandler.py and gzipReader.py in the same directory as this script.
 """
 import logging
 import click
 import netaddr
 import csv
+import io
 import os.path
-import psycopg2 as py
-from time import time
+import sys
+
+# dbHandler.py and gzipReader.py are shared with cron_scripts/gen-whois.  They are installed
+#    next to this script, or are found in the source tree.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cron_scripts', 'gen-whois'))
+
+import dbHandler
+import gzipReader
 
 # Set logger
 logging.basicConfig(format='%(asctime)s | %(levelname)-8s | %(name)s[%(lineno)s] | %(message)s', level=logging.INFO)
 LOG = logging.getLogger("geo-csv-to-psql")
 
-SQL_INSERT = ("INSERT INTO geo_ip (family,ip,city,stateprov,country,latitude,longitude,"
-              "timezone_offset, timezone_name, isp_name) VALUES ")
+GEO_IP_COLUMNS = ('family', 'ip', 'city', 'stateprov', 'country', 'latitude', 'longitude',
+                  'timezone_offset', 'timezone_name', 'isp_name')
 
 SQL_CONFLICT = (" ON CONFLICT (ip) DO UPDATE SET "
                 " city=excluded.city, stateprov=excluded.stateprov,"
@@ -39,181 +48,156 @@ SQL_CONFLICT = (" ON CONFLICT (ip) DO UPDATE SET "
                 " timezone_name=excluded.timezone_name,"
                 " country=excluded.country, latitude=excluded.latitude, longitude=excluded.longitude;")
 
-
-class dbHandler:
-    """ Database handler class
-
-        This class handles the database access methods.
+#: Max number of rows to bulk insert at once
+MAX_BULK_ROWS = 50000
+
+#: Shadow table that is loaded and then swapped in as geo_ip
+GEO_IP_SHADOW = "geo_ip_new"
+
+#: Indexes built on the shadow table after it is loaded, keyed by index name suffix.  The
+#:    index names are renamed from <shadow table>_<suffix> to geo_ip_<suffix> on swap.
+GEO_IP_INDEXES = {
+    "pkey": "CREATE UNIQUE INDEX {name} ON {table} (ip)",
+    "stateprov_idx": "CREATE INDEX {name} ON {table} (stateprov)",
+    "country_idx": "CREATE INDEX {name} ON {table} (country)",
+    "family_idx": "CREATE INDEX {name} ON {table} (family)",
+    "ip_gist_idx": "CREATE INDEX {name} ON {table} USING GIST (ip inet_ops)",
+    "ip_hash_idx": "CREATE INDEX {name} ON {table} USING HASH (ip)",
+}
+
+#: Views that depend on geo_ip and their definitions
+SQL_GEO_IP_VIEWS = ("SELECT DISTINCT v.oid::regclass::text, pg_get_viewdef(v.oid)"
+                    "  FROM pg_depend d"
+                    "       JOIN pg_rewrite r ON (r.oid = d.objid)"
+                    "       JOIN pg_class v ON (v.oid = r.ev_class)"
+                    "  WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = 'geo_ip'::regclass"
+                    "        AND v.oid <> 'geo_ip'::regclass")
+
+#: Privileges granted on a relation to roles other than the owner
+SQL_RELATION_GRANTS = ("SELECT a.privilege_type,"
+                       "       CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END"
+                       "  FROM pg_class c, aclexplode(c.relacl) a"
+                       "  WHERE c.oid = '%s'::regclass AND a.grantee <> c.relowner")
+
+
+def open_csv(filename, gzip_backend=None):
     """
+    Open a CSV file for reading, decompressing it if it ends in .gz
 
-    #: Connection handle
-    conn = None
-
-    #: Cursor handle
-    cursor = None
-
-    #: Last query time in seconds (floating point)
-    last_query_time = 0
-
-    def __init__(self):
-        pass
-
-    def connectDb(self, user, pw, host, database):
-        """
-         Connect to database
-        """
-        try:
-            self.conn = py.connect(user=user, password=pw,
-                                   host=host,
-                                   database=database)
-
-            self.cursor = self.conn.cursor()
-
-        except py.ProgrammingError as err:
-            LOG.error("Connect failed: %s", str(err))
-            raise err
-
-    def close(self):
-        """ Close the database connection """
-        if (self.cursor):
-            self.cursor.close()
-            self.cursor = None
-
-        if (self.conn):
-            self.conn.close()
-            self.conn = None
-
-    def createTable(self, tableName, tableSchema, dropIfExists = True):
-        """ Create table schema
-
-            :param tablename:    The table name that is being created
-            :param tableSchema:  Create table syntax as it would be to create it in SQL
-            :param dropIfExists: True to drop the table, false to not drop it.
-
-            :return: True if the table successfully was created, false otherwise
-        """
-        if (not self.cursor):
-            LOG.error("Looks like psql is not connected, try to reconnect.")
-            return False
-
-        try:
-            if (dropIfExists == True):
-                self.cursor.execute("DROP TABLE IF EXISTS %s" % tableName)
+    :param filename:        CSV filename
+    :param gzip_backend:    Backend to decompress the file, see gzipReader.selectBackend()
 
-            self.cursor.execute(tableSchema)
-
-        except py.ProgrammingError as err:
-            LOG.error("Failed to create table - %s", str(err))
-            #raise err
-
-
-        return True
-
-    def createTable(self, tableName, tableSchema, dropIfExists = True):
-        """ Create table schema
+    :return: Text file object
+    """
+    if not filename.endswith(".gz"):
+        return open(filename, "r", newline='')
 
-            :param tablename:    The table name that is being created
-            :param tableSchema:  Create table syntax as it would be to create it in SQL
-            :param dropIfExists: True to drop the table, false to not drop it.
+    backend = gzipReader.selectBackend(gzip_backend)
+    LOG.info(f"Decompressing {filename} using {backend}")
 
-            :return: True if the table successfully was created, false otherwise
-        """
-        if (not self.cursor):
-            LOG.error("Looks like psql is not connected, try to reconnect.")
-            return False
+    return io.TextIOWrapper(gzipReader.openGzip(filename, backend), encoding='utf-8', newline='')
 
-        try:
-            if (dropIfExists == True):
-                self.cursor.execute("DROP TABLE IF EXISTS %s" % tableName)
 
-            self.cursor.execute(tableSchema)
+def write_rows(db, rows, shadow=False):
+    """
+    Write a batch of geo_ip rows, either upserted into geo_ip or copied into the shadow table
 
-        except py.ProgrammingError as err:
-            LOG.error("Failed to create table - %s", str(err))
-            #raise err
-            return False
+    :param db:          Connected DB handler or writer pool
+    :param rows:        List of row tuples in the order of GEO_IP_COLUMNS
+    :param shadow:      True to copy into the shadow table
+    """
+    if shadow:
+        db.bulkCopy(GEO_IP_SHADOW, GEO_IP_COLUMNS, rows)
+    else:
+        db.bulkUpsert("geo_ip", GEO_IP_COLUMNS, rows, SQL_CONFLICT, distinctOn=('ip',))
 
-        return True
 
-    def query(self, query, queryParams=None):
-        """ Run a query and return the result set back
+def prepare_shadow_table(db):
+    """
+    Create an empty shadow table without indexes, seeded with the default geo_ip entries
 
-            :param query:       The query to run - should be a working SELECT statement
-            :param queryParams: Dictionary of parameters to supply to the query for
-                                variable substitution
+    :param db:          Connected DB handler
 
-            :return: Returns "None" if error, otherwise array list of rows
-        """
-        if (not self.cursor):
-            LOG.error("Looks like psql is not connected, try to reconnect")
-            return None
+    :return: True if success, None on Error
+    """
+    return db.queryNoResults(f"DROP TABLE IF EXISTS {GEO_IP_SHADOW};"
+                             f"CREATE TABLE {GEO_IP_SHADOW} (LIKE geo_ip INCLUDING DEFAULTS);"
+                             f"INSERT INTO {GEO_IP_SHADOW} SELECT * FROM geo_ip WHERE ip IN ('0.0.0.0/0', '::/0')")
 
-        try:
-            startTime = time()
 
-            if (queryParams):
-                self.cursor.execute(query % queryParams)
-            else:
-                self.cursor.execute(query)
+def build_shadow_indexes(db):
+    """
+    Remove duplicate prefixes from the loaded shadow table, build its indexes and analyze it
 
-            self.last_query_time = time() - startTime
+    The indexes are queued to the writers so they are built in parallel when there is more
+    than one writer.  CONCURRENTLY is not needed since nothing reads the shadow table yet.
 
-            rows = []
+    :param db:          Writer pool used to load the shadow table
+    """
+    db.flush()
 
-            while (True):
-                result = self.cursor.fetchmany(size=10000)
-                if (len(result) > 0):
-                    rows += result
-                else:
-                    break
+    LOG.info("Removing duplicate prefixes from shadow table")
+    db.queryNoResults(f"DELETE FROM {GEO_IP_SHADOW} a USING {GEO_IP_SHADOW} b"
+                      f"  WHERE a.ip = b.ip AND a.ctid < b.ctid")
+    db.flush()
 
-            return rows
+    LOG.info("Building shadow table indexes")
+    for suffix, index in GEO_IP_INDEXES.items():
+        db.queryNoResults(index.format(name=f"{GEO_IP_SHADOW}_{suffix}", table=GEO_IP_SHADOW))
+    db.flush()
 
-        except py.ProgrammingError as err:
-            LOG.error("query failed - %s", str(err))
-            return None
+    db.queryNoResults(f"ALTER TABLE {GEO_IP_SHADOW} ADD CONSTRAINT {GEO_IP_SHADOW}_pkey"
+                      f"  PRIMARY KEY USING INDEX {GEO_IP_SHADOW}_pkey;"
+                      f"ANALYZE {GEO_IP_SHADOW}")
+    db.flush()
 
-    def queryNoResults(self, query, queryParams=None):
-        """ Runs a query that would normally not have any results, such as insert, update, delete
 
-            :param query:       The query to run - should be a working INSERT or UPDATE statement
-            :param queryParams: Dictionary of parameters to supply to the query for
-                                variable substitution
+def swap_shadow_table(db):
+    """
+    Swap the shadow table in as geo_ip in a single transaction
 
-            :return: Returns True if successful, false if not.
-        """
-        if (not self.cursor):
-            LOG.error("Looks like psql is not connected, try to reconnect")
-            return None
+    Views that depend on geo_ip are recreated and the grants on geo_ip and the views
+    are copied, since they are bound to the old table.
 
-        try:
-            startTime = time()
+    :param db:          Connected DB handler
 
-            if (queryParams):
-                self.cursor.execute(query % queryParams)
-            else:
-                self.cursor.execute(query)
+    :return: True if success, None on Error
+    """
+    views = db.query(SQL_GEO_IP_VIEWS)
 
-            self.conn.commit()
+    if views is None:
+        return None
 
-            self.last_query_time = time() - startTime
+    grants = []
+    for rel in ['geo_ip'] + [v[0] for v in views]:
+        for (privilege, grantee) in db.query(SQL_RELATION_GRANTS % rel) or []:
+            grants.append(f"GRANT {privilege} ON {rel} TO {grantee}")
 
-            return True
+    stmts = ["SET LOCAL lock_timeout = '60s'",
+             "LOCK TABLE geo_ip IN ACCESS EXCLUSIVE MODE"]
+    stmts += [f"DROP VIEW {name}" for (name, definition) in views]
+    stmts += ["DROP TABLE geo_ip",
+              f"ALTER TABLE {GEO_IP_SHADOW} RENAME TO geo_ip",
+              f"ALTER TABLE geo_ip RENAME CONSTRAINT {GEO_IP_SHADOW}_pkey TO geo_ip_pkey"]
+    stmts += [f"ALTER INDEX {GEO_IP_SHADOW}_{suffix} RENAME TO geo_ip_{suffix}"
+              for suffix in GEO_IP_INDEXES if suffix != 'pkey']
+    stmts += [f"CREATE VIEW {name} AS {definition.strip().rstrip(';')}" for (name, definition) in views]
+    stmts += grants
 
-        except py.ProgrammingError as err:
-            LOG.error("query failed - %s", str(err))
-            #print("   QUERY: %s", query)
-            return None
+    LOG.info("Swapping shadow table in as geo_ip")
+    return db.queryNoResults(';'.join(stmts))
 
 
-def import_maxmind_csv(db, mm_loc, mm_ipv4, mm_ipv6):
+def import_maxmind_csv(db, mm_loc, mm_ipv4, mm_ipv6, shadow=False, gzip_backend=None):
     """
     import MaxMind City CSV Lite into OBMP postgres DB
 
-    :param db:          Connected DB handler
+    :param db:          Connected DB handler or writer pool
     :param mm_loc:      GeoLite2-City-Locations-en.csv
     :param mm_ipv4:     GeoLite2-City-Blocks-IPv4.csv
     :param mm_ipv6:     GeoLite2-City-Blocks-IPv6.csv
+    :param shadow:      True to load into the shadow table instead of geo_ip
+    :param gzip_backend: Backend to decompress .gz files, see gzipReader.selectBackend()
 
     :return: True if success, False on Error
     """
@@ -233,13 +217,11 @@ def import_maxmind_csv(db, mm_loc, mm_ipv4, mm_ipv6):
 
     # Load locations into memory
     # geoname_id,locale_code,continent_code,continent_name,country_iso_code,country_name,subdivision_1_iso_code,subdivision_1_name,subdivision_2_iso_code,subdivision_2_name,city_name,metro_code,time_zone,is_in_european_union
-    with open(mm_loc, "r") as lf:
-        lf.readline()
-        line=lf.readline()
-        while line and len(line) > 0:
-            stripped_line=line.rstrip('\n').replace("'", "")
-            r = [ '{}'.format(x) for x in list(csv.reader([stripped_line], delimiter=',', quotechar='"'))[0] ]
+    with open_csv(mm_loc, gzip_backend) as lf:
+        reader = csv.reader(lf, delimiter=',', quotechar='"')
+        next(reader, None)
 
+        for r in reader:
             key = r[0] # geoname_id
             entry = {
                 "country": r[4],
@@ -251,128 +233,90 @@ def import_maxmind_csv(db, mm_loc, mm_ipv4, mm_ipv6):
 
             locations[key] = entry
 
-            line=lf.readline()
-
     for f in [ mm_ipv4, mm_ipv6 ]:
         LOG.info(f"Processing {f}")
-        count = 0
-        sql_values=""
+        rows = []
         line_count = 0
 
-        with open(f, "r") as ib:
-            ib.readline()
-            line=ib.readline()
-            while line and len(line) > 0:
-                stripped_line=line.rstrip('\n').replace("'", "")
-                r = [ '{}'.format(x) for x in list(csv.reader([stripped_line], delimiter=',', quotechar='"'))[0] ]
+        with open_csv(f, gzip_backend) as ib:
+            reader = csv.reader(ib, delimiter=',', quotechar='"')
+            next(reader, None)
+
+            for r in reader:
+                line_count += 1
 
                 try:
                     loc = locations[r[1]]
                 except KeyError as e:
                     LOG.warning(f"Prefix missing geoname_id '{r[1]}': {r}")
-                    line=ib.readline()
-                    line_count += 1
                     continue
 
-                if count:
-                    sql_values += ','
-
-                sql_values += f"({4 if '.' in r[0] else 6},"
-                sql_values += f"'{r[0]}','{loc['city']}','{loc['stateprov']}','{loc['country']}',"
-                sql_values += f"{r[7]},{r[8]},0,'{loc['tz_name']}','')"
-                count += 1
-
-                line=ib.readline()
-                line_count += 1
+                rows.append((4 if '.' in r[0] else 6, r[0], loc['city'], loc['stateprov'], loc['country'],
+                             r[7], r[8], 0, loc['tz_name'], ''))
 
                 # bulk insert
-                if count >= 3000:
-                    LOG.info(f"Inserting {count} records, line count {line_count}")
+                if len(rows) >= MAX_BULK_ROWS:
+                    LOG.info(f"Inserting {len(rows)} records, line count {line_count}")
 
-                    try:
-                        db.queryNoResults(SQL_INSERT + sql_values + SQL_CONFLICT)
-                    except:
-                        LOG.error("Trying to insert again due to exception")
-                        db.queryNoResults(SQL_INSERT + sql_values + SQL_CONFLICT)
+                    write_rows(db, rows, shadow)
 
-                    sql_values = ""
-                    count = 0
+                    rows = []
 
             # insert the last batch
-            if len(sql_values) > 0:
-                try:
-                    LOG.info(f"Inserting last batch, count {count}, line count {line_count}")
-                    db.queryNoResults(SQL_INSERT + sql_values + SQL_CONFLICT)
-                except:
-                    LOG.error("Trying to insert again due to exception")
-                    db.queryNoResults(SQL_INSERT + sql_values + SQL_CONFLICT)
+            if len(rows) > 0:
+                LOG.info(f"Inserting last batch, count {len(rows)}, line count {line_count}")
+
+                write_rows(db, rows, shadow)
 
     return True
 
 
-def import_dbip_csv(db, in_file):
+def import_dbip_csv(db, in_file, shadow=False, gzip_backend=None):
     """
     import DB-IP CSV Lite Format - https://db-ip.com/db/download/ip-to-city-lite into OBMP Postgres DB
 
-    :param db:          Connected DB handler
+    :param db:          Connected DB handler or writer pool
     :param in_file:     DB-IP File to load
+    :param shadow:      True to load into the shadow table instead of geo_ip
+    :param gzip_backend: Backend to decompress a .gz file, see gzipReader.selectBackend()
 
     :return: True if success, False on Error
     """
     total_count = 0
-    count=0
-    line_count=1
-    sql_values=""
-
-    with open(in_file, "r") as inf:
-        line=inf.readline()
-        while line and len(line) > 0:
-            stripped_line=line.rstrip('\n').replace("'", "")
-            r = [ '{}'.format(x) for x in list(csv.reader([stripped_line], delimiter=',', quotechar='"'))[0] ]
+    line_count=0
+    rows = []
+
+    with open_csv(in_file, gzip_backend) as inf:
+        reader = csv.reader(inf, delimiter=',', quotechar='"')
+
+        for r in reader:
+            line_count += 1
             ip_list=netaddr.iprange_to_cidrs(r[0], r[1])
             addr_type = 4 if '.' in r[0] else 6
 
             # DB-IP specifies ranges like 1.1.1.18 - 1.1.1.50.  ip_list will be the specific CIDRs that includes
             #   all the IPs in the range.  This is why a single entry will end up being multiple CIDRs.
             for ip in ip_list:
-                if count:
-                    sql_values += ','
-
-                sql_values += "(%d, '%s', '%s', '%s', '%s', %s, %s," % (addr_type,
-                                                                        ip,
-                                                                        r[5].encode('ascii', 'ignore').decode('ascii'),
-                                                                        r[4].encode('ascii', 'ignore').decode('ascii'),
-                                                                        r[3],
-                                                                        r[6], r[7]);
-                sql_values += "0, 'UTC', '') "
-                count += 1
-
-            line=inf.readline()
-            line_count += 1
+                rows.append((addr_type, str(ip),
+                             r[5].encode('ascii', 'ignore').decode('ascii'),
+                             r[4].encode('ascii', 'ignore').decode('ascii'),
+                             r[3], r[6], r[7], 0, 'UTC', ''))
 
             # bulk insert
-            if count >= 4000:
-                total_count += count
-                LOG.info(f"Inserting {count} records, total {total_count}, line count {line_count}")
+            if len(rows) >= MAX_BULK_ROWS:
+                total_count += len(rows)
+                LOG.info(f"Inserting {len(rows)} records, total {total_count}, line count {line_count}")
 
-                try:
-                    db.queryNoResults(SQL_INSERT + sql_values + SQL_CONFLICT)
-                except:
-                    LOG.error("Trying to insert again due to exception")
-                    db.queryNoResults(SQL_INSERT + sql_values + SQL_CONFLICT)
+                write_rows(db, rows, shadow)
 
-                sql_values = ""
-                count = 0
+                rows = []
 
         # insert the last batch
-        if len(sql_values) > 0:
-            total_count += count
-            try:
-                LOG.info(f"Inserting last batch, count {count}, total {total_count}, line count {line_count}")
-                db.queryNoResults(SQL_INSERT + sql_values + SQL_CONFLICT)
-            except:
-                LOG.error("Trying to insert again due to exception")
-                db.queryNoResults(SQL_INSERT + sql_values + SQL_CONFLICT)
+        if len(rows) > 0:
+            total_count += len(rows)
+            LOG.info(f"Inserting last batch, count {len(rows)}, total {total_count}, line count {line_count}")
+
+            write_rows(db, rows, shadow)
 
     return True
 
@@ -390,7 +334,7 @@ def import_dbip_csv(db, in_file):
               help="Postgres Database name",
               metavar="<string>", default="openbmp")
 @click.option('--db_ip_file', 'db_ip_file',
-              help="DB-IP CSV DB-IP City Lite filename",
+              help="DB-IP CSV DB-IP City Lite filename, can be gzip compressed (.gz)",
               metavar="<string>", default=None)
 @click.option('--maxmind_loc_file', 'mm_loc_file',
               help="MaxMind GeoLite2-City-Locations CSV filename",
@@ -401,14 +345,28 @@ def import_dbip_csv(db, in_file):
 @click.option('--maxmind_ipv6_file', 'mm_ipv6_file',
               help="MaxMind GeoLite2-City-Blocks-IPv6 CSV filename",
               metavar="<string>", default=None)
+@click.option('-w', '--writers', 'writers',
+              help="Number of parallel DB writers/connections",
+              metavar="<int>", type=int, default=1)
+@click.option('-s', '--swap', 'swap',
+              help="Load into a new table and swap it in as geo_ip, which also removes stale ranges",
+              is_flag=True, default=False)
+@click.option('-z', '--gzip', 'gzip_backend',
+              help="Backend to decompress .gz files, auto selects the fastest available",
+              type=click.Choice(('auto',) + gzipReader.BACKENDS), default='auto')
 # @click.option('-f', '--flush', 'flush_routes',
 #               help="Flush routing table(s) at startup",
 #               is_flag=True, default=False)
-def main(pghost, pguser, pgpassword, pgdatabase, db_ip_file, mm_loc_file, mm_ipv4_file, mm_ipv6_file):
-    db = dbHandler()
-
+def main(pghost, pguser, pgpassword, pgdatabase, db_ip_file, mm_loc_file, mm_ipv4_file, mm_ipv6_file, writers, swap,
+         gzip_backend):
     success = True
 
+    try:
+        gzip_backend = gzipReader.selectBackend(gzip_backend)
+    except ValueError as err:
+        LOG.fatal(str(err))
+        exit(1)
+
     if db_ip_file:
         LOG.info(f"Importing DB-IP City Lite {db_ip_file}...")
 
@@ -416,12 +374,6 @@ def main(pghost, pguser, pgpassword, pgdatabase, db_ip_file, mm_loc_file, mm_ipv
             LOG.fatal(f"CSV file '{db_ip_file}' does not exist, cannot continue")
             exit(1)
 
-        db.connectDb(pguser, pgpassword, pghost, pgdatabase)
-
-        success = import_dbip_csv(db, db_ip_file)
-
-        db.close()
-
     else:
         if not mm_loc_file:
             LOG.fatal("Missing --maxmind_loc_file. Locations file is required in order to import.")
@@ -435,9 +387,47 @@ def main(pghost, pguser, pgpassword, pgdatabase, db_ip_file, mm_loc_file, mm_ipv
 
         LOG.info("Importing MaxMind GeoIP2 City Lite files ...")
 
+    if swap:
+        db = dbHandler.dbHandler()
         db.connectDb(pguser, pgpassword, pghost, pgdatabase)
 
-        success = import_maxmind_csv(db, mm_loc_file, mm_ipv4_file, mm_ipv6_file)
+        if not prepare_shadow_table(db):
+            LOG.fatal("Unable to create shadow table, cannot continue")
+            exit(3)
+
+    # Batches are written by write-behind threads while the CSV is parsed
+    pool = dbHandler.dbWriterPool(pguser, pgpassword, pghost, pgdatabase, writers)
+
+    try:
+        if db_ip_file:
+            success = import_dbip_csv(pool, db_ip_file, swap, gzip_backend)
+        else:
+            success = import_maxmind_csv(pool, mm_loc_file, mm_ipv4_file, mm_ipv6_file, swap, gzip_backend)
+
+        # Wait for the queued batches so that failed batches are counted
+        pool.flush()
+
+        if pool.failed():
+            LOG.error(f"{pool.failed()} batches failed to import")
+            success = False
+
+        if success and swap:
+            build_shadow_indexes(pool)
+
+        pool.close()
+
+    except Exception:
+        LOG.exception("Import failed")
+        success = False
+
+    if swap:
+        if success:
+            success = swap_shadow_table(db)
+
+        # Never swap in a partial table, geo_ip is left as is
+        if not success:
+            LOG.error(f"Dropping shadow table {GEO_IP_SHADOW}, geo_ip is unchanged")
+            db.queryNoResults(f"DROP TABLE IF EXISTS {GEO_IP_SHADOW}")
 
         db.close()
 